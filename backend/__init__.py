@@ -62,8 +62,8 @@ def create_app():
     LOGGER.debug("Backend web service registering shutdown function...")
     atexit.register(shutdown)
 
-    # start the background threads
-    start_threads()
+    # create the event the background threads terminate on
+    init_threads()
 
     app = Flask(__name__, static_url_path="")
 
@@ -110,29 +110,44 @@ def shutdown():
         LOGGER.debug("%s joined", thread)
 
 
-def start_threads():
+def init_threads():
     """
-    Start all threads and create events.
+    Create the event the background threads terminate on. The threads are
+    started by the web app with start_thread, so the daemons importing the
+    package don't run them as well.
     """
-    # start all background threads
-    GLOBALS["threads"] = [threading.Thread(target=update_ip_thread)]
+    GLOBALS["threads"] = []
 
     # create a signal they'll terminate on
     GLOBALS["thread_event"] = threading.Event()
 
-    for thread in GLOBALS["threads"]:
-        LOGGER.debug("Starting %s", thread)
-        thread.start()
+
+def start_thread(target, *args):
+    """
+    Start a background thread that's joined on shutdown. The target is given
+    the event signalling shutdown, followed by args.
+
+    :param target: the thread's function
+    :return: the thread
+    """
+    thread = threading.Thread(target=target, args=(GLOBALS["thread_event"], *args))
+    thread.daemon = True
+    LOGGER.debug("Starting %s", thread)
+    thread.start()
+    GLOBALS["threads"].append(thread)
+    return thread
 
 
-def update_ip_thread():
+def update_ip_thread(event):
     """
     Update the public website with the IP for this device.
+
+    :param event: the event signalling shutdown
     """
     last_good_ip = "1.2.3.4"
     last_send = time.time()
     while True:
-        if GLOBALS["thread_event"].wait(INTERVAL):
+        if event.wait(INTERVAL):
             LOGGER.debug("Signalled. Tearing down.")
             return
 
@@ -12,7 +12,7 @@ import base64
 import argparse
 
 # project imports
-from backend import flask_app, api, views, db, models
+from backend import flask_app, api, views, db, models, thumbnails, dedup
 from . import LOGGER, shutdown
 
 api.add_resource(views.Images, "/api/images")
@@ -20,6 +20,12 @@ api.add_resource(views.DeleteImage, "/api/images/<int:_id>")
 api.add_resource(views.Login, "/api/login")
 api.add_resource(views.Logout, "/api/logout")
 api.add_resource(views.TokenRefresh, "/api/refresh")
+api.add_resource(views.StreamStats, "/api/stream/stats")
+api.add_resource(views.Clips, "/api/clips")
+api.add_resource(views.CaptureJobs, "/api/captures/<int:_id>")
+api.add_resource(views.Schedules, "/api/schedules")
+api.add_resource(views.DeleteSchedule, "/api/schedules/<int:_id>")
+api.add_resource(views.Timelapses, "/api/timelapses")
 
 
 def add_default_user():
@@ -92,6 +98,20 @@ if __name__ == "__main__":
         help="just init database and do nothing else",
     )
 
+    parser.add_argument(
+        "--backfill-thumbnails",
+        action="store_true",
+        required=False,
+        help="make the thumbnails of captures without them and exit",
+    )
+
+    parser.add_argument(
+        "--backfill-hashes",
+        action="store_true",
+        required=False,
+        help="hash the captures without a perceptual hash and exit",
+    )
+
     args = parser.parse_args()
 
     init_db(drop_all=args.dropall)
@@ -99,6 +119,16 @@ if __name__ == "__main__":
         shutdown()
         sys.exit(0)
 
+    if args.backfill_thumbnails:
+        LOGGER.info("Backfilled %d thumbnails", thumbnails.backfill(flask_app))
+        shutdown()
+        sys.exit(0)
+
+    if args.backfill_hashes:
+        LOGGER.info("Backfilled %d hashes", dedup.backfill(flask_app))
+        shutdown()
+        sys.exit(0)
+
     LOGGER.info("Running app in debug mode from Flask")
 
     try:
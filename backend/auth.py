@@ -0,0 +1,121 @@
+"""
+Login throttling and password checks. Attempts are throttled per client
+address and per account before any hashing is done, and the hashing itself is
+limited to a few workers at a time, so a burst of logins can't hold every
+worker and stall the gallery.
+"""
+
+# standard imports
+import base64
+import fcntl
+import math
+import os
+import time
+
+# installed imports
+import bcrypt
+
+# project imports
+from backend.logger import LOGGER
+from backend.models import LoginBucket
+
+# login attempts allowed per minute from one client address, and per account
+LOGIN_ADDRESS_PER_MINUTE = int(os.environ.get("PICAM_LOGIN_ADDRESS_PER_MINUTE", 10))
+LOGIN_ACCOUNT_PER_MINUTE = int(os.environ.get("PICAM_LOGIN_ACCOUNT_PER_MINUTE", 5))
+
+# password checks running at once across all worker processes
+HASH_SLOTS = int(os.environ.get("PICAM_HASH_SLOTS", 2))
+
+# lock files of the slots, one per slot with the slot's index appended
+HASH_SLOT_PATH = os.environ.get("PICAM_HASH_SLOT_PATH", "/tmp/picam_hash_slot")
+
+# seconds a login waits for a free slot before being turned away
+HASH_SLOT_WAIT = 2.0
+HASH_SLOT_POLL_INTERVAL = 0.02
+
+GLOBALS = {"dummy_hash": None}
+
+
+def throttle(address, email, now=None):
+    """
+    Take a token from the attempt's address and account buckets.
+
+    :param address: the client's address
+    :param email: the account's email
+    :param now: unix time of the attempt, defaults to the current time
+    :return: seconds to wait before trying again, None if the attempt is
+             allowed.
+    """
+    for key, per_minute in (
+        (f"address:{address}", LOGIN_ADDRESS_PER_MINUTE),
+        (f"account:{email.lower()}", LOGIN_ACCOUNT_PER_MINUTE),
+    ):
+        if not LoginBucket.take(key, per_minute, per_minute / 60, now):
+            LOGGER.error("Throttled login attempt for %s", key)
+            return math.ceil(60 / per_minute)
+    return None
+
+
+def prune_buckets(now=None):
+    """
+    Delete the login buckets that are full again, which a minute without
+    attempts refills.
+
+    :param now: unix time to prune up to, defaults to the current time
+    :return: number of buckets pruned
+    """
+    return LoginBucket.prune(60, now)
+
+
+def dummy_hash():
+    """
+    A hash checked for unknown emails, so they take as long to reject as
+    wrong passwords.
+    """
+    if GLOBALS["dummy_hash"] is None:
+        GLOBALS["dummy_hash"] = bcrypt.hashpw(b"dummy", bcrypt.gensalt())
+    return GLOBALS["dummy_hash"]
+
+
+def acquire_slot(wait=HASH_SLOT_WAIT):
+    """
+    Lock one of the hash slots, waiting for one to free up.
+
+    :param wait: seconds to wait for a slot
+    :return: the locked slot's file descriptor, None if no slot freed up.
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        for index in range(HASH_SLOTS):
+            # a descriptor per attempt, so threads of a process exclude each
+            # other as well as other processes
+            descriptor = os.open(f"{HASH_SLOT_PATH}{index}", os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return descriptor
+            except BlockingIOError:
+                os.close(descriptor)
+        if time.monotonic() > deadline:
+            return None
+        time.sleep(HASH_SLOT_POLL_INTERVAL)
+
+
+def check_password(password, user):
+    """
+    Check a password in a hash slot. Unknown users are checked against a
+    dummy hash so they are as slow to reject as known ones.
+
+    :param password: the plaintext password
+    :param user: the User logging in, None if the email is unknown
+    :return: a tuple of whether the password matches and an error message,
+             which is None if the password could be checked.
+    """
+    hashed = base64.b64decode(user.password) if user is not None else dummy_hash()
+    descriptor = acquire_slot(HASH_SLOT_WAIT)
+    if descriptor is None:
+        return False, "Too many logins in progress, try again later"
+    try:
+        matches = bcrypt.checkpw(password.encode(), hashed)
+    finally:
+        os.close(descriptor)
+    return matches and user is not None, None
@@ -0,0 +1,3 @@
+"""
+Benchmarks and load tests, run with python -m backend.bench.<name>
+"""
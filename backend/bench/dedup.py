@@ -0,0 +1,77 @@
+"""
+Benchmark for perceptual hashing. Reports the time to hash the test image as
+a 1024x768 capture, decoded at a reduced scale next to a full decode, and the
+time to backfill the hashes of a throwaway database's captures with one
+thread and with the configured workers.
+
+    python -m backend.bench.dedup --images 500
+"""
+
+# standard imports
+import argparse
+import os
+import tempfile
+import time
+
+# installed imports
+import numpy
+from PIL import Image as PILImage
+
+# project imports
+from backend import flask_app, db, app, dedup
+from backend.bench.images import timed
+from backend.camera import TEST_SRC_IMAGE_PATH
+from backend.models import Image
+
+
+def full_decode_hash(path):
+    """
+    The same hash as dedup.image_hash, from a full resolution decode.
+    """
+    with PILImage.open(path) as image:
+        image = image.convert("L")
+    grid = image.resize((dedup.HASH_SIZE + 1, dedup.HASH_SIZE), PILImage.BILINEAR)
+    pixels = numpy.asarray(grid, dtype=numpy.int16)
+    return numpy.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes().hex()
+
+
+def main():
+    """
+    Parse the arguments and run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--images", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "capture.jpg")
+        with PILImage.open(TEST_SRC_IMAGE_PATH) as image:
+            image.convert("RGB").resize((1024, 768)).save(path, "JPEG", quality=85)
+        reduced = timed(lambda: dedup.image_hash(path), args.repeat)
+        full = timed(lambda: full_decode_hash(path), args.repeat)
+        print(f"reduced decode: {reduced:.1f} ms")
+        print(f"full decode:    {full:.1f} ms")
+
+        flask_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+            directory, "bench.db"
+        )
+        app.init_db(drop_all=True)
+        flask_app.debug = True
+        for workers in (1, dedup.HASH_WORKERS):
+            with flask_app.app_context():
+                Image.query.delete()
+                db.session.add_all(Image(url=path) for _ in range(args.images))
+                db.session.commit()
+            dedup.HASH_WORKERS = workers
+            start = time.perf_counter()
+            done = dedup.backfill(flask_app)
+            seconds = time.perf_counter() - start
+            print(f"backfill, {workers} workers: {done} captures in {seconds:.2f} s")
+        db.session.remove()
+        db.get_engine(flask_app).dispose()
+    os._exit(0)  # pylint: disable=protected-access
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark for deleting images. Seeds a throwaway sqlite database and capture
+directory, then reports the time to delete images one request at a time next
+to one bulk delete request, and the time the unlinker takes to remove the bulk
+deleted files after the response.
+
+    python -m backend.bench.delete --images 10000 --delete 300
+"""
+
+# standard imports
+import argparse
+import os
+import tempfile
+import time
+
+# installed imports
+from flask_jwt_extended import create_access_token
+
+# project imports
+from backend import flask_app, db, app, storage
+from backend.bench.images import seed
+from backend.models import Image
+from backend.views import GLOBALS
+
+
+def write_captures(directory):
+    """
+    Point the images at files in directory, with a thumbnail each.
+    """
+    for (_id,) in Image.query.with_entities(Image.id):
+        path = os.path.join(directory, f"{_id}.jpg")
+        for name in (path, storage.derived_path(path, storage.THUMB_SUFFIX)):
+            with open(name, "wb") as output:
+                output.write(b"\0" * 1024)
+    db.session.execute(
+        "UPDATE image SET url = :directory || '/' || id || '.jpg'",
+        {"directory": directory},
+    )
+    db.session.commit()
+
+
+def main():
+    """
+    Parse the arguments and run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--images", type=int, default=10000)
+    parser.add_argument("--delete", type=int, default=300)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        flask_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+            directory, "bench.db"
+        )
+        app.init_db(drop_all=True)
+        flask_app.debug = True
+        with flask_app.app_context():
+            seed(args.images)
+            write_captures(directory)
+            token = create_access_token(identity="bench@picam")
+
+        with flask_app.test_client() as client:
+            client.set_cookie("/", "access_token_cookie", token)
+
+            start = time.perf_counter()
+            for _id in range(1, args.delete + 1):
+                client.delete(f"/api/images/{_id}")
+            GLOBALS["unlinker"].join()
+            one_at_a_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            ids = list(range(args.delete + 1, 2 * args.delete + 1))
+            deleted = client.delete("/api/images", json={"ids": ids}).json["deleted"]
+            bulk = time.perf_counter() - start
+            GLOBALS["unlinker"].join()
+            unlinked = time.perf_counter() - start
+        db.session.remove()
+        db.get_engine(flask_app).dispose()
+
+    print(f"images:        {args.images}")
+    print(f"one at a time: {args.delete} requests in {one_at_a_time * 1000:.0f} ms")
+    print(f"bulk:          {deleted} images in {bulk * 1000:.0f} ms")
+    print(f"unlinked:      after {unlinked * 1000:.0f} ms")
+    os._exit(0)  # pylint: disable=protected-access
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Benchmark for listing images. Seeds a throwaway sqlite database and reports
+the cost of the old full list next to the first page, a deep page and a date
+filtered page of the keyset paginated list.
+
+    python -m backend.bench.images --images 100000
+"""
+
+# standard imports
+import argparse
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# project imports
+from backend import flask_app, db, app
+from backend.models import Image
+
+# rows inserted per statement when seeding
+SEED_BATCH_SIZE = 10000
+
+
+def seed(count):
+    """
+    Insert count images, one a minute ending now.
+    """
+    start = datetime.utcnow() - timedelta(minutes=count)
+    for first in range(0, count, SEED_BATCH_SIZE):
+        db.session.bulk_insert_mappings(
+            Image,
+            [
+                {
+                    "url": f"static/captures/{index}.jpg",
+                    "created_on": start + timedelta(minutes=index),
+                }
+                for index in range(first, min(first + SEED_BATCH_SIZE, count))
+            ],
+        )
+    db.session.commit()
+
+
+def timed(function, repeat):
+    """
+    Run function repeat times.
+
+    :return: milliseconds per run
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    """
+    Parse the arguments and run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--images", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        flask_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+            directory, "bench.db"
+        )
+        app.init_db(drop_all=True)
+        with flask_app.app_context():
+            seed(args.images)
+            middle = Image.query.get(args.images // 2)
+
+            def full_list():
+                return [x.as_json() for x in Image.query.order_by(Image.id.desc())]
+
+            results = {
+                "full list": timed(full_list, args.repeat),
+                "first page": timed(Image.page, args.repeat),
+                "deep page": timed(
+                    lambda: Image.page(before_id=middle.id), args.repeat
+                ),
+                "one day": timed(
+                    lambda: Image.page(
+                        since=middle.created_on,
+                        until=middle.created_on + timedelta(days=1),
+                    ),
+                    args.repeat,
+                ),
+            }
+        db.session.remove()
+        db.get_engine(flask_app).dispose()
+
+    print(f"images:     {args.images}")
+    for name, milliseconds in results.items():
+        print(f"{name + ':':<11} {milliseconds:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Load test for the live stream. Opens many viewers at once and reports how
+many got frames, to check the viewer count isn't limited by the worker count.
+
+    python -m backend.bench.load_stream --viewers 200 --socket /tmp/picam_stream.sock
+    python -m backend.bench.load_stream --viewers 200 --host pi-cam.com --port 8080
+"""
+
+# standard imports
+import argparse
+import asyncio
+import time
+
+BOUNDARY = b"--frame"
+
+
+async def viewer(args, deadline):
+    """
+    Watch the stream until the deadline.
+
+    :return: the number of frames received, None if the stream failed.
+    """
+    frames = 0
+    try:
+        if args.socket:
+            reader, writer = await asyncio.open_unix_connection(args.socket)
+        else:
+            reader, writer = await asyncio.open_connection(args.host, args.port)
+        writer.write(
+            f"GET {args.path} HTTP/1.1\r\nHost: {args.host}\r\n\r\n".encode()
+        )
+        head = await reader.readuntil(b"\r\n\r\n")
+        if b" 200 " not in head.split(b"\r\n", 1)[0]:
+            return None
+
+        tail = b""
+        while time.time() < deadline:
+            chunk = await asyncio.wait_for(reader.read(65536), deadline - time.time())
+            if not chunk:
+                break
+            frames += (tail + chunk).count(BOUNDARY)
+            tail = chunk[-len(BOUNDARY) + 1 :]
+        writer.close()
+        return frames
+    except asyncio.TimeoutError:
+        return frames
+    except (OSError, asyncio.IncompleteReadError):
+        return None
+
+
+async def load(args):
+    """
+    Run every viewer at once and print a summary.
+    """
+    deadline = time.time() + args.seconds
+    viewers = [viewer(args, deadline) for _ in range(args.viewers)]
+    results = await asyncio.gather(*viewers)
+    streamed = [frames for frames in results if frames]
+    print(f"viewers:  {args.viewers}")
+    print(f"streamed: {len(streamed)}")
+    print(f"failed:   {args.viewers - len(streamed)}")
+    if streamed:
+        print(
+            "fps per viewer: min %.1f, mean %.1f"
+            % (
+                min(streamed) / args.seconds,
+                sum(streamed) / len(streamed) / args.seconds,
+            )
+        )
+
+
+def main():
+    """
+    Parse the arguments and run the load test.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--viewers", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--socket", help="unix socket of the stream server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--path", default="/api/stream.mjpg")
+    asyncio.run(load(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Benchmark for logins under a brute force attack. Attackers send wrong
+passwords from many addresses while a user logs in and a viewer polls the
+gallery, with requests served by as many threads as uwsgi has workers.
+Reports the user's login latency and the gallery's latency and availability,
+with the throttling and hash slots on and effectively off.
+
+    python -m backend.bench.login --attackers 20 --seconds 10
+"""
+
+# standard imports
+import argparse
+import base64
+import concurrent.futures
+import os
+import tempfile
+import threading
+import time
+
+# installed imports
+from flask_jwt_extended import create_access_token
+
+# project imports
+from backend import flask_app, db, app, auth
+from backend.models import User
+
+# uwsgi worker processes, see wsgi.ini
+WORKERS = 5
+
+# gallery requests slower than this count as unavailable, in seconds
+GALLERY_DEADLINE = 1.0
+
+EMAIL = "bench@picam"
+PASSWORD = "benchpassword"
+
+
+def percentile(values, fraction):
+    """
+    The value below which the fraction of the values fall.
+    """
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0
+
+
+class Load:
+    """
+    Runs the attackers, the user and the viewer against the app.
+    """
+
+    def __init__(self, attackers, seconds):
+        self.attackers = attackers
+        self.seconds = seconds
+        # like uwsgi's listen queue, requests wait in order for a worker
+        self.workers = concurrent.futures.ThreadPoolExecutor(WORKERS)
+        self.event = threading.Event()
+        self.logins = []
+        self.gallery = []
+
+    def request(self, method, path, address, **kwargs):
+        """
+        Make a request once a worker is free.
+
+        :return: tuple of the status code and the seconds it took, counting
+                 the wait for a worker.
+        """
+        start = time.perf_counter()
+        status = self.workers.submit(self.serve, method, path, address, **kwargs)
+        return status.result(), time.perf_counter() - start
+
+    @staticmethod
+    def serve(method, path, address, token=None, **kwargs):
+        """
+        Serve a request on a worker.
+
+        :return: the status code
+        """
+        with flask_app.test_client() as client:
+            if token is not None:
+                client.set_cookie("/", "access_token_cookie", token)
+            return getattr(client, method)(
+                path, environ_base={"REMOTE_ADDR": address}, **kwargs
+            ).status_code
+
+    def attacker(self, index):
+        """
+        Guess passwords as fast as the server answers, from a new address
+        every attempt.
+        """
+        attempt = 0
+        while not self.event.is_set():
+            attempt += 1
+            self.request(
+                "post",
+                "/api/login",
+                f"10.{index}.{attempt // 250 % 250}.{attempt % 250}",
+                json={"email": EMAIL, "password": f"guess{attempt}"},
+            )
+
+    def user(self):
+        """
+        Log in once a second.
+        """
+        while not self.event.wait(1):
+            status, seconds = self.request(
+                "post",
+                "/api/login",
+                "192.168.1.2",
+                json={"email": EMAIL, "password": PASSWORD},
+            )
+            self.logins.append((status, seconds))
+
+    def viewer(self, token):
+        """
+        Poll the gallery ten times a second.
+        """
+        while not self.event.wait(0.1):
+            self.gallery.append(
+                self.request("get", "/api/images", "192.168.1.3", token=token)
+            )
+
+    def run(self):
+        """
+        Run the load for its seconds.
+        """
+        with flask_app.app_context():
+            token = create_access_token(identity=EMAIL)
+        threads = [threading.Thread(target=self.user)]
+        threads.append(threading.Thread(target=self.viewer, args=(token,)))
+        threads += [
+            threading.Thread(target=self.attacker, args=(index,))
+            for index in range(self.attackers)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(self.seconds)
+        self.event.set()
+        for thread in threads:
+            thread.join()
+        self.workers.shutdown()
+
+    def report(self, name):
+        """
+        Print the latencies and the gallery's availability.
+        """
+        login_times = [seconds for _, seconds in self.logins]
+        gallery_times = [seconds for _, seconds in self.gallery]
+        available = [
+            status == 200 and seconds < GALLERY_DEADLINE
+            for status, seconds in self.gallery
+        ]
+        print(f"{name}:")
+        print(
+            f"  user logins:  {sum(status == 200 for status, _ in self.logins)}"
+            f"/{len(self.logins)} ok, p99 {percentile(login_times, 0.99) * 1000:.0f} ms"
+        )
+        print(
+            f"  gallery:      p99 {percentile(gallery_times, 0.99) * 1000:.0f} ms, "
+            f"{sum(available) / max(len(available), 1):.1%} available"
+        )
+
+
+def main():
+    """
+    Parse the arguments and run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--attackers", type=int, default=20)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        flask_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+            directory, "bench.db"
+        )
+        auth.HASH_SLOT_PATH = os.path.join(directory, "slot")
+        app.init_db(drop_all=True)
+        with flask_app.app_context():
+            hashed = User.generate_hash(plaintext_password=PASSWORD.encode())
+            password = base64.b64encode(hashed).decode()
+            db.session.add(User(email=EMAIL, password=password))
+            db.session.commit()
+
+        limits = (
+            auth.LOGIN_ADDRESS_PER_MINUTE,
+            auth.LOGIN_ACCOUNT_PER_MINUTE,
+            auth.HASH_SLOTS,
+        )
+        for name, (per_address, per_account, slots) in (
+            ("unthrottled", (10 ** 6, 10 ** 6, WORKERS)),
+            ("throttled", limits),
+        ):
+            with flask_app.app_context():
+                db.session.execute("DELETE FROM login_bucket")
+                db.session.commit()
+            auth.LOGIN_ADDRESS_PER_MINUTE = per_address
+            auth.LOGIN_ACCOUNT_PER_MINUTE = per_account
+            auth.HASH_SLOTS = slots
+            load = Load(args.attackers, args.seconds)
+            load.run()
+            load.report(name)
+        db.session.remove()
+        db.get_engine(flask_app).dispose()
+
+
+if __name__ == "__main__":
+    main()
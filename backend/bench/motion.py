@@ -0,0 +1,78 @@
+"""
+Benchmark for the motion detector. Reports the per-frame cost of analyzing a
+stream-resolution frame, next to the cost of a full resolution color decode.
+
+    python -m backend.bench.motion --frames 200
+"""
+
+# standard imports
+import argparse
+import time
+
+# installed imports
+import cv2
+import numpy
+
+# project imports
+from backend import flask_app
+from backend.camera import STREAM_RESOLUTION
+from backend.motion import MotionDetector
+
+
+def make_frames(count):
+    """
+    Noisy stream-resolution JPEG frames with a box moving across them.
+    """
+    width, height = STREAM_RESOLUTION
+    generator = numpy.random.default_rng(0)
+    frames = []
+    for index in range(count):
+        image = generator.integers(0, 64, (height, width, 3), dtype=numpy.uint8)
+        x = index * 16 % (width - 200)
+        image[300:500, x : x + 200] = 255
+        frames.append(cv2.imencode(".jpg", image)[1].tobytes())
+    return frames
+
+
+def timed(function, frames):
+    """
+    Run function on every frame.
+
+    :return: milliseconds per frame
+    """
+    start = time.perf_counter()
+    for frame in frames:
+        function(frame)
+    return (time.perf_counter() - start) / len(frames) * 1000
+
+
+def main():
+    """
+    Parse the arguments and run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--frames", type=int, default=100)
+    args = parser.parse_args()
+
+    frames = make_frames(min(args.frames, 20))
+    frames = (frames * (args.frames // len(frames) + 1))[: args.frames]
+
+    detector = MotionDetector(None, flask_app)
+    analyze = timed(detector.analyze, frames)
+    full_decode = timed(
+        lambda data: cv2.imdecode(
+            numpy.frombuffer(data, numpy.uint8), cv2.IMREAD_COLOR
+        ),
+        frames,
+    )
+    print(f"frames:            {args.frames} at {STREAM_RESOLUTION}")
+    print(f"analyze:           {analyze:.2f} ms/frame")
+    print(f"full color decode: {full_decode:.2f} ms/frame")
+    print(
+        f"analyzing every {detector.every}th frame at 24 fps: "
+        f"{analyze * 24 / detector.every:.1f} ms of CPU per second"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark for serializing images. Seeds a throwaway sqlite database and
+reports the cost of serializing every image through model objects and
+strftime, as the image list used to, next to the bulk serializer. Fails if the
+two disagree.
+
+    python -m backend.bench.serialize --images 20000
+"""
+
+# standard imports
+import argparse
+import os
+import tempfile
+
+# installed imports
+from pytz import timezone
+
+# project imports
+from backend import flask_app, db, app
+from backend.models import Image
+from backend.bench.images import seed, timed
+
+
+def legacy_as_json(image):
+    """
+    Image.as_json as it was before the bulk serializer.
+    """
+    _created_on = timezone("US/Eastern").localize(image.created_on)
+    return {
+        "id": image.id,
+        "url": image.url,
+        "thumb_url": image.thumb_url,
+        "preview_url": image.preview_url,
+        "duplicate_of": image.duplicate_of,
+        "created_on": _created_on.strftime("%m/%d/%y %I:%M:%S EST"),
+    }
+
+
+def objects():
+    """
+    Serialize every image through model objects.
+    """
+    return [legacy_as_json(x) for x in Image.query.order_by(Image.id.desc()).all()]
+
+
+def bulk():
+    """
+    Serialize every image from column tuples.
+    """
+    return Image.rows_as_json(
+        Image.query.with_entities(*Image.json_columns()).order_by(Image.id.desc())
+    )
+
+
+def main():
+    """
+    Parse the arguments and run the benchmark.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--images", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        flask_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(
+            directory, "bench.db"
+        )
+        app.init_db(drop_all=True)
+        with flask_app.app_context():
+            seed(args.images)
+            if objects() != bulk():
+                raise SystemExit("bulk serializer output differs")
+            results = {
+                "objects": timed(objects, args.repeat),
+                "bulk": timed(bulk, args.repeat),
+            }
+        db.session.remove()
+        db.get_engine(flask_app).dispose()
+
+    print(f"images:  {args.images}, identical output")
+    for name, milliseconds in results.items():
+        print(f"{name + ':':<8} {milliseconds:.2f} ms")
+    print(f"speedup: {results['objects'] / results['bulk']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Shared broadcaster for the live stream.
+"""
+
+# standard imports
+import collections
+import itertools
+import os
+import threading
+
+# project imports
+from backend.logger import LOGGER
+from backend.camera import DEFAULT_TIER
+
+# seconds to keep the camera running after the last consumer leaves, so the
+# streams and captures that follow don't wait for it to start up again
+KEEP_WARM_PERIOD = float(os.environ.get("PICAM_KEEP_WARM", 30))
+
+# frames queued per subscriber before the oldest are dropped
+QUEUE_SIZE = 2
+
+# seconds the fan-out thread waits for a frame before checking the camera
+FAN_OUT_TIMEOUT = 1
+
+SUBSCRIBER_IDS = itertools.count(1)
+
+
+class Subscriber:
+    """
+    A stream viewer. Frames are queued in a small bounded queue that drops the
+    oldest frame when the viewer falls behind, so a slow viewer gets fewer
+    frames instead of slowing down the camera or using more memory.
+    """
+
+    def __init__(
+        self, max_fps=None, quality=None, tier=DEFAULT_TIER, queue_size=QUEUE_SIZE
+    ):
+        self.id = next(SUBSCRIBER_IDS)
+        self.max_fps = max_fps
+        self.quality = quality
+        self.tier = tier
+        self.queue = collections.deque(maxlen=queue_size)
+        self.condition = threading.Condition()
+        self.sequence = 0
+        self.next_due = 0
+
+        # frames handed to the viewer, dropped because it fell behind, and
+        # skipped to honour max_fps
+        self.sent = 0
+        self.dropped = 0
+        self.throttled = 0
+
+    def offer(self, frame):
+        """
+        Queue a frame for this subscriber, dropping the oldest queued frame if
+        the queue is full.
+
+        :param frame: the Frame from the camera output
+        """
+        with self.condition:
+            if frame.sequence <= self.sequence:
+                return
+            self.sequence = frame.sequence
+
+        if self.max_fps:
+            if frame.timestamp < self.next_due:
+                self.throttled += 1
+                return
+            interval = 1 / self.max_fps
+            self.next_due = max(self.next_due, frame.timestamp - interval) + interval
+
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append(frame)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Take the oldest queued frame.
+
+        :param timeout: seconds to wait for a frame, None waits forever
+        :return: the Frame, None if no frame arrived within the timeout.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.queue, timeout):
+                return None
+            return self.queue.popleft()
+
+    def stats(self):
+        """
+        Counters for this subscriber.
+        """
+        return {
+            "id": self.id,
+            "max_fps": self.max_fps,
+            "quality": self.quality,
+            "tier": self.tier,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "throttled": self.throttled,
+            "queued": len(self.queue),
+        }
+
+
+class Broadcaster:
+    """
+    Share one camera recording thread between any number of stream
+    subscribers and captures. The camera is started by the first consumer and
+    kept warm until the last consumer has been gone for the keep-warm period.
+    While the camera runs, a fan-out thread hands every new frame to each
+    subscriber's queue.
+    """
+
+    def __init__(self, camera, keep_warm=KEEP_WARM_PERIOD):
+        self.camera = camera
+        self.keep_warm = keep_warm
+        self.consumers = 0
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.stop_timer = None
+        self.fan_out = None
+
+    def acquire(self):
+        """
+        Register a consumer, starting the camera if it isn't running.
+        """
+        with self.lock:
+            self._acquire()
+
+    def release(self):
+        """
+        Unregister a consumer, scheduling the camera to stop if it was the
+        last one.
+        """
+        with self.lock:
+            self._release()
+
+    def subscribe(self, max_fps=None, quality=None, tier=DEFAULT_TIER):
+        """
+        Register a subscriber, starting the camera if it isn't running.
+
+        :param max_fps: most frames per second to send the subscriber
+        :param quality: JPEG quality of the subscriber's frames
+        :param tier: resolution tier of the subscriber's frames
+        :return: the Subscriber
+        """
+        subscriber = Subscriber(max_fps=max_fps, quality=quality, tier=tier)
+        with self.lock:
+            self.subscribers.append(subscriber)
+            LOGGER.debug("Subscribed, %d subscriber(s)", len(self.subscribers))
+            self._acquire()
+            if self.fan_out is None or not self.fan_out.is_alive():
+                self.fan_out = threading.Thread(target=self.fan_out_thread)
+                self.fan_out.daemon = True
+                self.fan_out.start()
+
+        # start the subscriber off with the latest frame rather than making it
+        # wait for the next one
+        latest = self.camera.output.latest()
+        if latest is not None:
+            subscriber.offer(latest)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """
+        Unregister a subscriber, scheduling the camera to stop if it was the
+        last consumer.
+
+        :param subscriber: the Subscriber returned by subscribe
+        """
+        with self.lock:
+            self.subscribers.remove(subscriber)
+            LOGGER.debug("Unsubscribed, %d subscriber(s)", len(self.subscribers))
+            self._release()
+
+    def take_picture(self, app):
+        """
+        Take a picture from the camera's stream, starting the camera if
+        needed and keeping it warm for the captures and streams that follow.
+        With keep-warm disabled, captures only use the stream when it is
+        already running.
+
+        :param app: the application
+        :return: the new Image, None if the capture failed.
+        """
+        if not self.keep_warm:
+            return self.camera.take_picture(app)
+
+        self.acquire()
+        try:
+            return self.camera.take_picture(app)
+        finally:
+            self.release()
+
+    def next_frame(self, subscriber, timeout):
+        """
+        Get the next stream frame for a subscriber. Frames that were
+        overwritten in the camera output before the subscriber got to them
+        count as dropped.
+
+        :param subscriber: the Subscriber returned by subscribe
+        :param timeout: seconds to wait for a frame
+        :return: the Frame with the stream frame's bytes as data, None if no
+                 frame arrived within the timeout.
+        """
+        while True:
+            frame = subscriber.get(timeout)
+            if frame is None:
+                return None
+            data = self.camera.stream_frame(
+                frame, quality=subscriber.quality, tier=subscriber.tier
+            )
+            if data is None:
+                subscriber.dropped += 1
+                continue
+            subscriber.sent += 1
+            return frame._replace(data=data)
+
+    def stats(self):
+        """
+        Counters for every subscriber.
+        """
+        with self.lock:
+            return [subscriber.stats() for subscriber in self.subscribers]
+
+    def fan_out_thread(self):
+        """
+        Thread that hands every new camera frame to the subscribers.
+        """
+        LOGGER.debug("Fan-out thread started...")
+        sequence = 0
+        while self.camera.is_running():
+            frame = self.camera.output.next_frame(sequence, FAN_OUT_TIMEOUT)
+            if frame is None:
+                continue
+            sequence = frame.sequence
+            with self.lock:
+                subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                subscriber.offer(frame)
+        LOGGER.debug("Camera stopped, fan-out thread exiting.")
+
+    def _acquire(self):
+        """
+        Register a consumer. The lock must be held.
+        """
+        self.consumers += 1
+        if self.stop_timer is not None:
+            LOGGER.debug("Cancelling pending camera stop")
+            self.stop_timer.cancel()
+            self.stop_timer = None
+        if not self.camera.is_running():
+            self.camera.start()
+
+    def _release(self):
+        """
+        Unregister a consumer. The lock must be held.
+        """
+        self.consumers -= 1
+        if self.consumers > 0:
+            return
+        LOGGER.debug("No consumers, keeping camera warm for %d seconds", self.keep_warm)
+        self.stop_timer = threading.Timer(self.keep_warm, self._stop_if_idle)
+        self.stop_timer.daemon = True
+        self.stop_timer.start()
+
+    def _stop_if_idle(self):
+        """
+        Stop the camera, unless a consumer showed up while it was kept warm.
+        """
+        with self.lock:
+            if self.consumers > 0:
+                return
+            # a newer acquire/release may have replaced this timer
+            if self.stop_timer is not threading.current_thread():
+                return
+            self.stop_timer = None
+            if self.camera.is_running():
+                LOGGER.info("Camera idle, stopping camera...")
+                self.camera.stop()
@@ -3,51 +3,256 @@ Implementation for the real raspberry pi camera.
 """
 
 # standard imports
+import collections
+import os
 import threading
-import io
 import time
 import uuid
 import shutil
 import datetime
 
 # installed imports
-from PIL import ImageFont, ImageDraw, Image
 import cv2
 import numpy
 
 # project imports
 from backend.logger import LOGGER
-from backend.models import Image as _Image
+from backend.models import Image as _Image, VersionStamp
 from backend.fake_camera import FakeCamera
-from backend import db
+from backend.overlay import FONT_SIZE, MIN_FONT_SIZE, TimestampOverlay, load_font
+from backend.storage import capture_path, remove_capture_files
+from backend import db, constants, thumbnails, dedup
 
 # path to a test image for use with development
 TEST_SRC_IMAGE_PATH = "test_images/test_image.jpg"
 
+# number of processed frames kept for late readers, and of decoded images
+# kept while the frames of a sequence are being processed
+FRAME_CACHE_SIZE = 16
+IMAGE_CACHE_SIZE = 8
+
+# number of frames kept by the output, and initial size of each frame slot
+OUTPUT_RING_SIZE = 8
+OUTPUT_SLOT_SIZE = 512 * 1024
+
+# seconds to wait for the camera to deliver a frame
+FRAME_TIMEOUT = 5
+
+# seconds a stream frame may predate a capture and still be saved as it
+SNAPSHOT_MAX_AGE = 0.5
+
+# seconds to wait for the first frame when starting the camera
+START_TIMEOUT = float(os.environ.get("PICAM_START_TIMEOUT", 10))
+
+# JPEG quality of the annotated stream frames
+STREAM_JPEG_QUALITY = 75
+
+# how the live stream timestamp is drawn: decoded and drawn in software for
+# every frame, or drawn by the camera firmware and passed through untouched
+ANNOTATE_SOFTWARE = "software"
+ANNOTATE_FIRMWARE = "firmware"
+ANNOTATE_MODE = os.environ.get("PICAM_ANNOTATE_MODE", ANNOTATE_SOFTWARE)
+
+# resolution tiers viewers can pick from, None being the camera's resolution
+STREAM_RESOLUTION = (1296, 730)
+STREAM_TIERS = collections.OrderedDict(
+    [("full", None), ("medium", (640, 360)), ("small", (320, 180))]
+)
+DEFAULT_TIER = "full"
+
+# how the smaller tiers are produced: downscaled in software once per frame,
+# or recorded at their resolution on their own camera splitter ports
+SIMULCAST_SOFTWARE = "software"
+SIMULCAST_SPLITTER = "splitter"
+SIMULCAST_MODE = os.environ.get("PICAM_SIMULCAST_MODE", SIMULCAST_SOFTWARE)
+
+# first splitter port used for the smaller tiers, the stream itself records on 1
+FIRST_TIER_SPLITTER_PORT = 2
+
+
+# a frame in the output: its sequence number, capture time and JPEG data
+Frame = collections.namedtuple("Frame", ["sequence", "timestamp", "data"])
+
+
+def timestamp_text():
+    """
+    The live stream timestamp for the current time.
+    """
+    return "Live stream: " + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
 
 class StreamingOutput(object):
     """
-    StreamingOutput target for the Camera writes.
+    StreamingOutput target for the Camera writes. Frames are written into a
+    preallocated ring of slots, each tagged with a sequence number and capture
+    timestamp, so the writer never allocates per frame or waits on readers.
+    Readers get frames as memoryviews into the ring and must check the frame
+    is still current before trusting what they read.
     """
 
-    def __init__(self):
-        self.frame = None
-        self.buffer = io.BytesIO()
+    def __init__(self, ring_size=OUTPUT_RING_SIZE, slot_size=OUTPUT_SLOT_SIZE):
+        self.slots = [bytearray(slot_size) for _ in range(ring_size)]
+        self.lengths = [0] * ring_size
+        self.sequences = [0] * ring_size
+        self.timestamps = [0.0] * ring_size
+
+        # sequence number of the latest complete frame
+        self.sequence = 0
+
+        # slot being written and how much of the frame it holds
+        self.index = 0
+        self.offset = 0
+
         self.condition = threading.Condition()
 
     def write(self, buf):
         """
         Write a frame to output.
         """
-        if buf.startswith(b"\xff\xd8"):
-            # New frame, copy the existing buffer's content and notify all
+        if buf.startswith(b"\xff\xd8") and self.offset:
+            # New frame, publish the one in the current slot and notify all
             # clients it's available
-            self.buffer.truncate()
-            with self.condition:
-                self.frame = self.buffer.getvalue()
-                self.condition.notify_all()
-            self.buffer.seek(0)
-        return self.buffer.write(buf)
+            self.publish()
+
+        end = self.offset + len(buf)
+        slot = self.slots[self.index]
+        if end > len(slot):
+            # frame doesn't fit, replace the slot rather than resizing it since
+            # readers may still hold views of it
+            LOGGER.debug("Growing frame slot to %d bytes", end * 2)
+            grown = bytearray(end * 2)
+            grown[: self.offset] = slot[: self.offset]
+            slot = self.slots[self.index] = grown
+
+        slot[self.offset : end] = buf
+        self.offset = end
+
+        if buf.endswith(b"\xff\xd9"):
+            # end of the frame, publish it rather than waiting for the next one
+            self.publish()
+        return len(buf)
+
+    def publish(self):
+        """
+        Publish the frame in the current slot and move on to the next slot.
+        """
+        with self.condition:
+            self.sequence += 1
+            self.lengths[self.index] = self.offset
+            self.sequences[self.index] = self.sequence
+            self.timestamps[self.index] = time.time()
+            self.condition.notify_all()
+
+        self.index = (self.index + 1) % len(self.slots)
+        self.offset = 0
+        # invalidate the frame about to be overwritten
+        self.sequences[self.index] = 0
+
+    def latest(self):
+        """
+        Get the latest complete frame.
+
+        :return: the Frame, None if no frame was written yet.
+        """
+        with self.condition:
+            return self._latest()
+
+    def next_frame(self, after_sequence=0, timeout=None):
+        """
+        Wait for a frame newer than after_sequence and get the latest frame.
+        The lock is only held to take the snapshot, so readers process frames
+        without holding up the writer.
+
+        :param after_sequence: sequence number of the last frame the reader saw
+        :param timeout: seconds to wait for a newer frame, None waits forever
+        :return: the Frame, None if no newer frame arrived within the timeout.
+        """
+        with self.condition:
+            if not self.condition.wait_for(
+                lambda: self.sequence > after_sequence, timeout
+            ):
+                return None
+            return self._latest()
+
+    def _latest(self):
+        """
+        Get the latest complete frame. The condition must be held.
+        """
+        if not self.sequence:
+            return None
+        index = (self.sequence - 1) % len(self.slots)
+        view = memoryview(self.slots[index])[: self.lengths[index]]
+        return Frame(self.sequence, self.timestamps[index], view)
+
+    def is_current(self, frame):
+        """
+        Whether a frame's slot still holds that frame, i.e. whether what was
+        read from its data can be trusted.
+        """
+        return self.sequences[(frame.sequence - 1) % len(self.slots)] == frame.sequence
+
+    def copy(self, frame):
+        """
+        Copy a frame's data out of the ring.
+
+        :return: the frame's bytes, None if its slot was reused meanwhile.
+        """
+        data = bytes(frame.data)
+        if not self.is_current(frame):
+            LOGGER.debug("Frame %d was overwritten while copying", frame.sequence)
+            return None
+        return data
+
+
+class FrameCache:
+    """
+    Cache of processed frames keyed by frame sequence number and variant, so
+    each camera frame is processed once no matter how many readers ask for it.
+    """
+
+    def __init__(self, size=FRAME_CACHE_SIZE):
+        self.size = size
+        self.frames = collections.OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, produce):
+        """
+        Get the cached frame for key, producing it if nobody has yet. Readers
+        asking for a key that is being produced wait for that result instead
+        of producing it again.
+
+        :param key: the key of the frame, e.g. its sequence number and quality
+        :param produce: callable returning the processed frame
+        :return: the processed frame
+        """
+        with self.lock:
+            if key in self.frames:
+                return self.frames[key]
+            ready = self.pending.get(key)
+            if ready is None:
+                ready = self.pending[key] = threading.Event()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            ready.wait()
+            with self.lock:
+                return self.frames.get(key)
+
+        frame = None
+        try:
+            frame = produce()
+        finally:
+            with self.lock:
+                if frame is not None:
+                    self.frames[key] = frame
+                    while len(self.frames) > self.size:
+                        self.frames.popitem(last=False)
+                del self.pending[key]
+            ready.set()
+        return frame
 
 
 class Camera:
@@ -55,22 +260,62 @@ class Camera:
     Interface for the Raspberry Pi Camera module.
     """
 
-    def __init__(self):
+    def __init__(self, annotate_mode=ANNOTATE_MODE, simulcast_mode=SIMULCAST_MODE):
         self.output = StreamingOutput()
+        self.cache = FrameCache()
+        self.images = FrameCache(size=IMAGE_CACHE_SIZE)
+        self.annotate_mode = annotate_mode
+        self.simulcast_mode = simulcast_mode
+        self.overlays = {}
+        if annotate_mode == ANNOTATE_SOFTWARE:
+            self.overlays[DEFAULT_TIER] = TimestampOverlay()
+
+        # outputs of the tiers recorded on splitter ports, by tier
+        self.tier_outputs = {}
+        self.metrics = {"starts": 0, "time_to_first_frame": None}
         self.event = None
         self.camera_thread = None
 
-    def start(self):
+    def start(self, timeout=START_TIMEOUT):
         """
-        Start the camera stream thread.
+        Start the camera stream thread and wait for its first frame.
+
+        :param timeout: seconds to wait for the first frame
+        :return: whether a frame arrived within the timeout.
         """
         LOGGER.debug("Starting camera...")
+        started = time.time()
+        sequence = self.output.sequence
         self.event = threading.Event()
         LOGGER.debug("Created event %s", self.event)
         self.camera_thread = threading.Thread(target=self.recording_thread)
         self.camera_thread.start()
-        LOGGER.info("Waiting 10 seconds for camera to start...")
-        time.sleep(10)  # camera warm up...
+        self.metrics["starts"] += 1
+
+        LOGGER.info("Waiting up to %d seconds for the first frame...", timeout)
+        deadline = started + timeout
+        while True:
+            frame = self.output.next_frame(sequence, deadline - time.time())
+            if frame is None:
+                LOGGER.error("No frame from the camera after %d seconds", timeout)
+                return False
+            if frame.data[-2:] == b"\xff\xd9":
+                break
+            # incomplete frame, wait for the next one
+            sequence = frame.sequence
+
+        self.metrics["time_to_first_frame"] = time.time() - started
+        LOGGER.info(
+            "Camera started, first frame after %.3f seconds",
+            self.metrics["time_to_first_frame"],
+        )
+        return True
+
+    def is_running(self):
+        """
+        Whether the camera stream thread is running.
+        """
+        return self.camera_thread is not None and self.camera_thread.is_alive()
 
     def stop(self):
         """
@@ -86,48 +331,36 @@ class Camera:
         LOGGER.debug("Camera thread joined.")
         self.camera_thread = None
 
-    def generate_live_stream(self):
-        """
-        Start the camera thread and yield frames.
-        """
-        LOGGER.info("Starting camera output...")
-        self.start()
-        LOGGER.info("Camera output started...")
-        try:
-            while self.camera_thread.is_alive():
-                frame = self.get_frame()
-                if frame is None:
-                    LOGGER.error("Failed getting frame.")
-                    self.stop()
-                    return "Error getting stream."
-                yield (
-                    b"--frame\r\n"
-                    b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n\r\n"
-                )
-        finally:
-            LOGGER.info("Stopping camera output...")
-            self.stop()
-            LOGGER.info("Camera output stopped...")
-
     def take_picture(self, app):
         """
-        Tell the camera to take a picture.
+        Tell the camera to take a picture. If the camera is streaming, the
+        latest frame of the stream is saved, otherwise the camera is started
+        just for the capture.
 
         :param app: the application
+        :return: the new Image, None if the capture failed.
         """
         img_uuid = uuid.uuid4()
-
-        # if the camera is busy streaming, stop the stream so we can take a snapshot.
-        self.stop()
+        path, url = capture_path(app, f"{img_uuid}.jpg")
+
+        if self.is_running():
+            data = self.snapshot()
+            if data is not None:
+                with open(path, "wb") as image_file:
+                    image_file.write(data)
+                LOGGER.info("Saved stream snapshot to path %s, updating db...", path)
+                return self.add_image(app, path, url)
+
+            # if the stream isn't delivering frames, stop it so we can take a
+            # snapshot.
+            LOGGER.error("Failed taking snapshot from the stream, capturing...")
+            self.stop()
 
         # debugging without a camera means faking an image capture. Achieve this by
         # copying a pre-existing image and naming it uniquely.
         if app.debug:
-            shutil.copyfile(TEST_SRC_IMAGE_PATH, f"test_images/{img_uuid}.jpg")
-            image = _Image(url=f"test_images/{img_uuid}.jpg")
-            db.session.add(image)
-            db.session.commit()
-            return True
+            shutil.copyfile(TEST_SRC_IMAGE_PATH, path)
+            return self.add_image(app, path, url)
 
         # if we're not debugging, try and capture an image from the actual camera.
         try:
@@ -142,89 +375,228 @@ class Camera:
                 # Camera warm-up time
                 time.sleep(2)
 
-                # /var/www/html/cam is writable by 'pi', and nginx
-                # routes the requests for /cam/ to this location.
-                path = f"/var/www/html/cam/{img_uuid}.jpg"
                 camera.capture(path)
 
                 # store a link to it in the database
                 LOGGER.info("Captured image, saved to path %s, updating db...", path)
-
-                # nginx routes *.jpg requests appropriately
-                image = _Image(url=f"{img_uuid}.jpg")
-                db.session.add(image)
-                db.session.commit()
+                image = self.add_image(app, path, url)
 
                 LOGGER.info("Done capturing image...")
-                return True
+                return image
         except Exception as e:
             LOGGER.error(e)
-            return False
+            return None
 
-    def get_frame(self):
+    @staticmethod
+    def add_image(app, path, url):
         """
-        Get a single frame from the output.
+        Add a capture to the db and queue its thumbnails. A capture
+        near-identical to the previous one is marked as a duplicate, or
+        removed when duplicates are skipped.
 
-        :return: None if camera is not started.
+        :param app: the application
+        :param path: where the capture is stored
+        :param url: URL the capture is served from
+        :return: the Image, the original's when the capture was skipped.
         """
-        if not self.camera_thread.is_alive():
-            LOGGER.error("Tried getting a frame before the was started.")
-            return None
-
-        with self.output.condition:
-            LOGGER.debug("Waiting for output to be ready")
-            self.output.condition.wait()
-            LOGGER.debug("Output is ready")
-            frame = self.output.frame
+        phash, duplicate_of = dedup.classify(path)
+        if duplicate_of is not None and dedup.DEDUP_MODE == dedup.DEDUP_SKIP:
+            LOGGER.info("Skipping capture %s, a duplicate of %d", url, duplicate_of)
+            remove_capture_files(path)
+            return _Image.query.get(duplicate_of)
+        if dedup.DEDUP_MODE != dedup.DEDUP_MARK:
+            duplicate_of = None
+
+        image = _Image(url=url, phash=phash, duplicate_of=duplicate_of)
+        db.session.add(image)
+        VersionStamp.bump(constants.IMAGES_VERSION)
+        db.session.commit()
+        thumbnails.submit(app, image.id, path, url)
+        return image
+
+    def snapshot(self, timeout=FRAME_TIMEOUT):
+        """
+        Copy the latest frame of the running stream, as captured by the camera.
+        A frame older than SNAPSHOT_MAX_AGE, left over from before the stream
+        stalled or stopped, is never saved; a newer one is waited for instead.
 
-            # now add timestamp to jpeg
-            # Convert to PIL Image
-            cv2.CV_LOAD_IMAGE_COLOR = 1  # set flag to 1 to give colour image
+        :param timeout: seconds to wait for a frame
+        :return: the JPEG bytes, None if no frame arrived within the timeout.
+        """
+        requested = time.time()
+        deadline = requested + timeout
+        sequence = 0
+        while True:
+            frame = self.output.next_frame(sequence, deadline - time.time())
+            if frame is None:
+                return None
+            if frame.timestamp < requested - SNAPSHOT_MAX_AGE:
+                sequence = frame.sequence
+                continue
+            data = self.output.copy(frame)
+            if data is not None:
+                return data
+            # overwritten before it could be read, try the next one
+            sequence = frame.sequence
+
+    def get_frame(self, timeout=FRAME_TIMEOUT):
+        """
+        Get the next annotated frame from the output.
 
-            npframe = numpy.fromstring(frame, dtype=numpy.uint8)
-            pil_frame = cv2.imdecode(npframe, cv2.CV_LOAD_IMAGE_COLOR)
+        :param timeout: seconds to wait for the frame
+        :return: the frame's bytes, None if camera is not started or timed out.
+        """
+        frame = self.next_frame(self.output.sequence, timeout)
+        if frame is None:
+            return None
+        return frame.data
 
-            cv2_im_rgb = cv2.cvtColor(pil_frame, cv2.COLOR_BGR2RGB)
-            pil_im = Image.fromarray(cv2_im_rgb)
+    def next_frame(self, after_sequence=0, timeout=FRAME_TIMEOUT):
+        """
+        Get the latest annotated frame newer than after_sequence.
 
-            draw = ImageDraw.Draw(pil_im)
+        :param after_sequence: sequence number of the last frame the caller got
+        :param timeout: seconds to wait for a newer frame
+        :return: the Frame with the stream frame's bytes as data, None if
+                 camera is not started or no frame arrived within the timeout.
+        """
+        if not self.is_running():
+            LOGGER.error("Tried getting a frame before the camera was started.")
+            return None
 
-            # Choose a font
-            try:
-                font_file = "/usr/share/fonts/truetype/freefont/FreeSans.ttf"
-                font = ImageFont.truetype(font_file, 25)
-                timestamp_text = "Live stream: " + datetime.datetime.now().strftime(
-                    "%Y-%m-%d %H:%M:%S"
-                )
+        deadline = time.time() + timeout
+        while True:
+            frame = self.output.next_frame(after_sequence, deadline - time.time())
+            if frame is None:
+                LOGGER.error("Timed out waiting for a frame after %d", after_sequence)
+                return None
+            data = self.stream_frame(frame)
+            if data is not None:
+                return frame._replace(data=data)
+            # overwritten before it could be read, try the next one
+            after_sequence = frame.sequence
+
+    def stream_frame(self, frame, quality=None, tier=DEFAULT_TIER):
+        """
+        Turn a frame from the output into a stream frame. Each camera frame is
+        processed once per quality and tier and shared with every caller
+        asking for it.
+
+        :param frame: the Frame from the output
+        :param quality: JPEG quality, None for the stream's default
+        :param tier: one of STREAM_TIERS
+        :return: the stream frame's bytes, None if the frame was overwritten
+                 before it could be read.
+        """
+        return self.cache.get(
+            (frame.sequence, quality, tier),
+            lambda: self.process_frame(frame, quality, tier),
+        )
 
-                # Draw the text
-                color = "rgb(255,255,255)"
+    def process_frame(self, frame, quality=None, tier=DEFAULT_TIER):
+        """
+        Turn a frame from the output into a stream frame. When the firmware
+        draws the timestamp, frames are passed through as they are unless a
+        different quality or resolution is asked for.
+
+        :param frame: the Frame from the output
+        :param quality: JPEG quality, None for the stream's default
+        :param tier: one of STREAM_TIERS
+        :return: the stream frame, None if the frame was overwritten meanwhile
+        """
+        passthrough = self.annotate_mode == ANNOTATE_FIRMWARE and quality is None
+
+        tier_output = self.tier_outputs.get(tier)
+        if tier_output is not None:
+            # the tier is recorded at its resolution, use its latest frame
+            tier_frame = tier_output.latest()
+            data = tier_frame and tier_output.copy(tier_frame)
+            if data is None or passthrough:
+                return data
+            image = self.decode(data)
+            if self.annotate_mode == ANNOTATE_SOFTWARE:
+                self.overlay(tier).apply(image, timestamp_text())
+        elif passthrough and STREAM_TIERS[tier] is None:
+            return self.output.copy(frame)
+        else:
+            image = self.images.get(
+                (frame.sequence, tier), lambda: self.tier_image(frame, tier)
+            )
+            if image is None:
+                return None
+
+        _, encoded = cv2.imencode(
+            ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, quality or STREAM_JPEG_QUALITY]
+        )
+        return encoded.tobytes()
+
+    def tier_image(self, frame, tier):
+        """
+        Decode a frame from the output, scale it down to a tier's resolution
+        and draw the timestamp. The frame is decoded once for all tiers.
 
-                # get text size
-                text_size = font.getsize(timestamp_text)
+        :param frame: the Frame from the output
+        :param tier: one of STREAM_TIERS
+        :return: the image, None if the frame was overwritten meanwhile
+        """
+        source = self.images.get(
+            (frame.sequence, None), lambda: self.decode_frame(frame)
+        )
+        if source is None:
+            return None
 
-                # set button size + 10px margins
-                button_size = (text_size[0] + 20, text_size[1] + 10)
+        size = STREAM_TIERS[tier]
+        if size is None:
+            image = source.copy()
+        else:
+            image = cv2.resize(source, size, interpolation=cv2.INTER_AREA)
+        if self.annotate_mode == ANNOTATE_SOFTWARE:
+            self.overlay(tier).apply(image, timestamp_text())
+        return image
 
-                # create image with correct size and black background
-                button_img = Image.new("RGBA", button_size, "black")
+    def decode_frame(self, frame):
+        """
+        Decode a frame from the output.
 
-                # button_img.putalpha(128)
-                # put text on button with 10px margins
-                button_draw = ImageDraw.Draw(button_img)
-                button_draw.text((10, 5), timestamp_text, fill=color, font=font)
+        :return: the image, None if the frame was overwritten meanwhile
+        """
+        data = self.output.copy(frame)
+        if data is None:
+            return None
+        return self.decode(data)
 
-                # put button on source image in position (0, 0)
-                pil_im.paste(button_img, (0, 0))
-            except OSError as _:
-                LOGGER.error(f"Failed opening fot resource {font_file}")
+    @staticmethod
+    def decode(data):
+        """
+        Decode a JPEG into a BGR image.
+        """
+        return cv2.imdecode(numpy.frombuffer(data, numpy.uint8), cv2.IMREAD_COLOR)
 
-            # Save the image
-            buf = io.BytesIO()
-            pil_im.save(buf, format="JPEG")
-            frame = buf.getvalue()
+    def overlay(self, tier):
+        """
+        Get the timestamp overlay for a tier, with its font scaled down along
+        with the tier's resolution.
+        """
+        overlay = self.overlays.get(tier)
+        if overlay is None:
+            scale = STREAM_TIERS[tier][0] / STREAM_RESOLUTION[0]
+            font = load_font(font_size=max(MIN_FONT_SIZE, round(FONT_SIZE * scale)))
+            overlay = self.overlays[tier] = TimestampOverlay(font=font)
+        return overlay
+
+    def annotation_ticker(self, camera):
+        """
+        Thread that keeps the firmware annotation text up to date, updating it
+        at the start of every second.
 
-        return frame
+        :param camera: the PiCamera (or FakeCamera) drawing the annotation
+        """
+        LOGGER.debug("Annotation ticker started...")
+        while True:
+            camera.annotate_text = timestamp_text()
+            if self.event.wait(1 - time.time() % 1):
+                LOGGER.debug("Annotation ticker was signalled, stopping...")
+                return
 
     def recording_thread(self):
         """
@@ -236,30 +608,59 @@ class Camera:
         try:
             import picamera  # pylint: disable=import-outside-toplevel
 
-            with picamera.PiCamera(resolution="1296x730", framerate=24) as camera:
+            resolution = "{}x{}".format(*STREAM_RESOLUTION)
+            with picamera.PiCamera(resolution=resolution, framerate=24) as camera:
                 camera.start_recording(self.output, format="mjpeg")
+                if self.simulcast_mode == SIMULCAST_SPLITTER:
+                    self.record_tiers(camera)
                 camera.annotate_foreground = picamera.Color(y=0.2, u=0, v=0)
                 camera.annotate_background = picamera.Color(y=0.8, u=0, v=0)
-
-                # keep the context alive
-                while True:
-                    LOGGER.debug("Waiting on event %s", self.event)
-                    if self.event.wait(1):
-                        LOGGER.info("Recording thread was signalled, stopping...")
-                        camera.stop_recording()
-                        LOGGER.debug("Exiting thread.")
-                        return
+                self.keep_recording(camera)
         except ModuleNotFoundError:
             LOGGER.debug("Not running on device, can't import model")
             camera = FakeCamera()
             camera.start_recording(self.output)
-
-            # keep the context alive
-            while True:
-                if self.event.wait(1):
-                    LOGGER.info("Thread was signalled, stopping...")
-                    camera.stop_recording()
-                    LOGGER.debug("Exiting thread.")
-                    return
+            self.keep_recording(camera)
 
         LOGGER.debug("Camera thread ending...")
+
+    def record_tiers(self, camera):
+        """
+        Record each of the smaller tiers at its resolution on its own splitter
+        port, so the GPU does the downscaling.
+
+        :param camera: the recording PiCamera
+        """
+        tiers = [tier for tier, size in STREAM_TIERS.items() if size is not None]
+        for port, tier in enumerate(tiers, FIRST_TIER_SPLITTER_PORT):
+            LOGGER.debug("Recording tier %s on splitter port %d", tier, port)
+            output = StreamingOutput()
+            camera.start_recording(
+                output, format="mjpeg", splitter_port=port, resize=STREAM_TIERS[tier]
+            )
+            self.tier_outputs[tier] = output
+
+    def keep_recording(self, camera):
+        """
+        Keep the camera recording until the thread is signalled.
+
+        :param camera: the recording PiCamera (or FakeCamera)
+        """
+        ticker = None
+        if self.annotate_mode == ANNOTATE_FIRMWARE:
+            ticker = threading.Thread(target=self.annotation_ticker, args=(camera,))
+            ticker.start()
+
+        # keep the context alive
+        while True:
+            LOGGER.debug("Waiting on event %s", self.event)
+            if self.event.wait(1):
+                LOGGER.info("Recording thread was signalled, stopping...")
+                if ticker is not None:
+                    ticker.join()
+                for port in range(len(self.tier_outputs)):
+                    camera.stop_recording(splitter_port=FIRST_TIER_SPLITTER_PORT + port)
+                self.tier_outputs = {}
+                camera.stop_recording()
+                LOGGER.debug("Exiting thread.")
+                return
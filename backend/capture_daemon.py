@@ -0,0 +1,135 @@
+"""
+Capture daemon. Owns the camera on behalf of every web worker and publishes
+its frames, as the camera captured them, to the shared frame ring.
+
+Run with python -m backend.capture_daemon
+"""
+
+# standard imports
+import signal
+import threading
+
+# project imports
+from backend import flask_app
+from backend.logger import LOGGER
+from backend.camera import Camera
+from backend.broadcaster import Broadcaster
+from backend.motion import MOTION_DETECTION, MotionDetector
+from backend.clips import CLIP_RECORDING, ClipRecorder
+from backend.shared_frames import (
+    CLIP_REQUESTS_OFFSET,
+    DAEMON_HEARTBEAT_OFFSET,
+    HEARTBEAT_TIMEOUT,
+    READER_HEARTBEAT_OFFSET,
+    SharedFrameRing,
+)
+
+# seconds between checks for readers while the camera is stopped
+IDLE_INTERVAL = 0.1
+
+# seconds to wait for a frame before checking for readers again
+PUBLISH_TIMEOUT = 1
+
+
+class CaptureDaemon:
+    """
+    Runs the camera while any worker is reading frames and copies each camera
+    frame into the shared ring, unannotated, so captures are saved as the
+    camera took them and the workers annotate their stream frames. Workers
+    keep the camera warm themselves, so the camera is stopped as soon as the
+    workers stop asking for frames.
+    Clips requested by the workers are handed to the recorder, if any.
+    """
+
+    def __init__(self, ring, camera=None, recorder=None):
+        self.ring = ring
+        self.camera = camera or Camera()
+        self.broadcaster = Broadcaster(self.camera, keep_warm=0)
+        self.recorder = recorder
+        self.event = threading.Event()
+
+    def wanted(self):
+        """
+        Whether any worker asked for frames recently.
+        """
+        return self.ring.heartbeat(READER_HEARTBEAT_OFFSET) < HEARTBEAT_TIMEOUT
+
+    def run(self):
+        """
+        Publish frames until stopped.
+        """
+        LOGGER.info("Capture daemon running...")
+        subscriber = None
+        clip_requests = self.ring.counter(CLIP_REQUESTS_OFFSET)
+        while not self.event.is_set():
+            self.ring.beat(DAEMON_HEARTBEAT_OFFSET)
+
+            requests = self.ring.counter(CLIP_REQUESTS_OFFSET)
+            if requests != clip_requests:
+                clip_requests = requests
+                if self.recorder is not None:
+                    self.recorder.trigger()
+
+            if self.wanted():
+                if subscriber is None:
+                    LOGGER.info("Workers asked for frames, starting camera...")
+                    subscriber = self.broadcaster.subscribe()
+            elif subscriber is not None:
+                LOGGER.info("Workers stopped asking for frames")
+                self.broadcaster.unsubscribe(subscriber)
+                subscriber = None
+
+            if subscriber is None:
+                self.event.wait(IDLE_INTERVAL)
+                continue
+
+            frame = subscriber.get(PUBLISH_TIMEOUT)
+            data = frame and self.camera.output.copy(frame)
+            if data is not None:
+                self.ring.publish(data, frame.timestamp)
+
+        if subscriber is not None:
+            self.broadcaster.unsubscribe(subscriber)
+        with self.broadcaster.lock:
+            if self.camera.is_running():
+                self.camera.stop()
+        LOGGER.info("Capture daemon stopped.")
+
+    def stop(self, *_):
+        """
+        Stop publishing frames. Usable as a signal handler.
+        """
+        self.event.set()
+
+
+def main():
+    """
+    Run the capture daemon until it is terminated.
+    """
+    ring = SharedFrameRing.create()
+    daemon = CaptureDaemon(ring)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+
+    # motion detection and clip recording run wherever the camera is owned
+    if CLIP_RECORDING:
+        daemon.recorder = ClipRecorder(daemon.broadcaster, flask_app)
+        daemon.recorder.start()
+    detector = None
+    if MOTION_DETECTION:
+        detector = MotionDetector(
+            daemon.broadcaster, flask_app, recorder=daemon.recorder
+        )
+        detector.start()
+    try:
+        daemon.run()
+    finally:
+        if detector is not None:
+            detector.stop()
+        if daemon.recorder is not None:
+            daemon.recorder.stop()
+        ring.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Capture job queue. Capture requests are queued as jobs and answered right
+away, and a worker thread takes the pictures, merging the requests made while
+a job waits into one capture.
+"""
+
+# standard imports
+import contextlib
+import fcntl
+import os
+import threading
+import time
+from datetime import datetime
+
+# project imports
+from backend import db
+from backend.logger import LOGGER
+from backend.models import CaptureJob
+
+# seconds a job waits for more requests to merge into it before it's captured
+CAPTURE_COALESCE_WINDOW = float(os.environ.get("PICAM_CAPTURE_COALESCE_WINDOW", 0.5))
+
+# lock file held while capturing, so captures of all processes take turns
+CAPTURE_LOCK_PATH = os.environ.get("PICAM_CAPTURE_LOCK", "/tmp/picam_capture.lock")
+
+# seconds between checks for jobs queued by other processes
+CAPTURE_POLL_INTERVAL = 5
+
+
+@contextlib.contextmanager
+def capture_lock(path=CAPTURE_LOCK_PATH):
+    """
+    Hold the capture lock, waiting for the capture holding it.
+
+    :param path: the lock file
+    """
+    descriptor = os.open(path, os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(descriptor, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(descriptor)
+
+
+class CaptureQueue:
+    """
+    Runs the queued capture jobs. A job is claimed with an UPDATE on its
+    status, so a job queued by one process is captured once even with a
+    worker in every process, and captures are made under the capture lock so
+    the camera is never opened twice at once. The worker is started by the
+    first submit in each process, as threads don't survive uWSGI forking the
+    workers.
+    """
+
+    def __init__(self, broadcaster, app, window=CAPTURE_COALESCE_WINDOW):
+        self.broadcaster = broadcaster
+        self.app = app
+        self.window = window
+        self.wake = threading.Event()
+        self.event = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the worker thread.
+        """
+        self.event.clear()
+        self.thread = threading.Thread(target=self.worker_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the worker thread, once the capture in progress is done.
+        """
+        self.event.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self):
+        """
+        Queue a capture, merging it into the queued job if there is one.
+
+        :return: the job
+        """
+        job = (
+            CaptureJob.query.filter_by(status=CaptureJob.QUEUED)
+            .order_by(CaptureJob.id.desc())
+            .first()
+        )
+        merged = (
+            job is not None
+            and CaptureJob.query.filter_by(id=job.id, status=CaptureJob.QUEUED).update(
+                {CaptureJob.requests: CaptureJob.requests + 1},
+                synchronize_session=False,
+            )
+        )
+        if not merged:
+            job = CaptureJob()
+            db.session.add(job)
+        db.session.commit()
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.start()
+        self.wake.set()
+        return job
+
+    def worker_thread(self):
+        """
+        Thread that runs the jobs once their coalescing window is over.
+        """
+        while not self.event.is_set():
+            self.wake.wait(CAPTURE_POLL_INTERVAL)
+            self.wake.clear()
+            if self.event.wait(self.window):
+                return
+            try:
+                self.run_pending()
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.error("Failed running capture jobs: %s", error)
+
+    def run_pending(self):
+        """
+        Run the queued jobs, oldest first.
+
+        :return: number of jobs this worker ran
+        """
+        ran = 0
+        with self.app.app_context():
+            queued = (
+                CaptureJob.query.with_entities(CaptureJob.id)
+                .filter_by(status=CaptureJob.QUEUED)
+                .order_by(CaptureJob.id)
+                .all()
+            )
+            for (job_id,) in queued:
+                ran += self.run(job_id)
+        return ran
+
+    def run(self, job_id):
+        """
+        Claim a job and take its picture.
+
+        :param job_id: the job's ID
+        :return: whether this worker claimed the job.
+        """
+        claimed = CaptureJob.query.filter_by(
+            id=job_id, status=CaptureJob.QUEUED
+        ).update({CaptureJob.status: CaptureJob.RUNNING}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            return False
+
+        start = time.time()
+        try:
+            with capture_lock():
+                image = self.broadcaster.take_picture(self.app)
+        except Exception as error:  # pylint: disable=broad-except
+            # the job must not stay running forever
+            LOGGER.error("Failed capturing job %d: %s", job_id, error)
+            image = None
+
+        job = CaptureJob.query.get(job_id)
+        job.status = CaptureJob.DONE if image else CaptureJob.FAILED
+        job.image_id = image.id if image else None
+        job.finished_on = datetime.utcnow()
+        db.session.commit()
+        LOGGER.info(
+            "Capture job %d %s for %d requests in %.2f seconds",
+            job_id,
+            job.status,
+            job.requests,
+            time.time() - start,
+        )
+        return True
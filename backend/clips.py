@@ -0,0 +1,196 @@
+"""
+Clip recorder. Keeps the last seconds of the stream in memory so a clip
+around an event can include what happened before it.
+"""
+
+# standard imports
+import collections
+import os
+import queue
+import threading
+import time
+import uuid
+
+# project imports
+from backend import db
+from backend.logger import LOGGER
+from backend.camera import FRAME_TIMEOUT
+from backend.storage import capture_path
+from backend.models import Clip
+
+# whether to run the clip recorder
+CLIP_RECORDING = os.environ.get("PICAM_CLIPS", "0") == "1"
+
+# seconds of stream kept before and recorded after a trigger
+CLIP_PRE_ROLL = float(os.environ.get("PICAM_CLIP_PRE_ROLL", 5))
+CLIP_POST_ROLL = float(os.environ.get("PICAM_CLIP_POST_ROLL", 5))
+
+# longest clip recorded when triggers keep extending it, in seconds
+CLIP_MAX_LENGTH = 60
+
+# finished clips waiting to be written before new ones are dropped
+WRITE_QUEUE_SIZE = 4
+
+
+class ClipRecorder:
+    """
+    Records clips of the raw camera frames. The last pre-roll seconds of
+    frames are kept in a bounded ring; a trigger takes those and keeps adding
+    frames until the post-roll is over, and a trigger during the post-roll
+    extends the clip. Finished clips are written to disk by a writer thread,
+    so the camera and the viewers never wait on the disk.
+    """
+
+    def __init__(
+        self, broadcaster, app, pre_roll=CLIP_PRE_ROLL, post_roll=CLIP_POST_ROLL
+    ):
+        self.broadcaster = broadcaster
+        self.app = app
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.lock = threading.Lock()
+        self.event = threading.Event()
+        self.threads = []
+        self.writes = queue.Queue(WRITE_QUEUE_SIZE)
+
+        # (timestamp, JPEG bytes) of the pre-roll, and the clip being recorded
+        self.frames = collections.deque()
+        self.recording = None
+
+        # clips written, and dropped because the writer fell behind
+        self.written = 0
+        self.dropped = 0
+
+    def start(self):
+        """
+        Start the recorder and writer threads.
+        """
+        LOGGER.info("Starting clip recorder...")
+        self.event.clear()
+        self.threads = [
+            threading.Thread(target=self.recorder_thread),
+            threading.Thread(target=self.writer_thread),
+        ]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def stop(self):
+        """
+        Stop the threads, once the clips already finished are written.
+        """
+        self.event.set()
+        self.writes.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def trigger(self, now=None):
+        """
+        Record a clip around now, or extend the clip being recorded.
+
+        :param now: time of the trigger, defaults to the current time
+        """
+        now = now or time.time()
+        with self.lock:
+            if self.recording is None:
+                LOGGER.info("Recording clip...")
+                self.recording = {
+                    "start": now,
+                    "until": now + self.post_roll,
+                    "frames": list(self.frames),
+                }
+            else:
+                self.recording["until"] = min(
+                    now + self.post_roll, self.recording["start"] + CLIP_MAX_LENGTH
+                )
+
+    def add(self, timestamp, data):
+        """
+        Add a frame to the pre-roll and to the clip being recorded.
+
+        :param timestamp: the frame's capture time
+        :param data: the frame's JPEG bytes
+        """
+        with self.lock:
+            self.frames.append((timestamp, data))
+            while self.frames[0][0] < timestamp - self.pre_roll:
+                self.frames.popleft()
+
+            if self.recording is None:
+                return
+            self.recording["frames"].append((timestamp, data))
+            if timestamp < self.recording["until"]:
+                return
+            frames = self.recording["frames"]
+            self.recording = None
+
+        try:
+            self.writes.put_nowait(frames)
+        except queue.Full:
+            LOGGER.error("Clip writer fell behind, dropping clip")
+            self.dropped += 1
+
+    def recorder_thread(self):
+        """
+        Thread that keeps the camera running and adds its frames.
+        """
+        subscriber = self.broadcaster.subscribe()
+        output = self.broadcaster.camera.output
+        try:
+            while not self.event.is_set():
+                frame = subscriber.get(FRAME_TIMEOUT)
+                if frame is None:
+                    continue
+                data = output.copy(frame)
+                if data is not None:
+                    self.add(frame.timestamp, bytes(data))
+        finally:
+            self.broadcaster.unsubscribe(subscriber)
+
+    def writer_thread(self):
+        """
+        Thread that writes finished clips.
+        """
+        while True:
+            frames = self.writes.get()
+            if frames is None:
+                LOGGER.info("Clip recorder stopped.")
+                return
+            try:
+                self.write(frames)
+            except OSError as error:
+                LOGGER.error("Failed writing clip: %s", error)
+
+    def write(self, frames):
+        """
+        Write a clip as concatenated JPEG frames (MJPEG) and add it to the db.
+
+        :param frames: the clip's (timestamp, JPEG bytes)
+        :return: the Clip
+        """
+        with self.app.app_context():
+            path, url = capture_path(self.app, f"{uuid.uuid4()}.mjpeg")
+            with open(path, "wb") as clip_file:
+                for _, data in frames:
+                    clip_file.write(data)
+
+            clip = Clip(
+                url=url, frames=len(frames), duration=frames[-1][0] - frames[0][0]
+            )
+            db.session.add(clip)
+            db.session.commit()
+            LOGGER.info("Saved %d frame clip to path %s", len(frames), path)
+            self.written += 1
+            return clip
+
+    def stats(self):
+        """
+        Counters for the recorder.
+        """
+        return {
+            "buffered": len(self.frames),
+            "recording": self.recording is not None,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
@@ -2,6 +2,9 @@
 Application wide constants.
 """
 
+# code to send to frontend when a request was queued to be done later
+ACCEPTED_CODE = 202
+
 # error code to send to frontend when login creds are invalid
 INVALID_CREDS_CODE = 401
 
@@ -10,3 +13,22 @@ TOKEN_EXPIRED_CODE = 498
 
 # error code to send to frontend when request is malformed
 MALFORMED_REQUEST_CODE = 400
+
+# error code to send to frontend when login attempts are throttled
+TOO_MANY_REQUESTS_CODE = 429
+
+# error code to send to frontend when the server is too busy to log in
+SERVICE_UNAVAILABLE_CODE = 503
+
+# images per page of /api/images, by default and at most
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# most image ids deleted by one bulk delete
+MAX_BULK_DELETE = 1000
+
+# name of the VersionStamp bumped on every change to the images
+IMAGES_VERSION = "images"
+
+# name of the VersionStamp bumped on every change to the revoked tokens
+REVOKED_TOKENS_VERSION = "revoked_tokens"
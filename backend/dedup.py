@@ -0,0 +1,154 @@
+"""
+Perceptual hashes of the captures, used to skip or mark captures that are
+near-identical to the previous one, as scheduled and motion captures of a
+static scene mostly are.
+"""
+
+# standard imports
+import concurrent.futures
+import os
+
+# installed imports
+import numpy
+from PIL import Image as PILImage
+
+# project imports
+from backend import db
+from backend.logger import LOGGER
+from backend.models import Image
+from backend.storage import image_path
+
+# what happens to a capture near-identical to the previous one: nothing, it's
+# marked as a duplicate of the previous one's original, or it's not kept
+DEDUP_OFF = "off"
+DEDUP_MARK = "mark"
+DEDUP_SKIP = "skip"
+DEDUP_MODE = os.environ.get("PICAM_DEDUP", DEDUP_OFF)
+
+# most bits two hashes may differ by for their captures to be near-identical
+DEDUP_DISTANCE = int(os.environ.get("PICAM_DEDUP_DISTANCE", 4))
+
+# the hash compares the brightness of neighbouring pixels on a grid this many
+# pixels square, giving a hash of its square in bits
+HASH_SIZE = 8
+
+# threads hashing captures during a backfill; PIL releases the GIL while
+# decoding
+HASH_WORKERS = int(os.environ.get("PICAM_HASH_WORKERS", 2))
+
+# captures backfilled per batch
+BACKFILL_BATCH_SIZE = 256
+
+
+def image_hash(path):
+    """
+    The difference hash of a capture. libjpeg decodes it in grayscale at the
+    smallest scale still covering the grid, an eighth of its resolution for a
+    capture, which is most of the cost.
+
+    :param path: where the capture is stored
+    :return: the hash, as hex
+    """
+    with PILImage.open(path) as image:
+        image.draft("L", (HASH_SIZE + 1, HASH_SIZE))
+        image = image.convert("L")
+    grid = image.resize((HASH_SIZE + 1, HASH_SIZE), PILImage.BILINEAR)
+    pixels = numpy.asarray(grid, dtype=numpy.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return numpy.packbits(bits).tobytes().hex()
+
+
+def try_image_hash(path):
+    """
+    The hash of a capture, logging failures.
+
+    :return: the hash, None if the capture couldn't be read.
+    """
+    try:
+        return image_hash(path)
+    except OSError as error:
+        LOGGER.error("Failed hashing %s: %s", path, error)
+        return None
+
+
+def distance(first, second):
+    """
+    Number of bits two hashes differ by.
+    """
+    return bin(int(first, 16) ^ int(second, 16)).count("1")
+
+
+def classify(path, max_distance=DEDUP_DISTANCE):
+    """
+    Hash a new capture and compare it with the previous one, or with the
+    previous one's original when that is a duplicate, so a scene drifting a
+    little between captures isn't marked as a duplicate of how it first
+    looked.
+
+    :param path: where the capture is stored
+    :param max_distance: most bits the hashes may differ by for the captures
+                         to be near-identical
+    :return: tuple of the hash and the ID of the original the capture is a
+             duplicate of, None if it isn't one.
+    """
+    phash = try_image_hash(path)
+    previous = (
+        Image.query.with_entities(Image.id, Image.phash, Image.duplicate_of)
+        .order_by(Image.id.desc())
+        .first()
+    )
+    if phash is None or previous is None:
+        return phash, None
+    original = previous
+    if previous.duplicate_of is not None:
+        # None once the original is deleted, the capture starts over
+        original = (
+            Image.query.with_entities(Image.id, Image.phash)
+            .filter(Image.id == previous.duplicate_of)
+            .first()
+        )
+    if original is None or original.phash is None:
+        return phash, None
+    if distance(phash, original.phash) > max_distance:
+        return phash, None
+    return phash, original.id
+
+
+def backfill(app, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Hash every capture without a hash, a batch at a time, with each batch's
+    captures hashed in parallel. Existing captures are only hashed, not
+    marked as duplicates.
+
+    :param app: the application
+    :param batch_size: captures per batch
+    :return: number of captures hashed.
+    """
+    done = 0
+    last_id = 0
+    with app.app_context(), concurrent.futures.ThreadPoolExecutor(
+        max_workers=HASH_WORKERS, thread_name_prefix="hashes"
+    ) as executor:
+        while True:
+            batch = (
+                Image.query.with_entities(Image.id, Image.url)
+                .filter(Image.phash.is_(None), Image.id > last_id)
+                .order_by(Image.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            paths = [image_path(app, url) for _, url in batch]
+            hashes = [
+                {"id": _id, "phash": phash}
+                for (_id, _), phash in zip(batch, executor.map(try_image_hash, paths))
+                if phash is not None
+            ]
+            db.session.bulk_update_mappings(Image, hashes)
+            db.session.commit()
+            done += len(hashes)
+            LOGGER.info("Backfilled hashes up to image %d", last_id)
+    return done
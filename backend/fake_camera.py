@@ -3,13 +3,23 @@ Implementation for the stream.
 """
 
 # standard imports
+import os
 import threading
 import time
 
 # installed imports
+import cv2
+import numpy
 
 # project imports
 from backend.logger import LOGGER
+from backend.overlay import TimestampOverlay
+
+# frames the fake camera alternates between
+FRAME_PATHS = ["test_images/test_frame_1.jpg", "test_images/test_frame_2.jpg"]
+
+# frame used when the frames above are not available
+FALLBACK_FRAME_PATH = "test_images/test_image.jpg"
 
 
 class FakeCamera:
@@ -17,35 +27,92 @@ class FakeCamera:
     Fake camera object for testing on laptop.
     """
 
-    def __init__(self):
+    def __init__(self, framerate=1):
         self.record_loop_thread = threading.Thread(target=self.record_loop)
         self.do_record = False
         self.output = None
+        self.framerate = framerate
+        self.frames = []
+
+        # emulate the firmware annotator of the PiCamera
+        self.annotate_text = ""
+        self.annotate_foreground = None
+        self.annotate_background = None
+        self.overlay = None
+        self.annotated = {}
+        self.annotated_text = None
+
+    @staticmethod
+    def load_frames():
+        """
+        Read the fake frames from disk.
+        """
+        paths = [path for path in FRAME_PATHS if os.path.exists(path)]
+        if not paths:
+            LOGGER.debug("No fake frames, using %s", FALLBACK_FRAME_PATH)
+            paths = [FALLBACK_FRAME_PATH]
+
+        frames = []
+        for path in paths:
+            with open(path, "rb") as frame_file:
+                frame = frame_file.read()
+            # the camera only ever sends JPEGs
+            if not frame.startswith(b"\xff\xd8"):
+                decoded = cv2.imdecode(
+                    numpy.frombuffer(frame, dtype=numpy.uint8), cv2.IMREAD_COLOR
+                )
+                frame = cv2.imencode(".jpg", decoded)[1].tobytes()
+            frames.append(frame)
+        return frames
+
+    def annotate(self, index):
+        """
+        Draw the annotation text on a frame, like the firmware would. Each
+        frame is drawn once per distinct text.
+
+        :param index: index of the frame to annotate
+        :return: the annotated JPEG frame
+        """
+        text = self.annotate_text
+        if text != self.annotated_text:
+            # only frames with the current text are ever needed again
+            self.annotated = {}
+            self.annotated_text = text
+        frame = self.annotated.get(index)
+        if frame is not None:
+            return frame
+
+        if self.overlay is None:
+            self.overlay = TimestampOverlay()
+        decoded = cv2.imdecode(
+            numpy.frombuffer(self.frames[index], dtype=numpy.uint8), cv2.IMREAD_COLOR
+        )
+        self.overlay.apply(decoded, text)
+        frame = self.annotated[index] = cv2.imencode(".jpg", decoded)[1].tobytes()
+        return frame
 
     def record_loop(self):
         """
         Fake camera recording loop
         """
         LOGGER.debug("Starting record loop...")
-        last_index = 1
+        index = 0
 
         while self.do_record:
 
-            # wait a bit between each frame
-            time.sleep(1)
-
             LOGGER.debug("fake camera sending frame...")
             if self.output is None:
                 LOGGER.error("Fake camera output is None...")
-                continue
-
-            # write a fake frame
-            if last_index == 1:
-                last_index = 2
-                self.output.write(open("test_images/test_frame_2.jpg", "rb").read())
             else:
-                last_index = 1
-                self.output.write(open("test_images/test_frame_1.jpg", "rb").read())
+                # write a fake frame
+                index = (index + 1) % len(self.frames)
+                if self.annotate_text:
+                    self.output.write(self.annotate(index))
+                else:
+                    self.output.write(self.frames[index])
+
+            # wait a bit between each frame
+            time.sleep(1 / self.framerate)
 
         LOGGER.debug("Ending record loop.")
 
@@ -64,6 +131,7 @@ class FakeCamera:
         Start the fake camera recording thread
         """
         LOGGER.debug("Fake camera starting...")
+        self.frames = self.load_frames()
         self.output = output
         self.do_record = True
         self.record_loop_thread.start()
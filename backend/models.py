@@ -3,13 +3,36 @@ Models for the service
 """
 # native imports
 import json
+import time
 from datetime import datetime
 
 # third party imports
 import bcrypt
 from pytz import timezone
+from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
 
-from backend import db
+from backend import db, constants
+
+# creation times are shown in the frontend's timezone, resolved once
+EASTERN = timezone("US/Eastern")
+CREATED_ON_FORMAT = "%m/%d/%y %I:%M:%S EST"
+
+
+def format_created_on(created_on):
+    """
+    Format a creation time for the frontend, the same as strftime with
+    CREATED_ON_FORMAT but a few times faster, which matters when formatting
+    thousands of rows. None of the format's fields depend on the timezone.
+
+    :param created_on: the naive creation time
+    :return: the formatted time
+    """
+    return (
+        f"{created_on.month:02}/{created_on.day:02}/{created_on.year % 100:02} "
+        f"{created_on.hour % 12 or 12:02}:{created_on.minute:02}:"
+        f"{created_on.second:02} EST"
+    )
 
 
 class JsonEncodedDict(db.TypeDecorator):
@@ -70,23 +93,341 @@ class Image(db.Model):
     __tablename__ = "image"
     id = db.Column(db.Integer, primary_key=True)
     url = db.Column(db.String, unique=False, nullable=False)
-    created_on = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    created_on = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, index=True
+    )
+
+    # made in the background after the capture, None until then
+    thumb_url = db.Column(db.String, nullable=True)
+    preview_url = db.Column(db.String, nullable=True)
+
+    # perceptual hash of the capture, and the image it's near-identical to
+    # when duplicates are marked; see dedup
+    phash = db.Column(db.String(16), nullable=True)
+    duplicate_of = db.Column(db.Integer, nullable=True)
 
     def as_json(self):
         """
         JSON representation of this model
         """
-        _created_on = timezone("US/Eastern").localize(self.created_on)
+        _created_on = EASTERN.localize(self.created_on)
         payload = {
             "id": self.id,
             # "user_id": self.user.id, # this is sensitive, let's not reveal it
             "url": self.url,
-            "created_on": _created_on.strftime("%m/%d/%y %I:%M:%S EST"),
+            "thumb_url": self.thumb_url,
+            "preview_url": self.preview_url,
+            "duplicate_of": self.duplicate_of,
+            "created_on": format_created_on(_created_on),
+        }
+
+        return payload
+
+    @classmethod
+    def json_columns(cls):
+        """
+        The columns of the JSON representation, in the order rows_as_json
+        expects them.
+        """
+        return (
+            cls.id,
+            cls.url,
+            cls.thumb_url,
+            cls.preview_url,
+            cls.duplicate_of,
+            cls.created_on,
+        )
+
+    @staticmethod
+    def rows_as_json(rows):
+        """
+        JSON representation of many images, the same as as_json of each, from
+        rows of json_columns rather than model objects, which skips building
+        an object per row.
+
+        :param rows: tuples of json_columns
+        :return: list of the images' JSON
+        """
+        return [
+            {
+                "id": _id,
+                "url": url,
+                "thumb_url": thumb_url,
+                "preview_url": preview_url,
+                "duplicate_of": duplicate_of,
+                "created_on": format_created_on(created_on),
+            }
+            for _id, url, thumb_url, preview_url, duplicate_of, created_on in rows
+        ]
+
+    @classmethod
+    def page(
+        cls, before_id=None, limit=constants.DEFAULT_PAGE_SIZE, since=None, until=None
+    ):
+        """
+        A page of images, newest first. Pages are keyed on the id of the last
+        image of the previous page rather than an offset, so every page costs
+        the same however deep it is.
+
+        :param before_id: only images older than this one
+        :param limit: most images in the page
+        :param since: only images created at or after this UTC datetime
+        :param until: only images created before this UTC datetime
+        :return: the page's JSON, with the before_id of the next page, None
+                 if this is the last page.
+        """
+        query = cls.query
+        if before_id is not None:
+            query = query.filter(cls.id < before_id)
+        if since is not None:
+            query = query.filter(cls.created_on >= since)
+        if until is not None:
+            query = query.filter(cls.created_on < until)
+        rows = (
+            query.with_entities(*cls.json_columns())
+            .order_by(cls.id.desc())
+            .limit(limit + 1)
+            .all()
+        )
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return {
+            "images": cls.rows_as_json(rows),
+            "has_more": has_more,
+            "next_before_id": rows[-1][0] if has_more else None,
+        }
+
+
+class Clip(db.Model):
+    """
+    A clip of the stream around an event, stored as concatenated JPEG frames.
+    """
+
+    __tablename__ = "clip"
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String, unique=False, nullable=False)
+    frames = db.Column(db.Integer, nullable=False)
+    duration = db.Column(db.Float, nullable=False)
+    created_on = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def as_json(self):
+        """
+        JSON representation of this model
+        """
+        _created_on = EASTERN.localize(self.created_on)
+        payload = {
+            "id": self.id,
+            "url": self.url,
+            "frames": self.frames,
+            "duration": self.duration,
+            "created_on": format_created_on(_created_on),
         }
 
         return payload
 
 
+class Schedule(db.Model):
+    """
+    Captures taken every interval seconds between two hours of the day.
+    """
+
+    __tablename__ = "schedule"
+    id = db.Column(db.Integer, primary_key=True)
+    interval = db.Column(db.Integer, nullable=False)
+
+    # local hours the schedule is active from and until, wrapping around
+    # midnight when the start is after the end, and all day when they're equal
+    start_hour = db.Column(db.Integer, nullable=False, default=0)
+    end_hour = db.Column(db.Integer, nullable=False, default=0)
+
+    # unix time of the start of the last interval captured
+    last_slot = db.Column(db.Float, nullable=True)
+    created_on = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def active_at(self, hour):
+        """
+        Whether the schedule is active during a local hour of the day.
+        """
+        if self.start_hour == self.end_hour:
+            return True
+        if self.start_hour < self.end_hour:
+            return self.start_hour <= hour < self.end_hour
+        return hour >= self.start_hour or hour < self.end_hour
+
+    def as_json(self):
+        """
+        JSON representation of this model
+        """
+        return {
+            "id": self.id,
+            "interval": self.interval,
+            "start_hour": self.start_hour,
+            "end_hour": self.end_hour,
+        }
+
+
+class Timelapse(db.Model):
+    """
+    A video of the images taken in a time range.
+    """
+
+    BUILDING = "building"
+    DONE = "done"
+    FAILED = "failed"
+
+    __tablename__ = "timelapse"
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String, unique=False, nullable=False)
+    status = db.Column(db.String(16), nullable=False, default=BUILDING)
+    since = db.Column(db.DateTime, nullable=False)
+    until = db.Column(db.DateTime, nullable=False)
+    fps = db.Column(db.Integer, nullable=False)
+    frames = db.Column(db.Integer, nullable=False, default=0)
+    created_on = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def as_json(self):
+        """
+        JSON representation of this model
+        """
+        return {
+            "id": self.id,
+            "url": self.url,
+            "status": self.status,
+            "since": self.since.isoformat(),
+            "until": self.until.isoformat(),
+            "fps": self.fps,
+            "frames": self.frames,
+            "created_on": format_created_on(self.created_on),
+        }
+
+
+class CaptureJob(db.Model):
+    """
+    A queued capture. Capture requests made while a job is still queued are
+    merged into it, so they share one picture.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    __tablename__ = "capture_job"
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(16), nullable=False, default=QUEUED, index=True)
+
+    # capture requests merged into this job
+    requests = db.Column(db.Integer, nullable=False, default=1)
+
+    # the captured Image once done, not a foreign key so it can be deleted
+    image_id = db.Column(db.Integer, nullable=True)
+    created_on = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_on = db.Column(db.DateTime, nullable=True)
+
+    def as_json(self):
+        """
+        JSON representation of this model
+        """
+        image = Image.query.get(self.image_id) if self.image_id else None
+        return {
+            "id": self.id,
+            "status": self.status,
+            "requests": self.requests,
+            "image": image.as_json() if image is not None else None,
+        }
+
+
+class VersionStamp(db.Model):
+    """
+    A counter bumped on every change to a table. It lives in the db so every
+    worker process sees the same version, and it is bumped in the same
+    transaction as the change so it never runs ahead of or behind the data.
+    """
+
+    __tablename__ = "version_stamp"
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def current(cls, name):
+        """
+        The current version, 0 if it was never bumped.
+        """
+        stamp = cls.query.get(name)
+        return stamp.version if stamp is not None else 0
+
+    @classmethod
+    def bump(cls, name):
+        """
+        Bump the version in the current transaction, which the caller commits.
+        The increment is done by the db so concurrent bumps are not lost.
+        """
+        bumped = cls.query.filter_by(name=name).update(
+            {cls.version: cls.version + 1}, synchronize_session=False
+        )
+        if not bumped:
+            db.session.add(cls(name=name, version=1))
+
+
+class LoginBucket(db.Model):
+    """
+    A token bucket throttling login attempts, kept in the db so every worker
+    process draws from the same bucket.
+    """
+
+    __tablename__ = "login_bucket"
+    key = db.Column(db.String(160), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+
+    # unix time of the last attempt, which tokens is as of
+    updated = db.Column(db.Float, nullable=False, index=True)
+
+    @classmethod
+    def take(cls, key, burst, rate, now=None):
+        """
+        Take a token for an attempt. The refill and the take are one UPDATE,
+        so concurrent attempts can't both take the last token.
+
+        :param key: the bucket's key
+        :param burst: most tokens the bucket holds
+        :param rate: tokens added per second
+        :param now: unix time of the attempt, defaults to the current time
+        :return: whether there was a token to take.
+        """
+        now = now or time.time()
+        refilled = cls.tokens + (now - cls.updated) * rate
+        level = case([(refilled > burst, burst)], else_=refilled)
+        taken = cls.query.filter(cls.key == key, level >= 1).update(
+            {cls.tokens: level - 1, cls.updated: now}, synchronize_session=False
+        )
+        if not taken and cls.query.get(key) is None:
+            db.session.add(cls(key=key, tokens=burst - 1, updated=now))
+            taken = True
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # another process made the bucket first, take from theirs
+            db.session.rollback()
+            return cls.take(key, burst, rate, now)
+        return bool(taken)
+
+    @classmethod
+    def prune(cls, idle, now=None):
+        """
+        Delete the buckets unused for idle seconds, which are full again.
+
+        :param idle: seconds after which a bucket is full
+        :param now: unix time to prune up to, defaults to the current time
+        :return: number of buckets pruned
+        """
+        pruned = cls.query.filter(cls.updated < (now or time.time()) - idle).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+        return pruned
+
+
 class RevokedTokenModel(db.Model):
     """
     Store revoked tokens
@@ -94,13 +435,17 @@ class RevokedTokenModel(db.Model):
 
     __tablename__ = "revoked_tokens"
     id = db.Column(db.Integer, primary_key=True)
-    jti = db.Column(db.String(120))
+    jti = db.Column(db.String(120), index=True)
+
+    # when the token expires, after which it can be pruned
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
 
     def add(self):
         """
         Add a token to the revoked tokens list
         """
         db.session.add(self)
+        VersionStamp.bump(constants.REVOKED_TOKENS_VERSION)
         db.session.commit()
 
     @classmethod
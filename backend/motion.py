@@ -0,0 +1,192 @@
+"""
+Motion detection on the live frames, taking a picture when something moves.
+"""
+
+# standard imports
+import os
+import threading
+import time
+
+# installed imports
+import cv2
+import numpy
+
+# project imports
+from backend.logger import LOGGER
+from backend.camera import FRAME_TIMEOUT
+
+# whether to run the motion detector
+MOTION_DETECTION = os.environ.get("PICAM_MOTION", "0") == "1"
+
+# analyze one in this many frames
+MOTION_EVERY = int(os.environ.get("PICAM_MOTION_EVERY", 4))
+
+# fraction of the pixels that must change for the frame to count as motion
+MOTION_FRACTION = float(os.environ.get("PICAM_MOTION_FRACTION", 0.02))
+
+# seconds between motion captures
+MOTION_COOLDOWN = float(os.environ.get("PICAM_MOTION_COOLDOWN", 10))
+
+# frames are decoded at a quarter of their resolution, in grayscale, which
+# libjpeg does for a fraction of the cost of a full decode
+DECODE_FLAGS = cv2.IMREAD_REDUCED_GRAYSCALE_4
+
+# gray levels a pixel must differ from the background by to count as changed
+PIXEL_THRESHOLD = 25
+
+# weight of each analyzed frame in the running background average
+BACKGROUND_WEIGHT = 0.05
+
+
+class MotionDetector:
+    """
+    Compares frames against a running average of the previous ones and takes
+    a picture when enough of the frame changed, also recording a clip when
+    given a ClipRecorder. The camera is kept running
+    for as long as the detector runs. All buffers are allocated on the first
+    frame and reused for every frame after it.
+    """
+
+    def __init__(
+        self,
+        broadcaster,
+        app,
+        every=MOTION_EVERY,
+        fraction=MOTION_FRACTION,
+        cooldown=MOTION_COOLDOWN,
+        recorder=None,
+    ):
+        self.broadcaster = broadcaster
+        self.recorder = recorder
+        self.app = app
+        self.every = every
+        self.fraction = fraction
+        self.cooldown = cooldown
+        self.event = threading.Event()
+        self.thread = None
+        self.sequence = 0
+        self.last_trigger = 0
+
+        # float32 background average, current frame and scratch, changed mask
+        self.background = None
+        self.gray = None
+        self.diff = None
+        self.mask = None
+
+        # frames analyzed, captures taken, and the last changed fraction
+        self.analyzed = 0
+        self.triggered = 0
+        self.changed = 0.0
+
+    def start(self):
+        """
+        Start the detector thread.
+        """
+        LOGGER.info("Starting motion detector...")
+        self.event.clear()
+        self.thread = threading.Thread(target=self.detector_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the detector thread.
+        """
+        self.event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def detector_thread(self):
+        """
+        Thread that analyzes the frames of the running camera.
+        """
+        subscriber = self.broadcaster.subscribe()
+        output = self.broadcaster.camera.output
+        try:
+            while not self.event.is_set():
+                frame = subscriber.get(FRAME_TIMEOUT)
+                # frames that aren't due aren't even copied
+                if frame is None or not self.due(frame.sequence):
+                    continue
+                data = output.copy(frame)
+                if data is not None:
+                    self.process(frame.sequence, data)
+        finally:
+            self.broadcaster.unsubscribe(subscriber)
+            LOGGER.info("Motion detector stopped.")
+
+    def due(self, sequence):
+        """
+        Whether a frame is due for analysis, being one in every frames.
+
+        :param sequence: sequence number of the frame
+        """
+        return not self.sequence or sequence - self.sequence >= self.every
+
+    def process(self, sequence, data):
+        """
+        Analyze a frame if it is due, taking a picture if it shows motion.
+
+        :param sequence: sequence number of the frame
+        :param data: the frame's JPEG bytes
+        :return: whether a picture was taken.
+        """
+        if not self.due(sequence):
+            return False
+        self.sequence = sequence
+
+        self.changed = self.analyze(data)
+        if self.changed < self.fraction:
+            return False
+        if time.time() - self.last_trigger < self.cooldown:
+            return False
+
+        LOGGER.info("Motion detected, %.1f%% changed, capturing...", self.changed * 100)
+        self.last_trigger = time.time()
+        self.triggered += 1
+        if self.recorder is not None:
+            self.recorder.trigger()
+        with self.app.app_context():
+            return self.broadcaster.take_picture(self.app)
+
+    def analyze(self, data):
+        """
+        Compare a frame against the background and fold it into the average.
+
+        :param data: the frame's JPEG bytes
+        :return: the fraction of the pixels that changed.
+        """
+        decoded = cv2.imdecode(numpy.frombuffer(data, numpy.uint8), DECODE_FLAGS)
+        if decoded is None:
+            LOGGER.error("Motion detector failed decoding frame")
+            return 0.0
+        self.analyzed += 1
+
+        if self.background is None or self.background.shape != decoded.shape:
+            self.background = decoded.astype(numpy.float32)
+            self.gray = numpy.empty_like(self.background)
+            self.diff = numpy.empty_like(self.background)
+            self.mask = numpy.empty(decoded.shape, dtype=bool)
+            return 0.0
+
+        numpy.copyto(self.gray, decoded)
+        numpy.subtract(self.gray, self.background, out=self.diff)
+
+        # background += weight * diff, reusing gray as scratch
+        numpy.multiply(self.diff, BACKGROUND_WEIGHT, out=self.gray)
+        numpy.add(self.background, self.gray, out=self.background)
+
+        numpy.abs(self.diff, out=self.diff)
+        numpy.greater(self.diff, PIXEL_THRESHOLD, out=self.mask)
+        return numpy.count_nonzero(self.mask) / self.mask.size
+
+    def stats(self):
+        """
+        Counters for the detector.
+        """
+        return {
+            "analyzed": self.analyzed,
+            "triggered": self.triggered,
+            "changed": self.changed,
+        }
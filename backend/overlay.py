@@ -0,0 +1,122 @@
+"""
+Timestamp overlay for the live stream.
+"""
+
+# standard imports
+import math
+
+# installed imports
+from PIL import ImageFont, ImageDraw, Image
+import numpy
+
+# project imports
+from backend.logger import LOGGER
+
+FONT_FILE = "/usr/share/fonts/truetype/freefont/FreeSans.ttf"
+FONT_SIZE = 25
+
+# smallest font size used when scaling the font down for smaller frames
+MIN_FONT_SIZE = 10
+
+# characters rendered into the atlas up front; anything else is added lazily
+CHARSET = "Live stream: 0123456789-"
+
+# margins around the text, in pixels
+MARGIN_X = 10
+MARGIN_Y = 5
+
+
+def load_font(font_file=FONT_FILE, font_size=FONT_SIZE):
+    """
+    Load the overlay font, falling back to PIL's default font.
+    """
+    try:
+        return ImageFont.truetype(font_file, font_size)
+    except OSError:
+        LOGGER.error("Failed opening font resource %s, using default", font_file)
+        return ImageFont.load_default()
+
+
+class TimestampOverlay:
+    """
+    Draws white-on-black text banners into decoded frames. Glyphs are rendered
+    once into an atlas, banners are composed from the atlas once per distinct
+    text and written into frames by array slicing.
+    """
+
+    def __init__(self, font=None, charset=CHARSET):
+        self.font = font or load_font()
+        self.line_height = self._line_height()
+        self.glyphs = {}
+        for char in charset:
+            self._glyph(char)
+        self.cached = (None, None)
+
+    def _line_height(self):
+        """
+        Height of a line of text in the overlay font.
+        """
+        if hasattr(self.font, "getmetrics"):
+            ascent, descent = self.font.getmetrics()
+            return ascent + descent
+        return self.font.getsize(CHARSET)[1]
+
+    def _glyph(self, char):
+        """
+        Get the coverage mask of a character, rendering it into the atlas if
+        it isn't there yet.
+        """
+        glyph = self.glyphs.get(char)
+        if glyph is not None:
+            return glyph
+
+        if hasattr(self.font, "getlength"):
+            advance = self.font.getlength(char)
+        else:
+            advance = self.font.getsize(char)[0]
+
+        mask = Image.new("L", (max(1, math.ceil(advance)), self.line_height), 0)
+        ImageDraw.Draw(mask).text((0, 0), char, fill=255, font=self.font)
+        glyph = self.glyphs[char] = numpy.asarray(mask)
+        return glyph
+
+    def render(self, text):
+        """
+        Compose the banner for text from the glyph atlas. The last banner is
+        kept, so a text that only changes once a second is composed once a
+        second.
+
+        :param text: the text to render
+        :return: the banner as a 2D uint8 array
+        """
+        cached_text, cached_banner = self.cached
+        if text == cached_text:
+            return cached_banner
+
+        glyphs = [self._glyph(char) for char in text]
+        width = sum(glyph.shape[1] for glyph in glyphs) + 2 * MARGIN_X
+        banner = numpy.zeros((self.line_height + 2 * MARGIN_Y, width), numpy.uint8)
+
+        x = MARGIN_X
+        for glyph in glyphs:
+            height, advance = glyph.shape
+            target = banner[MARGIN_Y : MARGIN_Y + height, x : x + advance]
+            numpy.maximum(target, glyph, out=target)
+            x += advance
+
+        self.cached = (text, banner)
+        return banner
+
+    def apply(self, frame, text):
+        """
+        Write the banner for text into the top left corner of a frame.
+
+        :param frame: decoded frame, as a (height, width, channels) array
+        :param text: the text to render
+        :return: the frame, modified in place
+        """
+        banner = self.render(text)
+        height = min(banner.shape[0], frame.shape[0])
+        width = min(banner.shape[1], frame.shape[1])
+        frame[:height, :width] = banner[:height, :width, numpy.newaxis]
+        return frame
@@ -0,0 +1,335 @@
+"""
+Retention of the captures. Keeps the captures under a byte quota and a
+maximum age, and reconciles the capture directory with the db.
+"""
+
+# standard imports
+import fcntl
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+# project imports
+from backend import db, constants
+from backend.logger import LOGGER
+from backend.camera import TEST_SRC_IMAGE_PATH
+from backend.models import Clip, Image, Timelapse, VersionStamp
+from backend.storage import (
+    DERIVED_SUFFIXES,
+    capture_dir,
+    derived_path,
+    remove_capture,
+)
+
+# most megabytes the capture directory may hold, 0 for no quota
+RETENTION_QUOTA_MB = int(os.environ.get("PICAM_RETENTION_QUOTA_MB", 0))
+
+# days captures are kept for, 0 to keep them until the quota is reached
+RETENTION_MAX_AGE_DAYS = float(os.environ.get("PICAM_RETENTION_MAX_AGE_DAYS", 0))
+
+# seconds between retention passes
+RETENTION_INTERVAL = int(os.environ.get("PICAM_RETENTION_INTERVAL", 600))
+
+# lock file held during a pass, so one process runs it at a time
+RETENTION_LOCK_PATH = os.environ.get(
+    "PICAM_RETENTION_LOCK", "/tmp/picam_retention.lock"
+)
+
+# file the last pass's counters are written to, as the pass runs in one
+# process and every worker reports them
+RETENTION_STATS_PATH = os.environ.get(
+    "PICAM_RETENTION_STATS", "/tmp/picam_retention.json"
+)
+
+# images handled per transaction
+RETENTION_BATCH_SIZE = 200
+
+# seconds a file without a row is left alone, as captures are written to disk
+# before their row is committed
+ORPHAN_GRACE = 300
+
+
+class RetentionEngine:
+    """
+    Runs retention passes. A pass scans the capture directory once, deletes
+    the rows whose capture is gone and the files no row refers to, then the
+    expired captures and the oldest captures over the quota. Rows are handled
+    in batches with a commit per batch, so the gallery is never locked for
+    long. The counters of the last pass are kept in a file, so any process
+    can report them.
+    """
+
+    def __init__(
+        self,
+        app,
+        quota_mb=RETENTION_QUOTA_MB,
+        max_age_days=RETENTION_MAX_AGE_DAYS,
+        batch_size=RETENTION_BATCH_SIZE,
+        stats_path=RETENTION_STATS_PATH,
+    ):
+        self.app = app
+        self.quota = quota_mb * 1024 * 1024
+        self.max_age = timedelta(days=max_age_days)
+        self.batch_size = batch_size
+        self.stats_path = stats_path
+
+    @property
+    def last_pass(self):
+        """
+        Counters for the last pass, whichever process ran it.
+
+        :return: the counters, None if no pass ran yet.
+        """
+        try:
+            with open(self.stats_path) as stats_file:
+                return json.load(stats_file)
+        except (OSError, ValueError):
+            return None
+
+    def save_stats(self, stats):
+        """
+        Write the counters of a pass, replacing the previous ones at once so
+        readers never see a partial file.
+
+        :param stats: the counters
+        """
+        partial_path = self.stats_path + ".partial"
+        try:
+            with open(partial_path, "w") as stats_file:
+                json.dump(stats, stats_file)
+            os.replace(partial_path, self.stats_path)
+        except OSError as error:
+            LOGGER.error("Failed saving retention stats: %s", error)
+
+    def retention_thread(self, event):
+        """
+        Thread that runs a pass every interval until the event is set, unless
+        another process is running one.
+
+        :param event: the event signalling shutdown
+        """
+        while not event.wait(RETENTION_INTERVAL):
+            descriptor = os.open(RETENTION_LOCK_PATH, os.O_RDWR | os.O_CREAT)
+            try:
+                fcntl.flock(descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.run_pass()
+            except BlockingIOError:
+                LOGGER.debug("Retention pass running in another process")
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.error("Failed retention pass: %s", error)
+            finally:
+                os.close(descriptor)
+        LOGGER.debug("Retention engine exiting...")
+
+    def run_pass(self, now=None):
+        """
+        Reconcile the captures with the db and enforce the age and the quota.
+
+        :param now: the UTC time of the pass, defaults to the current time
+        :return: counters for the pass
+        """
+        now = now or datetime.utcnow()
+        start = time.perf_counter()
+        with self.app.app_context():
+            files = self.scan()
+            stats = {"files": len(files)}
+            stats["missing"], captures = self.remove_missing(files, now)
+            referenced = captures | self.other_files()
+            stats["orphans"] = self.remove_orphans(files, referenced, now)
+            stats["expired"] = self.expire(now, files)
+            stats["over_quota"] = self.enforce_quota(files, captures)
+            stats["bytes"] = sum(size for size, _ in files.values())
+            stats["capture_bytes"] = self.captures_size(files, captures)
+        stats["seconds"] = time.perf_counter() - start
+        LOGGER.info("Retention pass took %.2f seconds: %s", stats["seconds"], stats)
+        self.save_stats(stats)
+        return stats
+
+    def scan(self):
+        """
+        The files in the capture directory.
+
+        :return: dict of file names to their size and modification time
+        """
+        files = {}
+        with os.scandir(capture_dir(self.app)) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files[entry.name] = (stat.st_size, stat.st_mtime)
+        return files
+
+    @staticmethod
+    def other_files():
+        """
+        Names of the files stored with the captures that aren't captures: the
+        clips, the timelapses and, in debug mode, the test image.
+        """
+        # debug captures are copies of the test image, which lives among them
+        names = {os.path.basename(TEST_SRC_IMAGE_PATH)}
+        for model in (Clip, Timelapse):
+            for (url,) in model.query.with_entities(model.url):
+                names.add(os.path.basename(url))
+        return names
+
+    def remove_missing(self, files, now):
+        """
+        Delete the images whose capture is gone. Only images added before
+        the pass are checked, as newer ones may have been written after the
+        scan.
+
+        :param files: the scanned files
+        :param now: the UTC time of the pass, before the scan
+        :return: tuple of the number of images deleted and the names of the
+                 files of the remaining images.
+        """
+        captures = set()
+        missing = 0
+        last_id = 0
+        while True:
+            batch = (
+                Image.query.with_entities(Image.id, Image.url)
+                .filter(Image.id > last_id, Image.created_on < now)
+                .order_by(Image.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not batch:
+                return missing, captures
+            last_id = batch[-1][0]
+
+            gone = []
+            for _id, url in batch:
+                if os.path.basename(url) not in files:
+                    gone.append((_id, url))
+                    continue
+                captures.update(self.file_names(url))
+            if gone:
+                LOGGER.error("Deleting %d images whose capture is gone", len(gone))
+                missing += self.delete(gone, files)
+
+    def remove_orphans(self, files, referenced, now):
+        """
+        Remove the files no row refers to, once they're past the grace period.
+        Nothing is removed in debug mode, where captures are stored among the
+        repository's test images and fake camera frames.
+
+        :param files: the scanned files, which removed files are dropped from
+        :param referenced: names of the files the rows refer to
+        :param now: the UTC time of the pass
+        :return: number of files removed
+        """
+        if self.app.debug:
+            return 0
+        cutoff = (now - datetime(1970, 1, 1)).total_seconds() - ORPHAN_GRACE
+        orphans = [
+            name
+            for name, (_, mtime) in files.items()
+            if name not in referenced and mtime < cutoff
+        ]
+        directory = capture_dir(self.app)
+        for name in orphans:
+            LOGGER.info("Removing orphaned file %s", name)
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+            del files[name]
+        return len(orphans)
+
+    def expire(self, now, files):
+        """
+        Delete the captures older than the maximum age, oldest first.
+
+        :param now: the UTC time of the pass
+        :param files: the scanned files, which deleted files are dropped from
+        :return: number of captures deleted
+        """
+        if not self.max_age:
+            return 0
+        expired = 0
+        while True:
+            batch = (
+                Image.query.with_entities(Image.id, Image.url)
+                .filter(Image.created_on < now - self.max_age)
+                .order_by(Image.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not batch:
+                return expired
+            expired += self.delete(batch, files)
+
+    def enforce_quota(self, files, captures):
+        """
+        Delete the oldest captures until they are under the quota. Only the
+        captures and the files derived from them count against it, as they
+        are all that is deleted to get under it.
+
+        :param files: the scanned files, which deleted files are dropped from
+        :param captures: names of the files of the images
+        :return: number of captures deleted
+        """
+        if not self.quota:
+            return 0
+        total = self.captures_size(files, captures)
+        deleted = 0
+        while total > self.quota:
+            batch = (
+                Image.query.with_entities(Image.id, Image.url)
+                .order_by(Image.id)
+                .limit(self.batch_size)
+                .all()
+            )
+            if not batch:
+                break
+            # only as many as it takes to get under the quota
+            for index, (_, url) in enumerate(batch):
+                total -= self.size(url, files)
+                if total <= self.quota:
+                    batch = batch[: index + 1]
+                    break
+            deleted += self.delete(batch, files)
+        return deleted
+
+    @staticmethod
+    def file_names(url):
+        """
+        Names of the files of a capture and the files derived from it.
+        """
+        name = os.path.basename(url)
+        return [name] + [derived_path(name, suffix) for suffix in DERIVED_SUFFIXES]
+
+    @staticmethod
+    def captures_size(files, captures):
+        """
+        Bytes taken by the captures and the files derived from them.
+        """
+        return sum(files[name][0] for name in captures if name in files)
+
+    def size(self, url, files):
+        """
+        Bytes taken by a capture and the files derived from it.
+        """
+        return sum(files[name][0] for name in self.file_names(url) if name in files)
+
+    def delete(self, batch, files):
+        """
+        Delete a batch of captures, from disk and from the db.
+
+        :param batch: (id, url) of the captures
+        :param files: the scanned files, which deleted files are dropped from
+        :return: number of captures deleted
+        """
+        for _, url in batch:
+            remove_capture(self.app, url)
+            for name in self.file_names(url):
+                files.pop(name, None)
+
+        Image.query.filter(Image.id.in_([_id for _id, _ in batch])).delete(
+            synchronize_session=False
+        )
+        VersionStamp.bump(constants.IMAGES_VERSION)
+        db.session.commit()
+        return len(batch)
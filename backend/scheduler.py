@@ -0,0 +1,72 @@
+"""
+Capture scheduler, taking pictures on the intervals of the schedules.
+"""
+
+# standard imports
+import time
+from datetime import datetime
+
+# installed imports
+from sqlalchemy import or_
+
+# project imports
+from backend import db
+from backend.logger import LOGGER
+from backend.models import Schedule
+
+# seconds between checks for due captures
+SCHEDULER_TICK = 1
+
+
+class Scheduler:
+    """
+    Queues a capture for every interval of every active schedule. A single
+    scheduler runs, started when the views are imported, which under uWSGI
+    is in the master before it forks the workers. Each interval is claimed
+    with an UPDATE on the schedule's last slot, so a restarted scheduler
+    doesn't capture an interval again.
+    """
+
+    def __init__(self, app, captures):
+        self.app = app
+        self.captures = captures
+
+    def scheduler_thread(self, event):
+        """
+        Thread that queues the due captures until the event is set.
+
+        :param event: the event signalling shutdown
+        """
+        while not event.wait(SCHEDULER_TICK):
+            try:
+                self.run_due()
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.error("Failed running schedules: %s", error)
+        LOGGER.debug("Scheduler exiting...")
+
+    def run_due(self, now=None):
+        """
+        Queue a capture for each schedule whose current interval wasn't
+        captured yet.
+
+        :param now: unix time to run the schedules at, defaults to now
+        :return: number of captures queued
+        """
+        now = now or time.time()
+        hour = datetime.fromtimestamp(now).hour
+        queued = 0
+        with self.app.app_context():
+            for schedule in Schedule.query.all():
+                if not schedule.active_at(hour):
+                    continue
+                slot = now - now % schedule.interval
+                claimed = Schedule.query.filter(
+                    Schedule.id == schedule.id,
+                    or_(Schedule.last_slot.is_(None), Schedule.last_slot < slot),
+                ).update({Schedule.last_slot: slot}, synchronize_session=False)
+                db.session.commit()
+                if claimed:
+                    LOGGER.info("Schedule %d is due, queueing capture", schedule.id)
+                    self.captures.submit()
+                    queued += 1
+        return queued
@@ -0,0 +1,385 @@
+"""
+Frames shared between the capture daemon and the web workers through a
+memory-mapped ring.
+"""
+
+# standard imports
+import mmap
+import os
+import struct
+import threading
+import time
+
+# project imports
+from backend.logger import LOGGER
+from backend.camera import START_TIMEOUT, Camera, Frame
+
+# whether the web workers read frames from the capture daemon instead of
+# owning the camera themselves
+CAPTURE_DAEMON = os.environ.get("PICAM_CAPTURE_DAEMON", "0") == "1"
+
+# the ring lives in shared memory when /dev/shm is available
+SHARED_RING_PATH = os.environ.get("PICAM_SHARED_RING", "/dev/shm/picam_frames")
+SHARED_RING_SLOTS = 8
+SHARED_RING_SLOT_SIZE = 1024 * 1024
+
+# seconds between checks for a new frame while a reader waits
+POLL_INTERVAL = 0.005
+
+# seconds after which a heartbeat is considered stale; readers heartbeat to
+# ask for frames, the daemon heartbeats to show it is alive
+HEARTBEAT_TIMEOUT = 3
+
+# seconds between the heartbeats of a worker asking for frames
+HEARTBEAT_INTERVAL = HEARTBEAT_TIMEOUT / 3
+
+MAGIC = b"PCAM"
+
+# ring header: magic, slot count, slot size, latest sequence number, daemon
+# heartbeat, reader heartbeat, clip requests
+HEADER = struct.Struct("<4sIIQddQ")
+SEQUENCE_FIELD = struct.Struct("<Q")
+SEQUENCE_OFFSET = 12
+HEARTBEAT_FIELD = struct.Struct("<d")
+DAEMON_HEARTBEAT_OFFSET = 20
+READER_HEARTBEAT_OFFSET = 28
+COUNTER_FIELD = struct.Struct("<Q")
+CLIP_REQUESTS_OFFSET = 36
+
+# slot header: sequence number, capture timestamp, frame length
+SLOT_HEADER = struct.Struct("<QdI")
+
+
+class SharedFrameRing:
+    """
+    Ring of frame slots in a memory-mapped file. The capture daemon is the
+    only writer; any number of processes read from it. A slot's sequence
+    number is cleared while the slot is rewritten, so readers check it before
+    and after copying a frame to know the copy is intact.
+    """
+
+    def __init__(self, path, mapping):
+        self.path = path
+        self.map = mapping
+        _, self.slots, self.slot_size, _, _, _, _ = HEADER.unpack_from(mapping, 0)
+        self.data_offset = HEADER.size + self.slots * SLOT_HEADER.size
+
+    @classmethod
+    def create(cls, path=SHARED_RING_PATH, slots=SHARED_RING_SLOTS, slot_size=None):
+        """
+        Create the ring file. An existing ring is reused in place rather than
+        replaced, so readers that already mapped it keep reading from it when
+        the daemon restarts.
+
+        :return: the SharedFrameRing, for writing
+        """
+        slot_size = slot_size or SHARED_RING_SLOT_SIZE
+        size = HEADER.size + slots * (SLOT_HEADER.size + slot_size)
+        ring_file = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(ring_file).st_size < size:
+                os.ftruncate(ring_file, size)
+            mapping = mmap.mmap(ring_file, size)
+        finally:
+            os.close(ring_file)
+
+        # carry on from the previous daemon's sequence numbers so readers
+        # don't mistake new frames for ones they have seen
+        magic, old_slots, old_slot_size, sequence, _, _, requests = HEADER.unpack_from(
+            mapping
+        )
+        if magic != MAGIC or (old_slots, old_slot_size) != (slots, slot_size):
+            sequence = requests = 0
+        HEADER.pack_into(
+            mapping, 0, MAGIC, slots, slot_size, sequence, time.time(), 0.0, requests
+        )
+        LOGGER.info("Created shared frame ring %s (%d bytes)", path, size)
+        return cls(path, mapping)
+
+    @classmethod
+    def attach(cls, path=SHARED_RING_PATH):
+        """
+        Map an existing ring file.
+
+        :return: the SharedFrameRing, None if there is no ring to attach to.
+        """
+        try:
+            with open(path, "r+b") as ring_file:
+                mapping = mmap.mmap(ring_file.fileno(), 0)
+        except (OSError, ValueError):
+            return None
+        if mapping[:4] != MAGIC:
+            LOGGER.error("%s is not a shared frame ring", path)
+            mapping.close()
+            return None
+        return cls(path, mapping)
+
+    @property
+    def sequence(self):
+        """
+        Sequence number of the latest frame.
+        """
+        return SEQUENCE_FIELD.unpack_from(self.map, SEQUENCE_OFFSET)[0]
+
+    def heartbeat(self, offset):
+        """
+        Seconds since the heartbeat at offset.
+        """
+        return time.time() - HEARTBEAT_FIELD.unpack_from(self.map, offset)[0]
+
+    def beat(self, offset):
+        """
+        Update the heartbeat at offset.
+        """
+        HEARTBEAT_FIELD.pack_into(self.map, offset, time.time())
+
+    def counter(self, offset):
+        """
+        Value of the counter at offset.
+        """
+        return COUNTER_FIELD.unpack_from(self.map, offset)[0]
+
+    def increment(self, offset):
+        """
+        Increment the counter at offset. Increments racing each other from
+        several processes may count once, which is fine for requests.
+        """
+        COUNTER_FIELD.pack_into(self.map, offset, self.counter(offset) + 1)
+
+    def publish(self, data, timestamp):
+        """
+        Write a frame into the next slot.
+
+        :param data: the frame's bytes
+        :param timestamp: the frame's capture time
+        :return: the frame's sequence number, None if it doesn't fit a slot.
+        """
+        if len(data) > self.slot_size:
+            LOGGER.error("Frame of %d bytes doesn't fit the shared ring", len(data))
+            return None
+
+        sequence = self.sequence + 1
+        index = (sequence - 1) % self.slots
+        header_offset = HEADER.size + index * SLOT_HEADER.size
+        data_offset = self.data_offset + index * self.slot_size
+
+        SLOT_HEADER.pack_into(self.map, header_offset, 0, 0.0, 0)
+        self.map[data_offset : data_offset + len(data)] = data
+        SLOT_HEADER.pack_into(self.map, header_offset, sequence, timestamp, len(data))
+        SEQUENCE_FIELD.pack_into(self.map, SEQUENCE_OFFSET, sequence)
+        return sequence
+
+    def read(self, sequence):
+        """
+        Copy a frame out of the ring.
+
+        :param sequence: sequence number of the frame
+        :return: the Frame, None if its slot holds another frame by now.
+        """
+        index = (sequence - 1) % self.slots
+        header_offset = HEADER.size + index * SLOT_HEADER.size
+        data_offset = self.data_offset + index * self.slot_size
+
+        slot_sequence, timestamp, length = SLOT_HEADER.unpack_from(
+            self.map, header_offset
+        )
+        if slot_sequence != sequence:
+            return None
+        data = self.map[data_offset : data_offset + length]
+        if SLOT_HEADER.unpack_from(self.map, header_offset)[0] != sequence:
+            return None
+        return Frame(sequence, timestamp, data)
+
+    def close(self):
+        """
+        Unmap the ring.
+        """
+        self.map.close()
+
+
+class SharedFrameOutput:
+    """
+    Reads frames published by the capture daemon, with the same reader API as
+    StreamingOutput. Frames are copied out of the ring when read, so their
+    data stays valid.
+    """
+
+    def __init__(self, path=SHARED_RING_PATH):
+        self.path = path
+        self.ring = None
+
+        # whether to ask the daemon for frames
+        self.demand = False
+
+    def attached(self):
+        """
+        Attach to the ring if not attached yet.
+
+        :return: whether the ring is available.
+        """
+        if self.ring is None:
+            self.ring = SharedFrameRing.attach(self.path)
+        return self.ring is not None
+
+    @property
+    def sequence(self):
+        """
+        Sequence number of the latest frame.
+        """
+        if not self.attached():
+            return 0
+        return self.ring.sequence
+
+    def daemon_alive(self):
+        """
+        Whether the capture daemon is running.
+        """
+        if not self.attached():
+            return False
+        return self.ring.heartbeat(DAEMON_HEARTBEAT_OFFSET) < HEARTBEAT_TIMEOUT
+
+    def request_clip(self):
+        """
+        Ask the capture daemon to record a clip.
+
+        :return: whether the daemon is there to get the request.
+        """
+        if not self.daemon_alive():
+            return False
+        self.ring.increment(CLIP_REQUESTS_OFFSET)
+        return True
+
+    def latest(self):
+        """
+        Get the latest frame.
+
+        :return: the Frame, None if no frame was published yet.
+        """
+        return self.next_frame(0, 0)
+
+    def next_frame(self, after_sequence=0, timeout=None):
+        """
+        Wait for a frame newer than after_sequence and get the latest frame.
+
+        :param after_sequence: sequence number of the last frame the reader saw
+        :param timeout: seconds to wait for a newer frame, None waits forever
+        :return: the Frame, None if no newer frame arrived within the timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if self.attached():
+                if self.demand:
+                    self.ring.beat(READER_HEARTBEAT_OFFSET)
+                sequence = self.ring.sequence
+                if sequence > after_sequence:
+                    frame = self.ring.read(sequence)
+                    if frame is not None:
+                        return frame
+                    # overwritten while reading, try again
+                    continue
+            if deadline is not None and time.time() >= deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    @staticmethod
+    def is_current(frame):
+        """
+        Frames are copies, so they stay current.
+        """
+        return True
+
+    @staticmethod
+    def copy(frame):
+        """
+        Frames are copies already.
+        """
+        return frame.data
+
+
+class SharedCamera(Camera):
+    """
+    Camera owned by the capture daemon. Starting and stopping this camera
+    asks the daemon for frames or stops asking, with a keep-alive thread
+    heartbeating for as long as it runs; the frames themselves are read from
+    the shared ring as the camera captured them and are annotated here.
+    """
+
+    def __init__(self, path=SHARED_RING_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.output = SharedFrameOutput(path)
+        self.running = False
+        self.stopped = threading.Event()
+        self.keep_alive = None
+
+    def start(self, timeout=START_TIMEOUT):
+        """
+        Ask the daemon for frames and wait for the first one.
+
+        :param timeout: seconds to wait for the first frame
+        :return: whether a frame arrived within the timeout.
+        """
+        LOGGER.debug("Asking capture daemon for frames...")
+        started = time.time()
+        self.running = True
+        self.output.demand = True
+        self.stopped.clear()
+        if self.keep_alive is None:
+            self.keep_alive = threading.Thread(target=self.keep_alive_thread)
+            self.keep_alive.daemon = True
+            self.keep_alive.start()
+        self.metrics["starts"] += 1
+
+        if self.output.next_frame(self.output.sequence, timeout) is None:
+            LOGGER.error("No frame from the capture daemon after %d seconds", timeout)
+            return False
+
+        self.metrics["time_to_first_frame"] = time.time() - started
+        LOGGER.info(
+            "Capture daemon streaming, first frame after %.3f seconds",
+            self.metrics["time_to_first_frame"],
+        )
+        return True
+
+    def stop(self):
+        """
+        Stop asking the daemon for frames.
+        """
+        LOGGER.debug("No longer asking capture daemon for frames")
+        self.running = False
+        self.output.demand = False
+        self.stopped.set()
+        if self.keep_alive is not None:
+            self.keep_alive.join()
+            self.keep_alive = None
+
+    def keep_alive_thread(self):
+        """
+        Thread that asks the daemon for frames until the camera is stopped,
+        so the daemon keeps the camera running while nothing reads frames.
+        """
+        while True:
+            if self.output.attached():
+                self.output.ring.beat(READER_HEARTBEAT_OFFSET)
+            if self.stopped.wait(HEARTBEAT_INTERVAL):
+                return
+
+    def is_running(self):
+        """
+        Whether frames are being asked for and the daemon is there to send them.
+        """
+        return self.running and self.output.daemon_alive()
+
+    def take_picture(self, app):
+        """
+        Take a picture from the daemon's stream, asking for frames just for
+        the capture if nobody else is.
+
+        :param app: the application
+        :return: the new Image, None if the capture failed.
+        """
+        started = not self.running and self.start()
+        try:
+            return super().take_picture(app)
+        finally:
+            if started:
+                self.stop()
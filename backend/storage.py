@@ -0,0 +1,89 @@
+"""
+Where captures are stored on disk and served from.
+"""
+
+# standard imports
+import os
+
+# /var/www/html/cam is writable by 'pi', and nginx routes *.jpg requests to
+# this location. Debug captures are served from test_images by Flask.
+CAPTURE_DIR = "/var/www/html/cam"
+DEBUG_CAPTURE_DIR = "test_images"
+
+# suffixes of the files derived from a capture, stored next to it
+PREVIEW_SUFFIX = "_preview.jpg"
+THUMB_SUFFIX = "_thumb.jpg"
+DERIVED_SUFFIXES = (PREVIEW_SUFFIX, THUMB_SUFFIX)
+
+
+def capture_dir(app):
+    """
+    The directory captures are stored in.
+
+    :param app: the application
+    """
+    return DEBUG_CAPTURE_DIR if app.debug else CAPTURE_DIR
+
+
+def capture_path(app, name):
+    """
+    Where a capture is stored and the URL it is served from.
+
+    :param app: the application
+    :param name: file name of the capture
+    :return: tuple of the path and URL
+    """
+    path = os.path.join(capture_dir(app), name)
+    return path, path if app.debug else name
+
+
+def image_path(app, url):
+    """
+    Where the capture served from a URL is stored.
+
+    :param app: the application
+    :param url: URL of the capture, as stored in the db
+    :return: the path
+    """
+    if app.debug:
+        return url
+    return os.path.join(capture_dir(app), url)
+
+
+def derived_path(path, suffix):
+    """
+    Path or URL of a file derived from a capture, such as its thumbnail.
+
+    :param path: path or URL of the capture
+    :param suffix: suffix of the derived file
+    """
+    return os.path.splitext(path)[0] + suffix
+
+
+def remove_capture(app, url):
+    """
+    Remove the capture served from a URL and the files derived from it.
+
+    :param app: the application
+    :param url: URL of the capture, as stored in the db
+    :return: the bytes freed
+    """
+    return remove_capture_files(image_path(app, url))
+
+
+def remove_capture_files(path):
+    """
+    Remove a capture and the files derived from it, any of which may already
+    be gone.
+
+    :param path: path of the capture
+    :return: the bytes freed
+    """
+    freed = 0
+    for file_path in [path] + [derived_path(path, s) for s in DERIVED_SUFFIXES]:
+        try:
+            freed += os.stat(file_path).st_size
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+    return freed
@@ -0,0 +1,282 @@
+"""
+Live stream server. Serves /api/stream.mjpg to any number of viewers from a
+single asyncio event loop, so viewers don't each hold a uWSGI worker. The
+viewers' statistics are served on the same socket, for /api/stream/stats.
+
+Run with python -m backend.stream_server
+"""
+
+# standard imports
+import asyncio
+import collections
+import json
+import os
+import socket
+from urllib.parse import parse_qsl, urlsplit
+
+# installed imports
+from werkzeug.datastructures import MultiDict
+
+# project imports
+from backend import constants, utils
+from backend.logger import LOGGER
+from backend.camera import Camera, DEFAULT_TIER, FRAME_CACHE_SIZE, FRAME_TIMEOUT
+from backend.broadcaster import (
+    FAN_OUT_TIMEOUT,
+    KEEP_WARM_PERIOD,
+    Broadcaster,
+    Subscriber,
+)
+from backend.shared_frames import CAPTURE_DAEMON, SharedCamera
+
+# unix socket nginx proxies the live stream to
+STREAM_SOCKET = os.environ.get("PICAM_STREAM_SOCKET", "/tmp/picam_stream.sock")
+
+STREAM_PATH = "/api/stream.mjpg"
+
+# only reachable through the socket, nginx sends /api/stream/stats to the
+# web workers which ask for these behind their login
+STATS_PATH = "/stats"
+
+# seconds a web worker waits for the statistics
+STATS_TIMEOUT = 1
+
+# seconds a client gets to send its request
+REQUEST_TIMEOUT = 10
+
+# longest request line or header accepted
+MAX_LINE = 8192
+
+# connections waiting to be accepted, enough for a burst of viewers
+BACKLOG = 1024
+
+
+class StreamServer:
+    """
+    Streams the camera to every viewer from one event loop. A single pump
+    task waits for each new camera frame and offers it to every viewer's
+    Subscriber queue; each variant of a frame (quality and tier) is encoded
+    once, off the loop, and the result shared by all viewers asking for it.
+    """
+
+    def __init__(self, camera, keep_warm=KEEP_WARM_PERIOD):
+        self.camera = camera
+        self.broadcaster = Broadcaster(camera, keep_warm)
+        # Subscriber -> asyncio.Event set when frames are queued for it
+        self.viewers = {}
+        self.pump = None
+        self.encoded = collections.OrderedDict()
+
+    async def serve(self, path=STREAM_SOCKET):
+        """
+        Serve the live stream on a unix socket until cancelled.
+
+        :param path: path of the socket
+        """
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(
+            self.handle, path=path, limit=MAX_LINE, backlog=BACKLOG
+        )
+        # let nginx connect
+        os.chmod(path, 0o666)
+        LOGGER.info("Serving live stream on %s", path)
+        async with server:
+            await server.serve_forever()
+
+    async def handle(self, reader, writer):
+        """
+        Handle one HTTP connection.
+        """
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            while True:
+                line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            if len(parts) != 3 or parts[0] != "GET":
+                await self.respond(writer, 405, {"error": "method not allowed"})
+                return
+            url = urlsplit(parts[1])
+            if url.path == STATS_PATH:
+                await self.respond(writer, 200, self.stats())
+                return
+            if url.path != STREAM_PATH:
+                await self.respond(writer, 404, {"error": "not found"})
+                return
+
+            options, error = utils.stream_options(MultiDict(parse_qsl(url.query)))
+            if error:
+                error = {"error": error}
+                await self.respond(writer, constants.MALFORMED_REQUEST_CODE, error)
+                return
+            await self.stream(writer, **options)
+        except (asyncio.TimeoutError, asyncio.LimitOverrunError, ValueError):
+            LOGGER.debug("Dropping malformed or slow request")
+        except ConnectionError:
+            LOGGER.debug("Viewer disconnected")
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def respond(writer, status, payload):
+        """
+        Send a JSON response, with errors shaped like the Flask endpoint's.
+        """
+        body = json.dumps(payload).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+
+    def stats(self):
+        """
+        Statistics for the camera and every viewer.
+        """
+        return {
+            "camera": self.camera.metrics,
+            "subscribers": [subscriber.stats() for subscriber in self.viewers],
+        }
+
+    async def stream(self, writer, max_fps=None, quality=None, tier=DEFAULT_TIER):
+        """
+        Send the live stream to a viewer until it disconnects or the camera
+        stops delivering frames.
+
+        :param writer: the viewer's StreamWriter
+        :param max_fps: most frames per second to send this viewer
+        :param quality: JPEG quality of this viewer's frames
+        :param tier: resolution tier of this viewer's frames
+        """
+        loop = asyncio.get_event_loop()
+        subscriber = Subscriber(max_fps=max_fps, quality=quality, tier=tier)
+        ready = asyncio.Event()
+
+        # starting the camera blocks until its first frame
+        await loop.run_in_executor(None, self.broadcaster.acquire)
+        self.viewers[subscriber] = ready
+        LOGGER.debug("Viewer joined, %d viewer(s)", len(self.viewers))
+        if self.pump is None or self.pump.done():
+            self.pump = loop.create_task(self.pump_frames())
+
+        try:
+            writer.write(
+                "HTTP/1.1 200 OK\r\n"
+                f"Content-Type: {utils.STREAM_MIMETYPE}\r\n"
+                "Cache-Control: no-cache\r\n"
+                "Connection: close\r\n\r\n".encode()
+            )
+            latest = self.camera.output.latest()
+            if latest is not None:
+                subscriber.offer(latest)
+                ready.set()
+
+            while True:
+                try:
+                    await asyncio.wait_for(ready.wait(), FRAME_TIMEOUT)
+                except asyncio.TimeoutError:
+                    LOGGER.error("Failed getting frame.")
+                    return
+                ready.clear()
+                frame = subscriber.get(0)
+                while frame is not None:
+                    data = await self.encode(frame, quality, tier)
+                    if data is None:
+                        subscriber.dropped += 1
+                    else:
+                        subscriber.sent += 1
+                        writer.write(utils.frame_part(data))
+                        await writer.drain()
+                    frame = subscriber.get(0)
+        finally:
+            del self.viewers[subscriber]
+            LOGGER.debug("Viewer left, %d viewer(s)", len(self.viewers))
+            await loop.run_in_executor(None, self.broadcaster.release)
+
+    async def pump_frames(self):
+        """
+        Task that hands every new camera frame to the viewers.
+        """
+        loop = asyncio.get_event_loop()
+        sequence = 0
+        while self.viewers:
+            frame = await loop.run_in_executor(
+                None, self.camera.output.next_frame, sequence, FAN_OUT_TIMEOUT
+            )
+            if frame is None:
+                continue
+            sequence = frame.sequence
+            for subscriber, ready in self.viewers.items():
+                subscriber.offer(frame)
+                if subscriber.queue:
+                    ready.set()
+
+    def encode(self, frame, quality, tier):
+        """
+        Make the stream frame for a quality and tier, once for all viewers.
+
+        :return: a future of the frame's bytes, None if it was overwritten
+                 before it could be read.
+        """
+        key = (frame.sequence, quality, tier)
+        future = self.encoded.get(key)
+        if future is None:
+            future = asyncio.get_event_loop().run_in_executor(
+                None, self.camera.stream_frame, frame, quality, tier
+            )
+            self.encoded[key] = future
+            while len(self.encoded) > FRAME_CACHE_SIZE:
+                self.encoded.popitem(last=False)
+        return future
+
+
+def fetch_stats(path=STREAM_SOCKET, timeout=STATS_TIMEOUT):
+    """
+    Get the statistics from the stream server.
+
+    :param path: path of the stream server's socket
+    :param timeout: seconds to wait for the statistics
+    :return: the statistics, None if the stream server isn't running.
+    """
+    response = b""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.settimeout(timeout)
+            client.connect(path)
+            client.sendall(f"GET {STATS_PATH} HTTP/1.1\r\n\r\n".encode())
+            # the server closes the connection after the response
+            while True:
+                chunk = client.recv(65536)
+                if not chunk:
+                    break
+                response += chunk
+    except OSError as error:
+        LOGGER.debug("No statistics from the stream server: %s", error)
+        return None
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    if not head.startswith(b"HTTP/1.1 200 "):
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+def main():
+    """
+    Run the stream server until it is terminated.
+    """
+    # with the capture daemon owning the camera, read its frames like the
+    # web workers do
+    camera = SharedCamera() if CAPTURE_DAEMON else Camera()
+    asyncio.run(StreamServer(camera).serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -38,7 +38,7 @@ def unauthenticated_client(test_users):
     flask_app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + db_path
     flask_app.config["TESTING"] = True
 
-    app.init_db(db, drop_all=True)
+    app.init_db(drop_all=True)
 
     with flask_app.test_client() as client:
         for test_user in test_users:
@@ -0,0 +1,200 @@
+import threading
+import time
+
+from backend import flask_app, app
+from backend.broadcaster import Broadcaster, Subscriber
+from backend.camera import Frame, StreamingOutput
+
+
+class CountingCamera:
+    """
+    Stand-in for Camera that tracks start/stop calls and passes frames through.
+    """
+
+    def __init__(self):
+        self.output = StreamingOutput()
+        self.running = False
+        self.starts = 0
+        self.stops = 0
+
+    def stream_frame(self, frame, quality=None, tier=None):
+        return self.output.copy(frame)
+
+    def is_running(self):
+        return self.running
+
+    def start(self):
+        self.starts += 1
+        self.running = True
+
+    def stop(self):
+        self.stops += 1
+        self.running = False
+
+
+def test_broadcaster_starts_once_for_many_subscribers():
+    """
+    Test that only the first subscriber starts the camera
+    """
+    camera = CountingCamera()
+    broadcaster = Broadcaster(camera, keep_warm=0.05)
+    subscribers = [broadcaster.subscribe() for _ in range(5)]
+    assert camera.starts == 1
+    assert len(broadcaster.subscribers) == 5
+
+    for subscriber in subscribers[:4]:
+        broadcaster.unsubscribe(subscriber)
+    time.sleep(0.2)
+    assert camera.stops == 0
+    assert camera.is_running()
+
+
+def test_broadcaster_stops_after_grace_period():
+    """
+    Test that the camera stops once the last subscriber has left
+    """
+    camera = CountingCamera()
+    broadcaster = Broadcaster(camera, keep_warm=0.05)
+    broadcaster.unsubscribe(broadcaster.subscribe())
+    assert camera.is_running()
+    time.sleep(0.2)
+    assert camera.stops == 1
+    assert not camera.is_running()
+
+
+def test_broadcaster_resubscribe_within_grace_period():
+    """
+    Test that a subscriber arriving during the grace period keeps the camera up
+    """
+    camera = CountingCamera()
+    broadcaster = Broadcaster(camera, keep_warm=0.1)
+    broadcaster.unsubscribe(broadcaster.subscribe())
+    broadcaster.subscribe()
+    time.sleep(0.3)
+    assert camera.starts == 1
+    assert camera.stops == 0
+
+
+def test_broadcaster_concurrent_subscribers():
+    """
+    Test that concurrent subscribe/unsubscribe keeps an accurate count
+    """
+    camera = CountingCamera()
+    broadcaster = Broadcaster(camera, keep_warm=0.05)
+
+    def viewer():
+        broadcaster.unsubscribe(broadcaster.subscribe())
+
+    threads = [threading.Thread(target=viewer) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not broadcaster.subscribers
+    time.sleep(0.2)
+    assert not camera.is_running()
+
+
+def test_broadcaster_keeps_camera_warm_for_captures():
+    """
+    Test that a capture keeps the camera running for the keep-warm period
+    """
+    camera = CountingCamera()
+    camera.take_picture = lambda app: camera.is_running()
+    broadcaster = Broadcaster(camera, keep_warm=0.1)
+    assert broadcaster.take_picture(flask_app)
+    assert broadcaster.take_picture(flask_app)
+    assert camera.starts == 1
+    time.sleep(0.3)
+    assert not camera.is_running()
+
+
+def test_broadcaster_captures_without_keep_warm():
+    """
+    Test that a capture with keep-warm disabled doesn't start the camera
+    """
+    camera = CountingCamera()
+    camera.take_picture = lambda app: camera.is_running()
+    broadcaster = Broadcaster(camera, keep_warm=0)
+    assert not broadcaster.take_picture(flask_app)
+    assert camera.starts == 0
+
+
+def make_frame(sequence, timestamp=0):
+    return Frame(sequence, timestamp, b"frame")
+
+
+def test_subscriber_drops_oldest_when_full():
+    """
+    Test that a subscriber that falls behind keeps only the newest frames
+    """
+    subscriber = Subscriber(queue_size=2)
+    for sequence in range(1, 6):
+        subscriber.offer(make_frame(sequence))
+    assert subscriber.dropped == 3
+    assert subscriber.get(0).sequence == 4
+    assert subscriber.get(0).sequence == 5
+    assert subscriber.get(0) is None
+
+
+def test_subscriber_limits_fps():
+    """
+    Test that max_fps skips frames arriving faster than the limit
+    """
+    subscriber = Subscriber(max_fps=10, queue_size=100)
+    # 24 fps for one second
+    for sequence in range(1, 25):
+        subscriber.offer(make_frame(sequence, 1000 + sequence / 24))
+    assert 9 <= len(subscriber.queue) <= 11
+    assert subscriber.throttled == 24 - len(subscriber.queue)
+
+
+def test_subscriber_ignores_repeated_frames():
+    """
+    Test that a frame is only queued once
+    """
+    subscriber = Subscriber()
+    subscriber.offer(make_frame(1))
+    subscriber.offer(make_frame(1))
+    assert len(subscriber.queue) == 1
+
+
+def test_broadcaster_fans_out_frames():
+    """
+    Test that every subscriber gets the frames written by the camera
+    """
+    camera = CountingCamera()
+    broadcaster = Broadcaster(camera, keep_warm=0.05)
+    subscribers = [broadcaster.subscribe() for _ in range(3)]
+
+    camera.output.write(b"\xff\xd8one\xff\xd9")
+    for subscriber in subscribers:
+        frame = broadcaster.next_frame(subscriber, timeout=5)
+        assert frame.sequence == 1
+        assert frame.data == b"\xff\xd8one\xff\xd9"
+        assert subscriber.sent == 1
+
+    stats = broadcaster.stats()
+    assert [stat["sent"] for stat in stats] == [1, 1, 1]
+    for subscriber in subscribers:
+        broadcaster.unsubscribe(subscriber)
+    camera.stop()
+
+
+def test_stream_rejects_invalid_limits():
+    """
+    Test that the stream endpoint validates max_fps and quality
+    """
+    with flask_app.test_client() as client:
+        res = client.get("/api/stream.mjpg?max_fps=0")
+        assert 400 == res.status_code
+        assert "error" in res.json
+
+        res = client.get("/api/stream.mjpg?quality=101")
+        assert 400 == res.status_code
+        assert "error" in res.json
+
+        res = client.get("/api/stream.mjpg?tier=huge")
+        assert 400 == res.status_code
+        assert "error" in res.json
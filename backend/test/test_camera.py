@@ -0,0 +1,277 @@
+import os
+import threading
+import time
+
+import cv2
+import numpy
+
+from backend.camera import (
+    ANNOTATE_FIRMWARE,
+    STREAM_RESOLUTION,
+    STREAM_TIERS,
+    Camera,
+    FrameCache,
+    StreamingOutput,
+)
+from backend.fake_camera import FakeCamera
+from backend.models import Image
+from backend import flask_app, thumbnails
+
+
+def test_frame_cache_produces_once_per_key():
+    """
+    Test that concurrent readers of the same frame only process it once
+    """
+    cache = FrameCache()
+    calls = []
+
+    def produce():
+        calls.append(1)
+        time.sleep(0.05)
+        return b"annotated"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get(1, produce)))
+        for _ in range(10)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [b"annotated"] * 10
+
+
+def test_frame_cache_evicts_oldest():
+    """
+    Test that the cache only keeps the newest frames
+    """
+    cache = FrameCache(size=2)
+    for sequence in range(1, 4):
+        cache.get(sequence, lambda: b"frame")
+    assert list(cache.frames) == [2, 3]
+
+
+def jpeg(payload):
+    """
+    A fake JPEG frame.
+    """
+    return b"\xff\xd8" + payload + b"\xff\xd9"
+
+
+def test_streaming_output_publishes_complete_frames():
+    """
+    Test that a frame is published as soon as it is complete
+    """
+    output = StreamingOutput(ring_size=4, slot_size=16)
+    assert output.latest() is None
+
+    output.write(jpeg(b"one"))
+    frame = output.latest()
+    assert frame.sequence == 1
+    assert bytes(frame.data) == jpeg(b"one")
+    assert frame.timestamp > 0
+
+
+def test_streaming_output_handles_partial_writes():
+    """
+    Test that frames written in several chunks are reassembled, and frames
+    missing their end marker are published when the next one starts
+    """
+    output = StreamingOutput(ring_size=4, slot_size=4)
+    output.write(b"\xff\xd8abc")
+    output.write(b"defghij")
+    assert output.latest() is None
+    output.write(b"\xff\xd9")
+    assert output.copy(output.latest()) == b"\xff\xd8abcdefghij\xff\xd9"
+
+    output.write(b"\xff\xd8truncated")
+    output.write(jpeg(b"next"))
+    assert output.sequence == 3
+    assert output.copy(output.next_frame(1)) == jpeg(b"next")
+
+
+def test_streaming_output_detects_overwritten_frames():
+    """
+    Test that readers can tell a frame was overwritten and how many they skipped
+    """
+    output = StreamingOutput(ring_size=2, slot_size=16)
+    output.write(jpeg(b"one"))
+    first = output.latest()
+    assert output.is_current(first)
+
+    for payload in [b"two", b"three", b"four"]:
+        output.write(jpeg(payload))
+    assert not output.is_current(first)
+    assert output.copy(first) is None
+
+    latest = output.latest()
+    assert bytes(latest.data) == jpeg(b"four")
+    assert latest.sequence - first.sequence - 1 == 2
+
+
+def test_fake_camera_emulates_annotator():
+    """
+    Test that the fake camera draws the annotation text on its frames
+    """
+    output = StreamingOutput()
+    fake = FakeCamera(framerate=50)
+    fake.start_recording(output)
+    try:
+        with output.condition:
+            output.condition.wait_for(lambda: output.sequence >= 1, timeout=5)
+        plain = output.copy(output.latest())
+
+        fake.annotate_text = "Live stream: 2021-01-01 00:00:00"
+        sequence = output.sequence
+        with output.condition:
+            output.condition.wait_for(lambda: output.sequence >= sequence + 2, 5)
+        annotated = output.copy(output.latest())
+    finally:
+        fake.stop_recording()
+
+    assert plain in fake.frames
+    assert annotated not in fake.frames
+    assert annotated.startswith(b"\xff\xd8")
+
+
+def test_annotation_ticker_sets_firmware_text():
+    """
+    Test that the ticker keeps the camera's annotation text current
+    """
+    camera = Camera(annotate_mode=ANNOTATE_FIRMWARE)
+    camera.event = threading.Event()
+    fake = FakeCamera()
+    ticker = threading.Thread(target=camera.annotation_ticker, args=(fake,))
+    ticker.start()
+    time.sleep(0.1)
+    camera.event.set()
+    ticker.join()
+    assert fake.annotate_text.startswith("Live stream: ")
+
+
+def test_streaming_output_next_frame_times_out():
+    """
+    Test that waiting for a frame that never comes returns None
+    """
+    output = StreamingOutput()
+    start = time.time()
+    assert output.next_frame(0, timeout=0.1) is None
+    assert time.time() - start < 1
+
+
+def test_streaming_output_next_frame_returns_newer_frame():
+    """
+    Test that a reader behind the writer gets the latest frame right away, and
+    a reader that is caught up waits for the next one
+    """
+    output = StreamingOutput()
+    for payload in [b"one", b"two", b"three"]:
+        output.write(jpeg(payload))
+    assert output.next_frame(0, timeout=0).sequence == 3
+    assert output.next_frame(3, timeout=0) is None
+
+    writer = threading.Timer(0.05, output.write, args=(jpeg(b"four"),))
+    writer.start()
+    frame = output.next_frame(3, timeout=5)
+    writer.join()
+    assert frame.sequence == 4
+    assert bytes(frame.data) == jpeg(b"four")
+
+
+def test_camera_next_frame_not_started():
+    """
+    Test that asking a stopped camera for a frame doesn't hang
+    """
+    camera = Camera()
+    assert camera.next_frame(0, timeout=0.1) is None
+
+
+def camera_with_frame(**kwargs):
+    """
+    A camera whose output holds one full resolution frame.
+    """
+    camera = Camera(**kwargs)
+    image = numpy.full(STREAM_RESOLUTION[::-1] + (3,), 128, numpy.uint8)
+    data = cv2.imencode(".jpg", image)[1].tobytes()
+    camera.output.write(data)
+    return camera, camera.output.latest()
+
+
+def test_camera_stream_tiers():
+    """
+    Test that each tier is scaled to its resolution from a single decode
+    """
+    camera, frame = camera_with_frame()
+    decodes = []
+    decode_frame = camera.decode_frame
+    camera.decode_frame = lambda frame: decodes.append(1) or decode_frame(frame)
+
+    for tier, size in STREAM_TIERS.items():
+        data = camera.stream_frame(frame, tier=tier)
+        decoded = cv2.imdecode(numpy.frombuffer(data, numpy.uint8), cv2.IMREAD_COLOR)
+        assert decoded.shape[1::-1] == (size or STREAM_RESOLUTION)
+        # asking again is served from the cache
+        assert camera.stream_frame(frame, tier=tier) is data
+
+    assert len(decodes) == 1
+
+
+def test_camera_firmware_mode_passes_frames_through():
+    """
+    Test that frames annotated by the firmware aren't re-encoded
+    """
+    camera, frame = camera_with_frame(annotate_mode=ANNOTATE_FIRMWARE)
+    assert camera.stream_frame(frame) == bytes(frame.data)
+    assert camera.stream_frame(frame, quality=50) != bytes(frame.data)
+
+
+def test_take_picture_from_running_stream(unauthenticated_client, monkeypatch):
+    """
+    Test that a capture while streaming saves the latest stream frame and
+    queues its thumbnails
+    """
+    submitted = []
+    monkeypatch.setattr(
+        thumbnails, "submit", lambda app, image_id, path, url: submitted.append(url)
+    )
+    camera, frame = camera_with_frame()
+    camera.event = threading.Event()
+    camera.camera_thread = threading.Thread(target=camera.event.wait)
+    camera.camera_thread.start()
+    flask_app.debug = True
+    try:
+        start = time.time()
+        assert camera.take_picture(flask_app)
+        assert time.time() - start < 1
+        assert camera.is_running()
+
+        with flask_app.app_context():
+            image = Image.query.one()
+        with open(image.url, "rb") as image_file:
+            assert image_file.read() == bytes(frame.data)
+        assert submitted == [image.url]
+        os.remove(image.url)
+    finally:
+        flask_app.debug = False
+        camera.event.set()
+        camera.camera_thread.join()
+
+
+def test_camera_start_waits_for_first_frame():
+    """
+    Test that starting the camera returns once the first frame arrives, and
+    reports how long that took
+    """
+    camera = Camera()
+    start = time.time()
+    try:
+        assert camera.start(timeout=5)
+        assert time.time() - start < 2
+        assert camera.output.sequence >= 1
+        assert camera.metrics["starts"] == 1
+        assert 0 < camera.metrics["time_to_first_frame"] < 2
+    finally:
+        camera.stop()
@@ -0,0 +1,84 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from backend import flask_app
+from backend.captures import CaptureQueue, capture_lock
+from backend.models import CaptureJob, Image
+
+
+def fake_broadcaster(images):
+    """
+    A broadcaster whose pictures come from a list, None once it runs out.
+    """
+    return SimpleNamespace(take_picture=lambda app: images.pop(0) if images else None)
+
+
+def test_capture_requests_merge(unauthenticated_client):
+    """
+    Test that requests made while a job is queued share its capture
+    """
+    with flask_app.app_context():
+        image = Image(url="image.jpg")
+        # a window long enough that the jobs are run here rather than by the
+        # worker
+        captures = CaptureQueue(fake_broadcaster([image]), flask_app, window=60)
+        first = captures.submit().id
+        assert captures.submit().id == first
+        assert captures.submit().id == first
+
+        assert captures.run_pending() == 1
+        job = CaptureJob.query.get(first)
+        assert job.status == CaptureJob.DONE
+        assert job.requests == 3
+
+        second = captures.submit().id
+        assert second != first
+        assert captures.run_pending() == 1
+        assert CaptureJob.query.get(second).status == CaptureJob.FAILED
+        assert captures.run_pending() == 0
+        captures.stop()
+
+
+def test_capture_queue_worker(unauthenticated_client):
+    """
+    Test that the worker thread is started by the first submit and runs the
+    job, and started again when it's gone, as it is in a forked uWSGI worker
+    """
+    captures = CaptureQueue(fake_broadcaster([]), flask_app, window=0)
+    captures.thread = threading.Thread(target=lambda: None)
+    captures.thread.start()
+    captures.thread.join()
+    try:
+        with flask_app.app_context():
+            job_id = captures.submit().id
+        assert captures.thread.is_alive()
+        for _ in range(100):
+            with flask_app.app_context():
+                if CaptureJob.query.get(job_id).status == CaptureJob.FAILED:
+                    break
+            time.sleep(0.05)
+        else:
+            assert False, "job never ran"
+    finally:
+        captures.stop()
+
+
+def test_capture_lock(tmp_path):
+    """
+    Test that the capture lock is held by one capture at a time
+    """
+    path = str(tmp_path / "lock")
+    order = []
+
+    def capture():
+        with capture_lock(path):
+            order.append("second")
+
+    with capture_lock(path):
+        thread = threading.Thread(target=capture)
+        thread.start()
+        time.sleep(0.2)
+        order.append("first")
+    thread.join()
+    assert order == ["first", "second"]
@@ -0,0 +1,72 @@
+import os
+import time
+
+from backend import flask_app
+from backend.clips import ClipRecorder
+from backend.models import Clip
+
+
+def test_clip_recorder_keeps_pre_roll():
+    """
+    Test that only the last pre-roll seconds of frames are kept
+    """
+    recorder = ClipRecorder(None, flask_app, pre_roll=2)
+    for second in range(10):
+        recorder.add(second, b"frame")
+    assert [timestamp for timestamp, _ in recorder.frames] == [7, 8, 9]
+
+
+def test_clip_recorder_records_around_trigger():
+    """
+    Test that a clip gets the pre-roll and the post-roll, and triggers during
+    the post-roll extend it
+    """
+    recorder = ClipRecorder(None, flask_app, pre_roll=1, post_roll=1)
+    now = time.time()
+    recorder.add(now - 0.5, b"before")
+    recorder.trigger(now)
+    recorder.add(now + 0.5, b"after")
+    recorder.trigger(now + 0.5)
+    recorder.add(now + 1.2, b"extended")
+    assert recorder.writes.empty()
+
+    recorder.add(now + 2.5, b"done")
+    frames = recorder.writes.get_nowait()
+    assert [data for _, data in frames] == [b"before", b"after", b"extended", b"done"]
+    assert recorder.recording is None
+
+
+def test_clip_recorder_writes_clip(authenticated_client):
+    """
+    Test that a finished clip is written to disk and listed
+    """
+    recorder = ClipRecorder(None, flask_app)
+    flask_app.debug = True
+    try:
+        frames = [(1.0, b"\xff\xd8one\xff\xd9"), (1.5, b"\xff\xd8two\xff\xd9")]
+        recorder.writes.put(frames)
+        recorder.writes.put(None)
+        recorder.writer_thread()
+    finally:
+        flask_app.debug = False
+
+    with flask_app.app_context():
+        clip = Clip.query.one()
+    assert clip.frames == 2
+    assert clip.duration == 0.5
+    with open(clip.url, "rb") as clip_file:
+        assert clip_file.read() == b"\xff\xd8one\xff\xd9\xff\xd8two\xff\xd9"
+    os.remove(clip.url)
+
+    res = authenticated_client.get("/api/clips")
+    assert 200 == res.status_code
+    assert [clip["frames"] for clip in res.json] == [2]
+
+
+def test_post_clip_disabled(authenticated_client):
+    """
+    Test that requesting a clip with the recorder disabled fails
+    """
+    res = authenticated_client.post("/api/clips")
+    assert 400 == res.status_code
+    assert "error" in res.json
@@ -0,0 +1,101 @@
+import os
+
+import numpy
+from PIL import Image as PILImage
+
+from backend import db, dedup, flask_app
+from backend.camera import Camera
+from backend.models import Image
+
+
+def write_capture(path, seed):
+    """
+    Write a 1024x768 capture of random blocks.
+
+    :return: the path
+    """
+    blocks = numpy.random.RandomState(seed).randint(0, 255, (12, 16), numpy.uint8)
+    image = PILImage.fromarray(blocks).resize((1024, 768), PILImage.NEAREST)
+    image.convert("RGB").save(path, "JPEG")
+    return str(path)
+
+
+def test_image_hash(tmp_path):
+    """
+    Test that near-identical captures hash alike and different ones don't
+    """
+    first = dedup.image_hash(write_capture(tmp_path / "first.jpg", 1))
+    assert len(first) == 16
+
+    with PILImage.open(tmp_path / "first.jpg") as image:
+        image.save(tmp_path / "again.jpg", "JPEG", quality=50)
+    again = dedup.image_hash(str(tmp_path / "again.jpg"))
+    other = dedup.image_hash(write_capture(tmp_path / "other.jpg", 2))
+
+    assert dedup.distance(first, again) <= dedup.DEDUP_DISTANCE
+    assert dedup.distance(first, other) > dedup.DEDUP_DISTANCE
+
+
+def test_add_image_dedup(unauthenticated_client, tmp_path, monkeypatch):
+    """
+    Test that duplicate captures are marked or skipped
+    """
+    paths = [
+        write_capture(tmp_path / f"{index}.jpg", seed)
+        for index, seed in enumerate((1, 1, 1, 2))
+    ]
+    with flask_app.app_context():
+        monkeypatch.setattr(dedup, "DEDUP_MODE", dedup.DEDUP_MARK)
+        originals = [Camera.add_image(flask_app, path, path) for path in paths[:2]]
+        assert originals[1].duplicate_of == originals[0].id
+
+        monkeypatch.setattr(dedup, "DEDUP_MODE", dedup.DEDUP_SKIP)
+        assert Camera.add_image(flask_app, paths[2], paths[2]).id == originals[0].id
+        assert not os.path.exists(paths[2])
+        image = Camera.add_image(flask_app, paths[3], paths[3])
+        assert image.duplicate_of is None
+
+        assert Image.query.count() == 3
+
+
+def test_classify_compares_with_original(unauthenticated_client, monkeypatch):
+    """
+    Test that a capture is compared with the original of a duplicate, so a
+    slowly drifting scene isn't marked as a duplicate of how it first looked
+    """
+    with flask_app.app_context():
+        db.session.add(Image(url="0.jpg", phash="0000000000000000"))
+        db.session.add(Image(url="1.jpg", phash="0000000000000007", duplicate_of=1))
+        db.session.commit()
+
+        monkeypatch.setattr(dedup, "try_image_hash", lambda path: "000000000000003f")
+        assert dedup.classify("2.jpg", max_distance=4) == ("000000000000003f", None)
+
+        monkeypatch.setattr(dedup, "try_image_hash", lambda path: "000000000000000f")
+        assert dedup.classify("2.jpg", max_distance=4) == ("000000000000000f", 1)
+
+        db.session.delete(Image.query.get(1))
+        db.session.commit()
+        assert dedup.classify("2.jpg", max_distance=4) == ("000000000000000f", None)
+
+
+def test_backfill_hashes(unauthenticated_client, tmp_path):
+    """
+    Test that captures without a hash are hashed, skipping unreadable ones
+    """
+    with flask_app.app_context():
+        for index in range(3):
+            path = write_capture(tmp_path / f"{index}.jpg", index)
+            db.session.add(Image(url=path))
+        db.session.add(Image(url=str(tmp_path / "gone.jpg")))
+        db.session.commit()
+
+    flask_app.debug = True
+    try:
+        assert dedup.backfill(flask_app, batch_size=2) == 3
+    finally:
+        flask_app.debug = False
+    with flask_app.app_context():
+        hashes = [image.phash for image in Image.query.order_by(Image.id)]
+    assert hashes[0] == dedup.image_hash(str(tmp_path / "0.jpg"))
+    assert all(hashes[:3]) and hashes[3] is None
@@ -1,7 +1,18 @@
 import json
+import os
+import threading
+from datetime import datetime
+from types import SimpleNamespace
 
 from flask_jwt_extended import create_access_token, create_refresh_token
 
+from backend import db, constants, thumbnails, flask_app, storage
+from backend.captures import CaptureQueue
+from backend.camera import Camera
+from backend.models import Image, VersionStamp
+from backend.unlinker import Unlinker
+from backend.views import GLOBALS
+
 
 def test_get_images(authenticated_client):
     """
@@ -12,7 +23,8 @@ def test_get_images(authenticated_client):
     assert "application/json" == res.content_type
 
     # not expecting any images
-    assert not res.get_json()
+    assert not res.get_json()["images"]
+    assert not res.get_json()["has_more"]
 
 
 def test_get_images_fail_unauthenticated(unauthenticated_client):
@@ -73,3 +85,201 @@ def test_delete_images_success(authenticated_client, test_images):
     res = authenticated_client.get("api/images")
     assert res.status_code == 200
     assert len(res.json) == 1
+
+
+def test_get_images_pages(authenticated_client):
+    """
+    Test paging through the images with before_id and limit
+    """
+    with authenticated_client.application.app_context():
+        for index in range(5):
+            db.session.add(Image(url=f"image{index}.jpg"))
+        db.session.commit()
+
+    res = authenticated_client.get("/api/images?limit=2")
+    assert 200 == res.status_code
+    assert [image["id"] for image in res.json["images"]] == [5, 4]
+    assert res.json["has_more"]
+
+    before_id = res.json["next_before_id"]
+    res = authenticated_client.get(f"/api/images?limit=2&before_id={before_id}")
+    assert [image["id"] for image in res.json["images"]] == [3, 2]
+
+    res = authenticated_client.get("/api/images?limit=2&before_id=2")
+    assert [image["id"] for image in res.json["images"]] == [1]
+    assert not res.json["has_more"]
+    assert res.json["next_before_id"] is None
+
+
+def test_get_images_date_range(authenticated_client):
+    """
+    Test filtering the images by creation date
+    """
+    with authenticated_client.application.app_context():
+        for day in (1, 2, 3):
+            db.session.add(Image(url="image.jpg", created_on=datetime(2021, 1, day)))
+        db.session.commit()
+
+    res = authenticated_client.get("/api/images?since=2021-01-02&until=2021-01-03")
+    assert 200 == res.status_code
+    assert [image["id"] for image in res.json["images"]] == [2]
+
+
+def test_get_images_invalid_page(authenticated_client):
+    """
+    Test that invalid page options are rejected
+    """
+    for query in ("limit=0", "limit=1000", "since=yesterday"):
+        res = authenticated_client.get("/api/images?" + query)
+        assert 400 == res.status_code
+        assert "error" in res.json
+
+
+def test_get_images_not_modified(authenticated_client):
+    """
+    Test that the image list is only sent again once the gallery changed
+    """
+    res = authenticated_client.get("/api/images")
+    etag = res.headers["ETag"]
+
+    res = authenticated_client.get("/api/images", headers={"If-None-Match": etag})
+    assert 304 == res.status_code
+    assert not res.data
+
+    with authenticated_client.application.app_context():
+        db.session.add(Image(url="image.jpg"))
+        VersionStamp.bump(constants.IMAGES_VERSION)
+        db.session.commit()
+
+    res = authenticated_client.get("/api/images", headers={"If-None-Match": etag})
+    assert 200 == res.status_code
+    assert res.headers["ETag"] != etag
+    assert len(res.json["images"]) == 1
+
+
+def test_post_images_queues_capture(authenticated_client, monkeypatch):
+    """
+    Test that a capture is queued and its job reports the new image once done
+    """
+    broadcaster = SimpleNamespace(
+        take_picture=lambda app: Camera.add_image(app, "image.jpg", "image.jpg")
+    )
+    # a window long enough that the job is run here rather than by the worker
+    captures = CaptureQueue(broadcaster, flask_app, window=60)
+    monkeypatch.setitem(GLOBALS, "captures", captures)
+    monkeypatch.setattr(thumbnails, "submit", lambda *args: None)
+
+    res = authenticated_client.post("/api/images")
+    assert 202 == res.status_code
+    assert res.json["job"]["status"] == "queued"
+    job_id = res.json["job"]["id"]
+
+    captures.run_pending()
+    captures.stop()
+    res = authenticated_client.get(f"/api/captures/{job_id}")
+    assert 200 == res.status_code
+    assert res.json["status"] == "done"
+    assert res.json["image"]["url"] == "image.jpg"
+
+    res = authenticated_client.get(f"/api/captures/{job_id + 1}")
+    assert 400 == res.status_code
+
+
+def test_get_images_matches_as_json(authenticated_client):
+    """
+    Test that the listed images are serialized the same as a single image
+    """
+    with authenticated_client.application.app_context():
+        for hour in (0, 11, 12, 23):
+            db.session.add(
+                Image(
+                    url="image.jpg",
+                    thumb_url="image_thumb.jpg",
+                    created_on=datetime(2021, 3, 14, hour, 5, 9),
+                )
+            )
+        db.session.commit()
+        expected = [x.as_json() for x in Image.query.order_by(Image.id.desc())]
+
+    res = authenticated_client.get("/api/images")
+    assert res.json["images"] == expected
+    assert res.json["images"][0]["created_on"] == "03/14/21 11:05:09 EST"
+
+
+def test_bulk_delete_images(authenticated_client, tmp_path, monkeypatch):
+    """
+    Test deleting images by ids and by date range, with their files removed
+    in the background
+    """
+    monkeypatch.setattr(storage, "DEBUG_CAPTURE_DIR", str(tmp_path))
+    paths = []
+    with authenticated_client.application.app_context():
+        for day in (1, 2, 3, 4):
+            path = tmp_path / f"{day}.jpg"
+            path.write_bytes(b"\0")
+            (tmp_path / f"{day}_thumb.jpg").write_bytes(b"\0")
+            paths.append(str(path))
+            db.session.add(Image(url=str(path), created_on=datetime(2021, 1, day)))
+        db.session.commit()
+
+    flask_app.debug = True
+    try:
+        res = authenticated_client.delete("/api/images", json={"ids": [1, 2, 9]})
+        assert 200 == res.status_code
+        assert res.json["deleted"] == 2
+        assert res.json["version"] == 1
+
+        res = authenticated_client.delete(
+            "/api/images", json={"since": "2021-01-03", "until": "2021-01-04"}
+        )
+        assert res.json["deleted"] == 1
+        assert res.json["version"] == 2
+    finally:
+        flask_app.debug = False
+
+    GLOBALS["unlinker"].join()
+    assert sorted(os.listdir(tmp_path)) == ["4.jpg", "4_thumb.jpg"]
+    res = authenticated_client.get("/api/images")
+    assert [image["url"] for image in res.json["images"]] == [paths[3]]
+
+
+def test_bulk_delete_images_invalid(authenticated_client):
+    """
+    Test that bulk deletes without valid ids or a valid range are rejected
+    """
+    for data in (
+        {},
+        {"ids": []},
+        {"ids": ["1"]},
+        {"ids": list(range(constants.MAX_BULK_DELETE + 1))},
+        {"since": "2021-01-02", "until": "2021-01-01"},
+    ):
+        res = authenticated_client.delete("/api/images", json=data)
+        assert constants.MALFORMED_REQUEST_CODE == res.status_code
+        assert "error" in res.json
+
+
+def test_unlinker_starts_in_each_process(tmp_path):
+    """
+    Test that the unlinker starts its thread on first use, and again when
+    its thread is gone, as it is in a forked uWSGI worker
+    """
+    unlinker = Unlinker(flask_app)
+    assert unlinker.thread is None
+    paths = [tmp_path / "1.jpg", tmp_path / "2.jpg"]
+    for path in paths:
+        path.write_bytes(b"\0")
+
+    unlinker.submit([str(paths[0])])
+    unlinker.join()
+    unlinker.stop()
+
+    # a thread that died with the fork
+    unlinker.thread = threading.Thread(target=lambda: None)
+    unlinker.thread.start()
+    unlinker.thread.join()
+    unlinker.submit([str(paths[1])])
+    unlinker.join()
+    unlinker.stop()
+    assert not os.listdir(tmp_path)
+    assert unlinker.unlinked == 2
@@ -1,5 +1,6 @@
 import json
 import datetime
+import os
 import time
 
 import pytest
@@ -7,7 +8,8 @@ import pytest
 from flask_jwt_extended import decode_token
 import jwt
 
-from backend import db
+from backend import db, auth
+from backend.models import LoginBucket
 
 
 def test_post_login_wrong_email(unauthenticated_client):
@@ -54,6 +56,20 @@ def test_post_login_missing_password(unauthenticated_client):
     assert "Set-Cookie" not in res.headers
 
 
+def test_post_login_not_strings(unauthenticated_client):
+    """
+    Test that an email or password that isn't a string is rejected before
+    the attempt is throttled or checked
+    """
+    for credentials in (
+        {"email": ["test1@gmail.com"], "password": "passwordpassword1"},
+        {"email": "test1@gmail.com", "password": 1234},
+    ):
+        res = unauthenticated_client.post("/api/login", json=credentials)
+        assert 400 == res.status_code
+        assert "error" in res.json
+
+
 def test_post_login_success(unauthenticated_client):
     """
     Test that we can login
@@ -136,3 +152,60 @@ def test_post_login_success_shortlived_token(unauthenticated_client):
             expired = True
         finally:
             assert expired
+
+
+def test_post_login_throttled(unauthenticated_client, monkeypatch):
+    """
+    Test that login attempts past an account's limit are throttled before
+    the password is checked
+    """
+    monkeypatch.setattr(auth, "LOGIN_ACCOUNT_PER_MINUTE", 2)
+    for _ in range(2):
+        res = unauthenticated_client.post(
+            "/api/login",
+            json={"email": "test1@gmail.com", "password": "wrong"},
+        )
+        assert 401 == res.status_code
+
+    monkeypatch.setattr(auth, "check_password", None)
+    res = unauthenticated_client.post(
+        "/api/login", json={"email": "test1@gmail.com", "password": "wrong"}
+    )
+    assert 429 == res.status_code
+    assert res.headers["Retry-After"] == "30"
+    assert "Set-Cookie" not in res.headers
+
+
+def test_login_bucket_refills(unauthenticated_client):
+    """
+    Test that a throttled bucket allows attempts again as it refills
+    """
+    with unauthenticated_client.application.app_context():
+        assert LoginBucket.take("key", 2, 1, now=100)
+        assert LoginBucket.take("key", 2, 1, now=100)
+        assert not LoginBucket.take("key", 2, 1, now=100.5)
+        assert LoginBucket.take("key", 2, 1, now=101.5)
+        assert not LoginBucket.take("key", 2, 1, now=101.5)
+
+        assert LoginBucket.prune(60, now=130) == 0
+        assert LoginBucket.prune(60, now=170) == 1
+
+
+def test_post_login_hash_slots_busy(unauthenticated_client, monkeypatch, tmp_path):
+    """
+    Test that logins are turned away when every hash slot stays busy
+    """
+    monkeypatch.setattr(auth, "HASH_SLOTS", 1)
+    monkeypatch.setattr(auth, "HASH_SLOT_PATH", str(tmp_path / "slot"))
+    descriptor = auth.acquire_slot()
+    try:
+        assert auth.acquire_slot(wait=0) is None
+        monkeypatch.setattr(auth, "HASH_SLOT_WAIT", 0)
+        res = unauthenticated_client.post(
+            "/api/login",
+            json={"email": "test1@gmail.com", "password": "passwordpassword1"},
+        )
+        assert 503 == res.status_code
+    finally:
+        os.close(descriptor)
+    assert auth.acquire_slot(wait=0) is not None
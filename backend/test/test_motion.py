@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import cv2
+import numpy
+
+from backend import flask_app
+from backend.camera import Frame
+from backend.motion import MotionDetector
+
+
+def jpeg(value, box=None):
+    """
+    A gray frame, with an optional white box drawn on it.
+    """
+    image = numpy.full((240, 320, 3), value, numpy.uint8)
+    if box is not None:
+        x, y, width, height = box
+        image[y : y + height, x : x + width] = 255
+    return cv2.imencode(".jpg", image)[1].tobytes()
+
+
+class CapturingBroadcaster:
+    """
+    Stand-in for Broadcaster that records captures.
+    """
+
+    def __init__(self):
+        self.captures = 0
+
+    def take_picture(self, app):
+        self.captures += 1
+        return True
+
+
+def test_motion_detector_ignores_still_frames():
+    """
+    Test that frames matching the background aren't motion
+    """
+    detector = MotionDetector(CapturingBroadcaster(), flask_app)
+    assert detector.analyze(jpeg(100)) == 0.0
+    background = detector.background
+    for _ in range(5):
+        assert detector.analyze(jpeg(100)) < 0.001
+    # buffers are reused between frames
+    assert detector.background is background
+
+
+def test_motion_detector_measures_changed_fraction():
+    """
+    Test that the changed fraction matches the area that changed
+    """
+    detector = MotionDetector(CapturingBroadcaster(), flask_app)
+    detector.analyze(jpeg(100))
+    changed = detector.analyze(jpeg(100, box=(0, 0, 160, 120)))
+    assert 0.2 < changed < 0.3
+
+
+def test_motion_detector_captures_on_motion():
+    """
+    Test that motion takes one picture per cooldown, analyzing every Nth frame
+    """
+    broadcaster = CapturingBroadcaster()
+    detector = MotionDetector(broadcaster, flask_app, every=2, cooldown=60)
+    assert not detector.process(1, jpeg(100))
+    # not due yet
+    assert not detector.process(2, jpeg(100, box=(0, 0, 160, 120)))
+    assert detector.analyzed == 1
+
+    assert detector.process(3, jpeg(100, box=(0, 0, 160, 120)))
+    assert not detector.process(5, jpeg(100, box=(160, 120, 160, 120)))
+    assert broadcaster.captures == 1
+    assert detector.stats()["triggered"] == 1
+
+
+def test_motion_detector_copies_due_frames_only():
+    """
+    Test that the frames that aren't due are skipped before being copied
+    """
+    broadcaster = CapturingBroadcaster()
+    detector = MotionDetector(broadcaster, flask_app, every=4)
+    frames = [Frame(sequence, 0, jpeg(100)) for sequence in range(1, 10)]
+    copies = []
+    broadcaster.camera = SimpleNamespace(
+        output=SimpleNamespace(
+            copy=lambda frame: copies.append(frame.sequence) or frame.data
+        )
+    )
+    # stop the detector once the frames run out
+    subscriber = SimpleNamespace(
+        get=lambda timeout: frames.pop(0) if frames else detector.event.set()
+    )
+    broadcaster.subscribe = lambda: subscriber
+    broadcaster.unsubscribe = lambda subscriber: None
+
+    detector.detector_thread()
+    assert copies == [1, 5, 9]
+    assert detector.analyzed == 3
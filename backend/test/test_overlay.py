@@ -0,0 +1,51 @@
+import numpy
+
+from backend.overlay import TimestampOverlay, MARGIN_X, MARGIN_Y
+
+
+def test_overlay_render_reuses_banner():
+    """
+    Test that the banner is only composed once for the same text
+    """
+    overlay = TimestampOverlay()
+    banner = overlay.render("Live stream: 2021-01-01 00:00:00")
+    assert overlay.render("Live stream: 2021-01-01 00:00:00") is banner
+    assert overlay.render("Live stream: 2021-01-01 00:00:01") is not banner
+
+
+def test_overlay_apply_writes_banner():
+    """
+    Test that the banner is written into the top left of the frame
+    """
+    overlay = TimestampOverlay()
+    frame = numpy.full((100, 800, 3), 128, numpy.uint8)
+    overlay.apply(frame, "Live stream: 2021-01-01 00:00:00")
+
+    banner = overlay.render("Live stream: 2021-01-01 00:00:00")
+    height, width = banner.shape
+    assert (frame[:height, :width, 0] == banner).all()
+    # margins stay black, text is white, the rest of the frame is untouched
+    assert (frame[:MARGIN_Y, :width] == 0).all()
+    assert (frame[:height, :MARGIN_X] == 0).all()
+    assert frame[:height, :width].max() > 128
+    assert (frame[height:] == 128).all()
+
+
+def test_overlay_apply_clips_to_small_frames():
+    """
+    Test that a banner larger than the frame is clipped
+    """
+    overlay = TimestampOverlay()
+    frame = numpy.full((10, 20, 3), 128, numpy.uint8)
+    overlay.apply(frame, "Live stream: 2021-01-01 00:00:00")
+    assert (frame[:MARGIN_Y] == 0).all()
+
+
+def test_overlay_renders_unknown_characters():
+    """
+    Test that characters outside the atlas are added on demand
+    """
+    overlay = TimestampOverlay()
+    assert "Z" not in overlay.glyphs
+    overlay.render("Z")
+    assert "Z" in overlay.glyphs
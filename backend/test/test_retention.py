@@ -0,0 +1,138 @@
+import os
+from datetime import datetime, timedelta
+
+from backend import db, flask_app, storage
+from backend.models import Clip, Image
+from backend.retention import ORPHAN_GRACE, RetentionEngine
+
+
+def write_file(directory, name, size, age=0):
+    """
+    Write a file of size bytes, last modified age seconds ago.
+
+    :return: the file's path
+    """
+    path = os.path.join(directory, name)
+    with open(path, "wb") as output:
+        output.write(b"\0" * size)
+    modified = datetime.utcnow().timestamp() - age
+    os.utime(path, (modified, modified))
+    return path
+
+
+def add_images(directory, days):
+    """
+    Add a 1000 byte capture with a thumbnail taken each of days ago.
+
+    :return: the captures' paths
+    """
+    paths = []
+    with flask_app.app_context():
+        for index, day in enumerate(days):
+            path = write_file(directory, f"{index}.jpg", 1000)
+            write_file(directory, f"{index}_thumb.jpg", 100)
+            created_on = datetime.utcnow() - timedelta(days=day)
+            db.session.add(Image(url=path, created_on=created_on))
+            paths.append(path)
+        db.session.commit()
+    return paths
+
+
+def remaining(directory):
+    """
+    The remaining image URLs and files.
+    """
+    with flask_app.app_context():
+        urls = [image.url for image in Image.query.order_by(Image.id)]
+    return [os.path.basename(url) for url in urls], sorted(os.listdir(directory))
+
+
+def test_retention_reconciles(unauthenticated_client, tmp_path, monkeypatch):
+    """
+    Test that images whose capture is gone and old files without an image
+    are removed, and new files are left alone
+    """
+    monkeypatch.setattr(storage, "CAPTURE_DIR", str(tmp_path))
+    paths = add_images(str(tmp_path), [3, 2, 1])
+    os.remove(paths[1])
+    write_file(str(tmp_path), "orphan.jpg", 10, age=ORPHAN_GRACE + 1)
+    write_file(str(tmp_path), "new.jpg", 10)
+
+    stats = RetentionEngine(flask_app).run_pass()
+    assert stats["missing"] == 1
+    assert stats["orphans"] == 1
+    assert remaining(str(tmp_path)) == (
+        ["0.jpg", "2.jpg"],
+        ["0.jpg", "0_thumb.jpg", "2.jpg", "2_thumb.jpg", "new.jpg"],
+    )
+
+
+def test_retention_keeps_debug_files(unauthenticated_client, tmp_path, monkeypatch):
+    """
+    Test that files without an image aren't removed in debug mode, where
+    captures are stored among the test images
+    """
+    monkeypatch.setattr(storage, "DEBUG_CAPTURE_DIR", str(tmp_path))
+    write_file(str(tmp_path), "test_frame_1.jpg", 10, age=ORPHAN_GRACE + 1)
+
+    flask_app.debug = True
+    try:
+        stats = RetentionEngine(flask_app).run_pass()
+    finally:
+        flask_app.debug = False
+    assert stats["orphans"] == 0
+    assert os.listdir(tmp_path) == ["test_frame_1.jpg"]
+
+
+def test_retention_enforces_age_and_quota(
+    unauthenticated_client, tmp_path, tmp_path_factory, monkeypatch
+):
+    """
+    Test that the expired and then the oldest captures over the quota are
+    deleted, with clips not counting against the quota, and that the pass is
+    reported by engines in other processes
+    """
+    monkeypatch.setattr(storage, "DEBUG_CAPTURE_DIR", str(tmp_path))
+    add_images(str(tmp_path), [10, 5, 4, 3, 2])
+    clip = write_file(str(tmp_path), "clip.mjpeg", 5000)
+    with flask_app.app_context():
+        db.session.add(Clip(url=clip, frames=1, duration=1))
+        db.session.commit()
+
+    stats_path = str(tmp_path_factory.mktemp("stats") / "retention.json")
+    engine = RetentionEngine(
+        flask_app, max_age_days=7, batch_size=2, stats_path=stats_path
+    )
+    engine.quota = 2500
+    assert engine.last_pass is None
+    flask_app.debug = True
+    try:
+        stats = engine.run_pass()
+    finally:
+        flask_app.debug = False
+    assert stats["expired"] == 1
+    assert stats["over_quota"] == 2
+    assert stats["bytes"] == 7200
+    assert stats["capture_bytes"] == 2200
+    assert remaining(str(tmp_path))[0] == ["3.jpg", "4.jpg"]
+    assert RetentionEngine(flask_app, stats_path=stats_path).last_pass == stats
+
+
+def test_delete_image_file_already_gone(authenticated_client, tmp_path):
+    """
+    Test that an image whose capture is gone can still be deleted
+    """
+    with flask_app.app_context():
+        db.session.add(Image(url=str(tmp_path / "gone.jpg")))
+        db.session.commit()
+
+    flask_app.debug = True
+    try:
+        res = authenticated_client.delete("/api/images/1")
+    finally:
+        flask_app.debug = False
+    assert 200 == res.status_code
+    assert res.json["id"] == 1
+
+    res = authenticated_client.delete("/api/images/1")
+    assert 400 == res.status_code
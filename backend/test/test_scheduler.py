@@ -0,0 +1,77 @@
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+from backend import db, flask_app
+from backend.models import Schedule
+from backend.scheduler import Scheduler
+
+
+def counting_captures():
+    """
+    A capture queue counting its submits.
+    """
+    captures = SimpleNamespace(submitted=0)
+
+    def submit():
+        captures.submitted += 1
+
+    captures.submit = submit
+    return captures
+
+
+def test_schedule_active_hours():
+    """
+    Test the active hours of schedules, including ones wrapping midnight
+    """
+    day = Schedule(interval=60, start_hour=8, end_hour=18)
+    assert [day.active_at(hour) for hour in (7, 8, 17, 18)] == [0, 1, 1, 0]
+    night = Schedule(interval=60, start_hour=22, end_hour=6)
+    assert [night.active_at(hour) for hour in (21, 22, 0, 5, 6)] == [0, 1, 1, 1, 0]
+    assert Schedule(interval=60, start_hour=0, end_hour=0).active_at(12)
+
+
+def test_scheduler_captures_each_interval_once(unauthenticated_client):
+    """
+    Test that each interval is captured once, even with a scheduler per
+    worker process
+    """
+    now = time.mktime(datetime(2021, 6, 1, 12, 0, 0).timetuple())
+    with flask_app.app_context():
+        db.session.add(Schedule(interval=60, start_hour=8, end_hour=18))
+        db.session.add(Schedule(interval=60, start_hour=20, end_hour=6))
+        db.session.commit()
+
+    captures = counting_captures()
+    schedulers = [Scheduler(flask_app, captures) for _ in range(3)]
+    for offset in (0, 1, 30, 59):
+        for scheduler in schedulers:
+            scheduler.run_due(now + offset)
+    assert captures.submitted == 1
+
+    for scheduler in schedulers:
+        scheduler.run_due(now + 60)
+    assert captures.submitted == 2
+
+
+def test_post_schedule(authenticated_client):
+    """
+    Test adding, listing and deleting schedules
+    """
+    res = authenticated_client.post(
+        "/api/schedules", json={"interval": 300, "start_hour": 6, "end_hour": 20}
+    )
+    assert 200 == res.status_code
+    schedule_id = res.json["id"]
+
+    res = authenticated_client.get("/api/schedules")
+    assert [schedule["interval"] for schedule in res.json] == [300]
+
+    for data in ({"interval": 0}, {"interval": 60, "end_hour": 24}):
+        res = authenticated_client.post("/api/schedules", json=data)
+        assert 400 == res.status_code
+
+    res = authenticated_client.delete(f"/api/schedules/{schedule_id}")
+    assert 200 == res.status_code
+    res = authenticated_client.delete(f"/api/schedules/{schedule_id}")
+    assert 400 == res.status_code
@@ -0,0 +1,154 @@
+import subprocess
+import sys
+import threading
+import time
+
+from backend.capture_daemon import CaptureDaemon
+from backend.fake_camera import FakeCamera
+from backend.shared_frames import (
+    HEARTBEAT_INTERVAL,
+    READER_HEARTBEAT_OFFSET,
+    SharedCamera,
+    SharedFrameOutput,
+    SharedFrameRing,
+)
+
+
+def test_shared_ring_publishes_to_readers(tmp_path):
+    """
+    Test that a frame written to the ring can be read from another mapping
+    """
+    path = str(tmp_path / "ring")
+    ring = SharedFrameRing.create(path, slots=2, slot_size=16)
+    reader = SharedFrameOutput(path)
+    assert reader.latest() is None
+
+    assert ring.publish(b"\xff\xd8one\xff\xd9", 123.5) == 1
+    frame = reader.latest()
+    assert frame.sequence == 1
+    assert frame.timestamp == 123.5
+    assert frame.data == b"\xff\xd8one\xff\xd9"
+    assert reader.next_frame(1, timeout=0) is None
+
+
+def test_shared_ring_detects_overwritten_frames(tmp_path):
+    """
+    Test that a frame whose slot was reused can't be read, and oversized
+    frames are refused
+    """
+    ring = SharedFrameRing.create(str(tmp_path / "ring"), slots=2, slot_size=16)
+    for payload in [b"one", b"two", b"three"]:
+        ring.publish(payload, 0)
+    assert ring.read(1) is None
+    assert ring.read(3).data == b"three"
+    assert ring.publish(b"x" * 17, 0) is None
+
+
+def test_shared_ring_reused_after_restart(tmp_path):
+    """
+    Test that recreating the ring keeps the sequence numbers going
+    """
+    path = str(tmp_path / "ring")
+    reader = SharedFrameOutput(path)
+    SharedFrameRing.create(path, slots=2, slot_size=16).publish(b"one", 0)
+    assert reader.latest().sequence == 1
+
+    SharedFrameRing.create(path, slots=2, slot_size=16).publish(b"two", 0)
+    assert reader.next_frame(1, timeout=0).data == b"two"
+
+
+def test_shared_frame_output_asks_for_frames(tmp_path):
+    """
+    Test that only readers that want frames update the reader heartbeat
+    """
+    path = str(tmp_path / "ring")
+    ring = SharedFrameRing.create(path, slots=2, slot_size=16)
+    reader = SharedFrameOutput(path)
+    reader.next_frame(0, timeout=0)
+    assert ring.heartbeat(READER_HEARTBEAT_OFFSET) > 60
+
+    reader.demand = True
+    reader.next_frame(0, timeout=0)
+    assert ring.heartbeat(READER_HEARTBEAT_OFFSET) < 1
+
+
+def test_capture_daemon_serves_shared_camera(tmp_path):
+    """
+    Test that the daemon starts the camera for a worker's shared camera and
+    stops it once the worker stops asking
+    """
+    path = str(tmp_path / "ring")
+    daemon = CaptureDaemon(SharedFrameRing.create(path))
+    thread = threading.Thread(target=daemon.run)
+    thread.start()
+    camera = SharedCamera(path)
+    try:
+        assert not camera.is_running()
+        assert camera.start(timeout=5)
+        assert camera.is_running()
+        assert daemon.camera.is_running()
+        frame = camera.next_frame(0, timeout=1)
+        assert frame.data.startswith(b"\xff\xd8")
+        # the ring holds the frames as the camera captured them
+        assert camera.output.latest().data in FakeCamera.load_frames()
+
+        camera.stop()
+        deadline = time.time() + 10
+        while daemon.camera.is_running() and time.time() < deadline:
+            time.sleep(0.1)
+        assert not daemon.camera.is_running()
+    finally:
+        camera.stop()
+        daemon.stop()
+        thread.join()
+
+
+def test_shared_camera_keeps_asking_for_frames(tmp_path):
+    """
+    Test that a running shared camera heartbeats without reading frames, and
+    stops once the camera is stopped
+    """
+    path = str(tmp_path / "ring")
+    ring = SharedFrameRing.create(path, slots=2, slot_size=16)
+    ring.publish(b"one", time.time())
+    camera = SharedCamera(path)
+    try:
+        threading.Timer(0.1, ring.publish, (b"two", time.time())).start()
+        assert camera.start(timeout=1)
+        time.sleep(HEARTBEAT_INTERVAL * 1.5)
+        assert ring.heartbeat(READER_HEARTBEAT_OFFSET) < HEARTBEAT_INTERVAL
+    finally:
+        camera.stop()
+    assert camera.keep_alive is None
+
+
+def test_snapshot_skips_stale_frames(tmp_path):
+    """
+    Test that a frame left in the ring from before the capture isn't saved
+    """
+    path = str(tmp_path / "ring")
+    ring = SharedFrameRing.create(path, slots=2, slot_size=16)
+    ring.publish(b"old", time.time() - 600)
+    camera = SharedCamera(path)
+    assert camera.snapshot(timeout=0.1) is None
+
+    threading.Timer(0.1, ring.publish, (b"new", time.time())).start()
+    assert camera.snapshot(timeout=1) == b"new"
+
+
+def test_daemons_skip_app_threads():
+    """
+    Test that importing the daemons doesn't start the web app's background
+    threads, such as the IP update
+    """
+    script = (
+        "import threading, backend.capture_daemon, backend.stream_server; "
+        "print(threading.active_count())"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        stdout=subprocess.PIPE,
+        check=True,
+        universal_newlines=True,
+    ).stdout
+    assert output.split()[-1] == "1"
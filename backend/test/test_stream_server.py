@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+import threading
+
+from backend.camera import StreamingOutput
+from backend.stream_server import StreamServer, fetch_stats
+
+FRAME = b"\xff\xd8frame\xff\xd9"
+
+
+class PassthroughCamera:
+    """
+    Stand-in for Camera whose stream frames are the frames written to it.
+    """
+
+    def __init__(self):
+        self.output = StreamingOutput()
+        self.running = False
+        self.metrics = {"starts": 0}
+
+    def stream_frame(self, frame, quality=None, tier=None):
+        return self.output.copy(frame)
+
+    def is_running(self):
+        return self.running
+
+    def start(self):
+        self.running = True
+        self.metrics["starts"] += 1
+
+    def stop(self):
+        self.running = False
+
+
+def serve(tmp_path, clients):
+    """
+    Run a stream server, feeding it frames until the clients are done.
+
+    :return: what the clients returned
+    """
+    camera = PassthroughCamera()
+    server = StreamServer(camera, keep_warm=0.05)
+    path = str(tmp_path / "stream.sock")
+    done = threading.Event()
+
+    def write_frames():
+        while not done.wait(0.05):
+            camera.output.write(FRAME)
+
+    async def run():
+        serving = asyncio.ensure_future(server.serve(path))
+        while not os.path.exists(path):
+            await asyncio.sleep(0.01)
+        try:
+            return await asyncio.wait_for(clients(path), 10)
+        finally:
+            serving.cancel()
+
+    writer = threading.Thread(target=write_frames)
+    writer.start()
+    try:
+        return asyncio.run(run())
+    finally:
+        done.set()
+        writer.join()
+
+
+async def request(path, target):
+    """
+    Send a GET request and read the response head and the first part.
+    """
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: pi\r\n\r\n".encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    if b" 200 " in head:
+        body = await reader.readuntil(b"\xff\xd9")
+    else:
+        body = await reader.read()
+    writer.close()
+    return head, body
+
+
+def test_stream_server_serves_many_viewers(tmp_path):
+    """
+    Test that one stream server process streams to far more viewers than
+    there are uWSGI workers
+    """
+
+    async def clients(path):
+        viewers = [request(path, "/api/stream.mjpg?tier=small") for _ in range(100)]
+        return await asyncio.gather(*viewers)
+
+    for head, body in serve(tmp_path, clients):
+        assert head.startswith(b"HTTP/1.1 200 OK")
+        assert b"multipart/x-mixed-replace; boundary=frame" in head
+        assert body.startswith(b"--frame\r\nContent-Type: image/jpeg\r\n\r\n")
+        assert body.endswith(FRAME)
+
+
+def test_stream_server_rejects_bad_requests(tmp_path):
+    """
+    Test that invalid stream options and unknown paths are refused
+    """
+
+    async def clients(path):
+        return await asyncio.gather(
+            request(path, "/api/stream.mjpg?quality=0"),
+            request(path, "/api/images"),
+        )
+
+    invalid, unknown = serve(tmp_path, clients)
+    assert invalid[0].startswith(b"HTTP/1.1 400")
+    assert "error" in json.loads(invalid[1])
+    assert unknown[0].startswith(b"HTTP/1.1 404")
+
+
+def test_stream_server_stats(tmp_path):
+    """
+    Test that a viewer's counters can be fetched from the stream server
+    """
+
+    async def clients(path):
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b"GET /api/stream.mjpg?tier=small HTTP/1.1\r\n\r\n")
+        await reader.readuntil(b"\xff\xd9")
+        await reader.readuntil(b"\xff\xd9")
+        loop = asyncio.get_event_loop()
+        stats = await loop.run_in_executor(None, fetch_stats, path)
+        writer.close()
+        return stats
+
+    stats = serve(tmp_path, clients)
+    assert stats["camera"] == {"starts": 1}
+    [viewer] = stats["subscribers"]
+    assert viewer["tier"] == "small"
+    assert viewer["sent"] >= 2
+    assert fetch_stats(str(tmp_path / "missing.sock")) is None
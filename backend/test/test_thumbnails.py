@@ -0,0 +1,89 @@
+import os
+
+from PIL import Image as PILImage
+
+from backend import flask_app, db, thumbnails
+from backend.models import Image
+
+
+def make_capture(path, size=(1024, 768)):
+    """
+    A 1024x768 capture, or one of size.
+    """
+    PILImage.new("RGB", size, (200, 100, 50)).save(path, "JPEG")
+    return path
+
+
+def test_make_thumbnails_sizes(tmp_path):
+    """
+    Test that the preview and thumbnail fit their sizes, next to the capture
+    """
+    preview, thumb = thumbnails.make_thumbnails(make_capture(str(tmp_path / "a.jpg")))
+    assert preview == str(tmp_path / "a_preview.jpg")
+    assert thumb == str(tmp_path / "a_thumb.jpg")
+    with PILImage.open(preview) as image:
+        assert image.size == thumbnails.PREVIEW_SIZE
+    with PILImage.open(thumb) as image:
+        assert image.size == thumbnails.THUMB_SIZE
+
+
+def test_make_thumbnails_draft_decode(tmp_path, monkeypatch):
+    """
+    Test that the capture is decoded at a reduced scale
+    """
+    decoded = []
+    convert = PILImage.Image.convert
+
+    def record_size(image, *args, **kwargs):
+        decoded.append(image.size)
+        return convert(image, *args, **kwargs)
+
+    monkeypatch.setattr(PILImage.Image, "convert", record_size)
+    thumbnails.make_thumbnails(make_capture(str(tmp_path / "a.jpg")))
+    # stream frames are wider, so they're scaled down further to fit
+    thumbnails.make_thumbnails(make_capture(str(tmp_path / "b.jpg"), (1296, 730)))
+    assert decoded == [(512, 384), (648, 365)]
+
+
+def test_thumbnail_image_updates_image(authenticated_client, tmp_path):
+    """
+    Test that a new capture's Image gets its thumbnail URLs
+    """
+    path = make_capture(str(tmp_path / "new.jpg"))
+    with flask_app.app_context():
+        image = Image(url="new.jpg")
+        db.session.add(image)
+        db.session.commit()
+        image_id = image.id
+
+    future = thumbnails.submit(flask_app, image_id, path, "new.jpg")
+    assert future.result(timeout=10)
+    with flask_app.app_context():
+        image = Image.query.get(image_id)
+        assert image.thumb_url == "new_thumb.jpg"
+        assert image.preview_url == "new_preview.jpg"
+        assert image.as_json()["thumb_url"] == "new_thumb.jpg"
+
+
+def test_backfill_thumbnails(authenticated_client, tmp_path):
+    """
+    Test that the backfill makes the missing thumbnails in batches
+    """
+    flask_app.debug = True
+    try:
+        with flask_app.app_context():
+            for index in range(5):
+                url = make_capture(str(tmp_path / f"{index}.jpg"))
+                db.session.add(Image(url=url))
+            db.session.add(Image(url=str(tmp_path / "missing.jpg")))
+            db.session.commit()
+
+        assert thumbnails.backfill(flask_app, batch_size=2) == 5
+        assert thumbnails.backfill(flask_app, batch_size=2) == 0
+    finally:
+        flask_app.debug = False
+
+    with flask_app.app_context():
+        for image in Image.query.filter(Image.thumb_url.isnot(None)):
+            assert os.path.exists(image.thumb_url)
+            assert os.path.exists(image.preview_url)
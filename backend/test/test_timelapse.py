@@ -0,0 +1,76 @@
+import os
+from datetime import datetime
+
+import cv2
+import numpy
+
+from backend import db, flask_app
+from backend.models import Image
+from backend.video import write_video
+from backend.views import GLOBALS
+
+
+def write_images(directory, sizes):
+    """
+    Write a JPEG of each size.
+
+    :return: the paths of the images
+    """
+    paths = []
+    for index, (width, height) in enumerate(sizes):
+        path = os.path.join(directory, f"{index}.jpg")
+        cv2.imwrite(path, numpy.full((height, width, 3), index * 40, numpy.uint8))
+        paths.append(path)
+    return paths
+
+
+def test_write_video(tmp_path):
+    """
+    Test that readable images are written to the video, at the first's size
+    """
+    paths = write_images(str(tmp_path), [(64, 48), (32, 24), (64, 48)])
+    paths.insert(1, str(tmp_path / "missing.jpg"))
+    path = str(tmp_path / "timelapse.mp4")
+    assert write_video(paths, path, 10) == 3
+
+    video = cv2.VideoCapture(path)
+    assert video.get(cv2.CAP_PROP_FRAME_COUNT) == 3
+    assert video.get(cv2.CAP_PROP_FRAME_WIDTH) == 64
+    video.release()
+
+
+def test_post_timelapse(authenticated_client, tmp_path):
+    """
+    Test that a timelapse is built of the images in the range
+    """
+    paths = write_images(str(tmp_path), [(64, 48)] * 4)
+    with flask_app.app_context():
+        for day, path in enumerate(paths, start=1):
+            db.session.add(Image(url=path, created_on=datetime(2021, 1, day)))
+        db.session.commit()
+
+    flask_app.debug = True
+    try:
+        res = authenticated_client.post(
+            "/api/timelapses",
+            json={"since": "2021-01-02", "until": "2021-01-04", "fps": 5},
+        )
+        assert 202 == res.status_code
+        assert res.json["status"] == "building"
+        GLOBALS["timelapses"].join()
+    finally:
+        flask_app.debug = False
+
+    res = authenticated_client.get("/api/timelapses")
+    assert res.json[0]["status"] == "done"
+    assert res.json[0]["frames"] == 2
+    os.remove(res.json[0]["url"])
+
+    res = authenticated_client.post(
+        "/api/timelapses", json={"since": "2020-01-01", "until": "2020-01-02"}
+    )
+    assert 400 == res.status_code
+    res = authenticated_client.post(
+        "/api/timelapses", json={"since": "2021-01-04", "until": "2021-01-02"}
+    )
+    assert 400 == res.status_code
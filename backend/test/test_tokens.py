@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+
+from flask_jwt_extended import create_access_token
+
+from backend import flask_app
+from backend.models import RevokedTokenModel
+from backend.tokens import RevokedTokenCache, TokenPruner
+from backend.views import GLOBALS
+
+
+def revoke(jti, expires_at):
+    """
+    Revoke a token as a logout would.
+    """
+    with flask_app.app_context():
+        RevokedTokenModel(jti=jti, expires_at=expires_at).add()
+
+
+def test_revoked_token_cache(unauthenticated_client):
+    """
+    Test that the cache sees tokens revoked after it was loaded, as another
+    process revoking them would
+    """
+    cache = RevokedTokenCache()
+    expires_at = datetime.utcnow() + timedelta(minutes=15)
+    with flask_app.app_context():
+        assert not cache.is_revoked("one")
+
+        revoke("one", expires_at)
+        assert cache.is_revoked("one")
+        assert not cache.is_revoked("two")
+
+        version = cache.version
+        assert not cache.is_revoked("two")
+        assert cache.version == version
+
+
+def test_token_pruner(unauthenticated_client):
+    """
+    Test that expired revoked tokens are pruned and dropped from the cache
+    """
+    now = datetime.utcnow()
+    revoke("expired", now - timedelta(minutes=1))
+    revoke("current", now + timedelta(minutes=15))
+
+    pruner = TokenPruner(flask_app)
+    assert pruner.prune(now) == 1
+    assert pruner.prune(now) == 0
+    with flask_app.app_context():
+        assert [token.jti for token in RevokedTokenModel.query] == ["current"]
+        assert RevokedTokenCache().jtis == frozenset()
+        assert RevokedTokenCache().is_revoked("current")
+
+
+def test_logout_revokes_token(authenticated_client, monkeypatch):
+    """
+    Test that a token can't be used after logging out with it
+    """
+    # the db is recreated for every test, so start from an empty cache
+    monkeypatch.setitem(GLOBALS, "revoked_tokens", RevokedTokenCache())
+    with flask_app.app_context():
+        access_token = create_access_token(identity="test1@gmail.com")
+    authenticated_client.set_cookie("/", "access_token_cookie", access_token)
+    res = authenticated_client.post("/api/logout")
+    assert 200 == res.status_code
+    with flask_app.app_context():
+        assert RevokedTokenModel.query.one().expires_at > datetime.utcnow()
+
+    authenticated_client.set_cookie("/", "access_token_cookie", access_token)
+    res = authenticated_client.get("/api/images")
+    assert 401 == res.status_code
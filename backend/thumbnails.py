@@ -0,0 +1,167 @@
+"""
+Thumbnails and previews of the captures, made on a background worker pool.
+"""
+
+# standard imports
+import concurrent.futures
+import os
+import threading
+
+# installed imports
+from PIL import Image as PILImage
+
+# project imports
+from backend import db, constants
+from backend.logger import LOGGER
+from backend.models import Image, VersionStamp
+from backend.storage import PREVIEW_SUFFIX, THUMB_SUFFIX, derived_path, image_path
+
+# whether to make thumbnails after each capture
+THUMBNAILS = os.environ.get("PICAM_THUMBNAILS", "1") == "1"
+
+# threads making thumbnails; PIL releases the GIL while decoding and encoding
+THUMBNAIL_WORKERS = int(os.environ.get("PICAM_THUMBNAIL_WORKERS", 2))
+
+# bounding boxes of the preview and the thumbnail. A 1024x768 capture or a
+# 1296x730 stream frame is decoded at half its resolution for the preview,
+# and the thumbnail is made from the preview, so captures are never decoded
+# at full resolution.
+PREVIEW_SIZE = (512, 384)
+THUMB_SIZE = (256, 192)
+JPEG_QUALITY = 80
+
+# captures backfilled per batch
+BACKFILL_BATCH_SIZE = 64
+
+GLOBALS = {"executor": None}
+EXECUTOR_LOCK = threading.Lock()
+
+
+def executor():
+    """
+    The worker pool, created on first use.
+    """
+    with EXECUTOR_LOCK:
+        if GLOBALS["executor"] is None:
+            GLOBALS["executor"] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnails"
+            )
+        return GLOBALS["executor"]
+
+
+def make_thumbnails(path):
+    """
+    Make the preview and the thumbnail of a capture, next to it.
+
+    :param path: where the capture is stored
+    :return: tuple of the preview's and the thumbnail's paths
+    """
+    preview_path = derived_path(path, PREVIEW_SUFFIX)
+    thumb_path = derived_path(path, THUMB_SUFFIX)
+    with PILImage.open(path) as image:
+        # have libjpeg decode at the smallest scale still covering the preview
+        image.draft("RGB", fitted_size(image.size, PREVIEW_SIZE))
+        image = image.convert("RGB")
+    image.thumbnail(PREVIEW_SIZE, PILImage.BILINEAR)
+    image.save(preview_path, "JPEG", quality=JPEG_QUALITY)
+    image.thumbnail(THUMB_SIZE, PILImage.BILINEAR)
+    image.save(thumb_path, "JPEG", quality=JPEG_QUALITY)
+    return preview_path, thumb_path
+
+
+def fitted_size(size, box):
+    """
+    The size an image is scaled down to so it fits a bounding box, keeping
+    its aspect ratio, as Image.thumbnail does.
+
+    :param size: the image's size
+    :param box: the bounding box
+    """
+    scale = min(1, box[0] / size[0], box[1] / size[1])
+    return round(size[0] * scale), round(size[1] * scale)
+
+
+def submit(app, image_id, path, url):
+    """
+    Queue the thumbnails of a new capture.
+
+    :param app: the application
+    :param image_id: ID of the capture's Image
+    :param path: where the capture is stored
+    :param url: URL the capture is served from
+    :return: the Future of the work, None if thumbnails are disabled.
+    """
+    if not THUMBNAILS:
+        return None
+    return executor().submit(thumbnail_image, app, image_id, path, url)
+
+
+def thumbnail_image(app, image_id, path, url):
+    """
+    Make the thumbnails of a capture and store their URLs on its Image.
+
+    :return: whether the thumbnails were made.
+    """
+    if not try_make_thumbnails(path):
+        return False
+
+    with app.app_context():
+        image = Image.query.get(image_id)
+        if image is None:
+            # deleted while the thumbnails were made
+            return False
+        image.preview_url = derived_path(url, PREVIEW_SUFFIX)
+        image.thumb_url = derived_path(url, THUMB_SUFFIX)
+        VersionStamp.bump(constants.IMAGES_VERSION)
+        db.session.commit()
+    return True
+
+
+def backfill(app, batch_size=BACKFILL_BATCH_SIZE):
+    """
+    Make the thumbnails of every capture without them, a batch at a time,
+    with each batch's captures processed in parallel.
+
+    :param app: the application
+    :param batch_size: captures per batch
+    :return: number of captures that got thumbnails.
+    """
+    done = 0
+    last_id = 0
+    with app.app_context():
+        while True:
+            batch = (
+                Image.query.filter(Image.thumb_url.is_(None), Image.id > last_id)
+                .order_by(Image.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            paths = [image_path(app, image.url) for image in batch]
+            results = executor().map(try_make_thumbnails, paths)
+            for image, made in zip(batch, results):
+                if made:
+                    image.preview_url = derived_path(image.url, PREVIEW_SUFFIX)
+                    image.thumb_url = derived_path(image.url, THUMB_SUFFIX)
+                    done += 1
+            VersionStamp.bump(constants.IMAGES_VERSION)
+            db.session.commit()
+            LOGGER.info("Backfilled thumbnails up to image %d", last_id)
+    return done
+
+
+def try_make_thumbnails(path):
+    """
+    Make the thumbnails of a capture, logging failures.
+
+    :return: whether the thumbnails were made.
+    """
+    try:
+        make_thumbnails(path)
+        return True
+    except OSError as error:
+        LOGGER.error("Failed making thumbnails of %s: %s", path, error)
+        return False
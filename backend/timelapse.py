@@ -0,0 +1,106 @@
+"""
+Timelapse builder, assembling the images of a time range into a video.
+"""
+
+# standard imports
+import os
+import subprocess
+import sys
+import threading
+import uuid
+
+# project imports
+from backend import db
+from backend.logger import LOGGER
+from backend.models import Image, Timelapse
+from backend.storage import capture_path, image_path
+
+# frames per second of the timelapses by default, and at most
+TIMELAPSE_FPS = 24
+MAX_TIMELAPSE_FPS = 60
+
+# videos are encoded by video.py in a fresh interpreter, so the encoding
+# never holds the GIL of a worker serving requests, and nothing is inherited
+# from a worker's threads the way a forked child would. Under uWSGI
+# sys.executable is uwsgi itself, so the interpreter is found by its prefix.
+VIDEO_WRITER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "video.py")
+PYTHON = os.path.join(sys.exec_prefix, "bin", "python3")
+
+
+class TimelapseBuilder:
+    """
+    Builds timelapses in video writer processes, with a thread per build
+    feeding its process the images and recording the result.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.threads = []
+
+    def submit(self, since, until, fps=TIMELAPSE_FPS):
+        """
+        Start building a timelapse of the images taken in a time range.
+
+        :param since: UTC datetime of the first images
+        :param until: UTC datetime the images end before
+        :param fps: frames per second of the video
+        :return: the Timelapse, None if no images were taken in the range.
+        """
+        urls = [
+            url
+            for url, in Image.query.with_entities(Image.url)
+            .filter(Image.created_on >= since, Image.created_on < until)
+            .order_by(Image.id)
+        ]
+        if not urls:
+            return None
+
+        path, url = capture_path(self.app, f"{uuid.uuid4()}.mp4")
+        timelapse = Timelapse(url=url, since=since, until=until, fps=fps)
+        db.session.add(timelapse)
+        db.session.commit()
+
+        paths = [image_path(self.app, image_url) for image_url in urls]
+        process = subprocess.Popen(
+            [PYTHON, VIDEO_WRITER, path, str(fps)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        LOGGER.info("Building %d image timelapse to %s", len(paths), path)
+
+        thread = threading.Thread(
+            target=self.waiter_thread, args=(timelapse.id, process, paths)
+        )
+        thread.daemon = True
+        thread.start()
+        self.threads = [thread for thread in self.threads if thread.is_alive()]
+        self.threads.append(thread)
+        return timelapse
+
+    def waiter_thread(self, timelapse_id, process, paths):
+        """
+        Thread that sends a build's process the images and records the
+        result once it exits.
+        """
+        output, _ = process.communicate("\n".join(paths))
+        try:
+            frames = int(output) if process.returncode == 0 else 0
+        except ValueError:
+            frames = 0
+        with self.app.app_context():
+            timelapse = Timelapse.query.get(timelapse_id)
+            timelapse.frames = frames
+            timelapse.status = Timelapse.DONE if frames else Timelapse.FAILED
+            db.session.commit()
+            LOGGER.info(
+                "Timelapse %d %s with %d frames", timelapse_id, timelapse.status, frames
+            )
+
+    def join(self):
+        """
+        Wait for the builds in progress.
+        """
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
@@ -0,0 +1,118 @@
+"""
+Revoked tokens, cached in every process and pruned once they expire.
+"""
+
+# standard imports
+import os
+import threading
+from datetime import datetime
+
+# project imports
+from backend import db, constants, auth
+from backend.logger import LOGGER
+from backend.models import RevokedTokenModel, VersionStamp
+
+# seconds between prunes of the expired revoked tokens
+TOKEN_PRUNE_INTERVAL = int(os.environ.get("PICAM_TOKEN_PRUNE_INTERVAL", 60 * 60))
+
+
+class RevokedTokenCache:
+    """
+    The jtis of the unexpired revoked tokens, held in memory. Every check
+    reads the revoked tokens' VersionStamp, a primary key lookup, and only
+    reloads the jtis when another request or process changed them, so a
+    check costs the same however many tokens were revoked.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.jtis = frozenset()
+
+    def is_revoked(self, jti):
+        """
+        Whether a token was revoked.
+
+        :param jti: the token's ID
+        """
+        version = VersionStamp.current(constants.REVOKED_TOKENS_VERSION)
+        if version != self.version:
+            self.reload(version)
+        return jti in self.jtis
+
+    def reload(self, version):
+        """
+        Load the jtis of the unexpired revoked tokens.
+
+        :param version: the version read before loading them
+        """
+        self.jtis = frozenset(
+            jti
+            for jti, in RevokedTokenModel.query.with_entities(
+                RevokedTokenModel.jti
+            ).filter(RevokedTokenModel.expires_at >= datetime.utcnow())
+        )
+        # set after the jtis, so another thread seeing the new version also
+        # sees the jtis it was loaded with
+        self.version = version
+
+
+class TokenPruner:
+    """
+    Deletes the revoked tokens that expired, which can no longer be used
+    anyway, so the table stops growing with every logout. The login buckets
+    that refilled are deleted along with them.
+    """
+
+    def __init__(self, app, interval=TOKEN_PRUNE_INTERVAL):
+        self.app = app
+        self.interval = interval
+        self.event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Start the pruner thread.
+        """
+        self.event.clear()
+        self.thread = threading.Thread(target=self.pruner_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the pruner thread.
+        """
+        self.event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def pruner_thread(self):
+        """
+        Thread that prunes the revoked tokens every interval.
+        """
+        while not self.event.wait(self.interval):
+            try:
+                self.prune()
+                with self.app.app_context():
+                    auth.prune_buckets()
+            except Exception as error:  # pylint: disable=broad-except
+                LOGGER.error("Failed pruning revoked tokens: %s", error)
+
+    def prune(self, now=None):
+        """
+        Delete the revoked tokens expired by now.
+
+        :param now: the UTC time to prune up to, defaults to the current time
+        :return: number of tokens pruned
+        """
+        with self.app.app_context():
+            pruned = RevokedTokenModel.query.filter(
+                RevokedTokenModel.expires_at < (now or datetime.utcnow())
+            ).delete(synchronize_session=False)
+            if pruned:
+                VersionStamp.bump(constants.REVOKED_TOKENS_VERSION)
+            db.session.commit()
+        if pruned:
+            LOGGER.info("Pruned %d expired revoked tokens", pruned)
+        return pruned
@@ -0,0 +1,83 @@
+"""
+Background removal of deleted captures from disk.
+"""
+
+# standard imports
+import queue
+import threading
+
+# project imports
+from backend.logger import LOGGER
+from backend.storage import image_path, remove_capture_files
+
+
+class Unlinker:
+    """
+    Removes the files of deleted images on a background thread, so deleting
+    images never waits on the disk. The thread is started by the first
+    submit in each process, as threads don't survive uWSGI forking the
+    workers. Files left behind if the process exits first are removed by the
+    retention engine's orphan pass.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.paths = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.unlinked = 0
+        self.freed = 0
+
+    def start(self):
+        """
+        Start the unlinker thread, with a queue of its own.
+        """
+        self.paths = queue.Queue()
+        self.thread = threading.Thread(target=self.unlinker_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the thread, once the files already submitted are removed.
+        """
+        with self.lock:
+            if self.thread is None:
+                return
+            self.paths.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, urls):
+        """
+        Queue the files of deleted images for removal.
+
+        :param urls: URLs of the images, as stored in the db
+        """
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.start()
+        for url in urls:
+            self.paths.put(image_path(self.app, url))
+
+    def join(self):
+        """
+        Wait for the files submitted so far to be removed.
+        """
+        self.paths.join()
+
+    def unlinker_thread(self):
+        """
+        Thread that removes the submitted files.
+        """
+        while True:
+            path = self.paths.get()
+            try:
+                if path is None:
+                    return
+                self.freed += remove_capture_files(path)
+                self.unlinked += 1
+            except OSError as error:
+                LOGGER.error("Failed removing %s: %s", path, error)
+            finally:
+                self.paths.task_done()
@@ -2,29 +2,175 @@
 Utilities
 """
 # standard imports
+from datetime import datetime
 
 # project imports
+from backend import constants
 from backend.logger import LOGGER
+from backend.camera import DEFAULT_TIER, FRAME_TIMEOUT, STREAM_TIERS
+from backend.timelapse import MAX_TIMELAPSE_FPS, TIMELAPSE_FPS
+from backend.models import Image
 
+STREAM_MIMETYPE = "multipart/x-mixed-replace; boundary=frame"
 
-def generate_live_stream(camera):
+
+def page_options(args):
+    """
+    Read and validate the page options of the images list from the query
+    parameters.
+
+    :param args: the query parameters, as a werkzeug MultiDict
+    :return: a tuple of the options for Image.page and an error message,
+             which is None if the options are valid.
+    """
+    before_id = args.get("before_id", None, type=int)
+
+    limit = args.get("limit", constants.DEFAULT_PAGE_SIZE, type=int)
+    if not 1 <= limit <= constants.MAX_PAGE_SIZE:
+        return None, f"limit must be between 1 and {constants.MAX_PAGE_SIZE}"
+
+    options = {"before_id": before_id, "limit": limit}
+    for name in ("since", "until"):
+        value = args.get(name)
+        if value is None:
+            continue
+        try:
+            options[name] = datetime.fromisoformat(value)
+        except ValueError:
+            return None, f"{name} must be an ISO 8601 date or datetime"
+    return options, None
+
+
+def bulk_delete_options(data):
+    """
+    Read and validate which images a bulk delete is for from a request's
+    JSON, either a list of ids or a since and until date range.
+
+    :param data: the request's JSON
+    :return: a tuple of the filters on Image and an error message, which is
+             None if the options are valid.
+    """
+    if "ids" in data:
+        ids = data["ids"]
+        if (
+            not isinstance(ids, list)
+            or not ids
+            or not all(isinstance(_id, int) for _id in ids)
+        ):
+            return None, "ids must be a list of image ids"
+        if len(ids) > constants.MAX_BULK_DELETE:
+            return None, f"ids must have at most {constants.MAX_BULK_DELETE} ids"
+        return [Image.id.in_(ids)], None
+
+    options, error = timelapse_options({**data, "fps": 1})
+    if error:
+        return None, "ids or since and until are required: " + error
+    return [
+        Image.created_on >= options["since"],
+        Image.created_on < options["until"],
+    ], None
+
+
+def schedule_options(data):
+    """
+    Read and validate a capture schedule from a request's JSON.
+
+    :param data: the request's JSON
+    :return: a tuple of the Schedule's columns and an error message, which is
+             None if the schedule is valid.
+    """
+    interval = data.get("interval")
+    if not isinstance(interval, int) or interval < 1:
+        return None, "interval must be a positive number of seconds"
+
+    options = {"interval": interval}
+    for name in ("start_hour", "end_hour"):
+        hour = data.get(name, 0)
+        if not isinstance(hour, int) or not 0 <= hour <= 23:
+            return None, f"{name} must be an hour between 0 and 23"
+        options[name] = hour
+    return options, None
+
+
+def timelapse_options(data):
     """
-    Handle the creation of the live stream.
+    Read and validate a timelapse's time range and frame rate from a
+    request's JSON.
+
+    :param data: the request's JSON
+    :return: a tuple of the options for TimelapseBuilder.submit and an error
+             message, which is None if the options are valid.
+    """
+    options = {}
+    for name in ("since", "until"):
+        try:
+            options[name] = datetime.fromisoformat(data[name])
+        except (KeyError, TypeError, ValueError):
+            return None, f"{name} must be an ISO 8601 date or datetime"
+    if options["since"] >= options["until"]:
+        return None, "since must be before until"
+
+    fps = data.get("fps", TIMELAPSE_FPS)
+    if not isinstance(fps, int) or not 1 <= fps <= MAX_TIMELAPSE_FPS:
+        return None, f"fps must be between 1 and {MAX_TIMELAPSE_FPS}"
+    options["fps"] = fps
+    return options, None
+
+
+def stream_options(args):
+    """
+    Read and validate a viewer's live stream options from the query parameters.
+
+    :param args: the query parameters, as a werkzeug MultiDict
+    :return: a tuple of the options for generate_live_stream and an error
+             message, which is None if the options are valid.
+    """
+    max_fps = args.get("max_fps", None, type=float)
+    if max_fps is not None and max_fps <= 0:
+        return None, "max_fps must be positive"
+
+    quality = args.get("quality", None, type=int)
+    if quality is not None and not 1 <= quality <= 100:
+        return None, "quality must be between 1 and 100"
+
+    tier = args.get("tier", DEFAULT_TIER)
+    if tier not in STREAM_TIERS:
+        return None, "tier must be one of " + ", ".join(STREAM_TIERS)
+
+    return {"max_fps": max_fps, "quality": quality, "tier": tier}, None
+
+
+def frame_part(data):
+    """
+    Wrap a JPEG frame as a part of the multipart live stream.
+    """
+    return b"--frame\r\nContent-Type: image/jpeg\r\n\r\n" + data + b"\r\n\r\n"
+
+
+def generate_live_stream(broadcaster, max_fps=None, quality=None, tier=DEFAULT_TIER):
+    """
+    Handle the creation of the live stream. The camera is shared with every
+    other viewer through the broadcaster.
+
+    :param broadcaster: the Broadcaster sharing the camera
+    :param max_fps: most frames per second to send this viewer
+    :param quality: JPEG quality of this viewer's frames
+    :param tier: resolution tier of this viewer's frames
     """
-    LOGGER.info("Starting camera output...")
-    camera.start()
-    LOGGER.info("Camera output started...")
+    LOGGER.info("Subscribing to camera output...")
+    subscriber = broadcaster.subscribe(max_fps=max_fps, quality=quality, tier=tier)
+    LOGGER.info("Subscribed to camera output...")
     try:
+        sequence = 0
         while True:
-            frame = camera.get_frame()
+            frame = broadcaster.next_frame(subscriber, FRAME_TIMEOUT)
             if frame is None:
                 LOGGER.error("Failed getting frame.")
-                camera.stop()
                 return "Error getting stream."
-            yield (
-                b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n\r\n"
-            )
+            if sequence and frame.sequence > sequence + 1:
+                LOGGER.debug("Skipped %d frames", frame.sequence - sequence - 1)
+            sequence = frame.sequence
+            yield frame_part(frame.data)
     finally:
-        LOGGER.info("Stopping camera output...")
-        camera.stop()
-        LOGGER.info("Camera output stopped...")
+        LOGGER.info("Unsubscribing from camera output...")
+        broadcaster.unsubscribe(subscriber)
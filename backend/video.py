@@ -0,0 +1,60 @@
+"""
+Timelapse video writer. Run in a fresh interpreter by the timelapse builder,
+with the images' paths on stdin, one per line:
+
+    python backend/video.py <video path> <fps> < paths
+
+It prints the number of frames written. It must not import the backend
+package, whose import creates the app and starts its threads.
+"""
+
+# standard imports
+import sys
+
+# installed imports
+import cv2
+
+# codec of the timelapses, which are written as .mp4
+FOURCC = "mp4v"
+
+
+def write_video(paths, path, fps):
+    """
+    Write images to a video, reading one at a time so memory use doesn't
+    grow with the number of images. Images that can't be read are skipped,
+    and images of another size than the first are resized to it.
+
+    :param paths: where the images are stored, in order
+    :param path: where to write the video
+    :param fps: frames per second of the video
+    :return: number of frames written
+    """
+    writer = None
+    size = None
+    frames = 0
+    for image_file in paths:
+        frame = cv2.imread(image_file, cv2.IMREAD_COLOR)
+        if frame is None:
+            continue
+        if writer is None:
+            size = (frame.shape[1], frame.shape[0])
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*FOURCC), fps, size)
+        elif (frame.shape[1], frame.shape[0]) != size:
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        writer.write(frame)
+        frames += 1
+    if writer is not None:
+        writer.release()
+    return frames
+
+
+def main():
+    """
+    Write the video of the paths on stdin.
+    """
+    path, fps = sys.argv[1], float(sys.argv[2])
+    print(write_video(sys.stdin.read().splitlines(), path, fps))
+
+
+if __name__ == "__main__":
+    main()
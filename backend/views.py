@@ -2,11 +2,9 @@
 Views backend. Handles items, logins, registrations, logouts and tokens.
 """
 # project imports
-import base64
-import os
+from datetime import datetime
 
 # installed imports
-import bcrypt
 from flask import jsonify, send_from_directory, Response
 from flask_restful import Resource, request
 from sqlalchemy import desc
@@ -23,22 +21,77 @@ from flask_jwt_extended import (
 )
 
 # project imports
-from backend import jwt, db, flask_app, utils, constants
+from backend import jwt, db, flask_app, utils, constants, auth
 from backend.camera import Camera
-from backend.models import User, Image, RevokedTokenModel
+from backend.broadcaster import Broadcaster
+from backend.shared_frames import CAPTURE_DAEMON, SharedCamera
+from backend.motion import MOTION_DETECTION, MotionDetector
+from backend.clips import CLIP_POST_ROLL, CLIP_RECORDING, ClipRecorder
+from backend.models import (
+    User,
+    Image,
+    Clip,
+    CaptureJob,
+    Schedule,
+    Timelapse,
+    RevokedTokenModel,
+    VersionStamp,
+)
+from backend.tokens import RevokedTokenCache, TokenPruner
+from backend.captures import CaptureQueue
+from backend.scheduler import Scheduler
+from backend.timelapse import TimelapseBuilder
+from backend.retention import RetentionEngine
+from backend.unlinker import Unlinker
+from backend.stream_server import fetch_stats
+from backend import start_thread, update_ip_thread
 from backend.logger import LOGGER
 
-GLOBALS = {"camera": Camera()}
+# with the capture daemon owning the camera, every worker reads its frames
+CAMERA = SharedCamera() if CAPTURE_DAEMON else Camera()
+GLOBALS = {
+    "camera": CAMERA,
+    "broadcaster": Broadcaster(CAMERA),
+    "revoked_tokens": RevokedTokenCache(),
+    "token_pruner": TokenPruner(flask_app),
+}
+GLOBALS["token_pruner"].start()
+GLOBALS["captures"] = CaptureQueue(GLOBALS["broadcaster"], flask_app)
+GLOBALS["timelapses"] = TimelapseBuilder(flask_app)
+# only the web app updates the IP, not the daemons importing the package
+start_thread(update_ip_thread)
+# runs once, in the uWSGI master
+start_thread(Scheduler(flask_app, GLOBALS["captures"]).scheduler_thread)
+# the retention thread runs in the uWSGI master, the workers read the counters
+# of its passes from their file
+GLOBALS["retention"] = RetentionEngine(flask_app)
+start_thread(GLOBALS["retention"].retention_thread)
+GLOBALS["unlinker"] = Unlinker(flask_app)
+
+# motion detection and clip recording run wherever the camera is owned
+if CLIP_RECORDING and not CAPTURE_DAEMON:
+    GLOBALS["clips"] = ClipRecorder(GLOBALS["broadcaster"], flask_app)
+    GLOBALS["clips"].start()
+if MOTION_DETECTION and not CAPTURE_DAEMON:
+    GLOBALS["motion"] = MotionDetector(
+        GLOBALS["broadcaster"], flask_app, recorder=GLOBALS.get("clips")
+    )
+    GLOBALS["motion"].start()
 
 
 @flask_app.route("/api/stream.mjpg")
 def live_stream():
     """
-    Endpoint for starting the live stream.
+    Endpoint for starting the live stream. Accepts optional max_fps, quality
+    and tier query parameters to limit the stream for this viewer.
     """
+    options, error = utils.stream_options(request.args)
+    if error:
+        return jsonify({"error": error}), constants.MALFORMED_REQUEST_CODE
+
     return Response(
-        utils.generate_live_stream(GLOBALS["camera"]),
-        mimetype="multipart/x-mixed-replace; boundary=frame",
+        utils.generate_live_stream(GLOBALS["broadcaster"], **options),
+        mimetype=utils.STREAM_MIMETYPE,
     )
 
 
@@ -50,6 +103,35 @@ def send_images(path):
     return send_from_directory("../test_images", path)
 
 
+class StreamStats(Resource):
+    """
+    Statistics for the camera and the viewers of the live stream.
+    """
+
+    @jwt_required
+    def get(self):
+        """
+        Handle a get request for the camera metrics and per-viewer counters.
+        The viewers are the stream server's when it is running, as nginx
+        sends the live stream there; its camera's metrics are under
+        stream_camera.
+        """
+        stats = {
+            "camera": GLOBALS["camera"].metrics,
+            "subscribers": GLOBALS["broadcaster"].stats(),
+        }
+        stream_stats = fetch_stats()
+        if stream_stats is not None:
+            stats["subscribers"] = stream_stats["subscribers"]
+            stats["stream_camera"] = stream_stats["camera"]
+        if "motion" in GLOBALS:
+            stats["motion"] = GLOBALS["motion"].stats()
+        if "clips" in GLOBALS:
+            stats["clips"] = GLOBALS["clips"].stats()
+        stats["retention"] = GLOBALS["retention"].last_pass
+        return stats
+
+
 class Images(Resource):
     """
     Get images and request pictures from the camera.
@@ -58,20 +140,179 @@ class Images(Resource):
     @jwt_required
     def get(self):
         """
-        Handle a get request for all files
+        Handle a get request for a page of images. Accepts optional before_id
+        and limit query parameters to page through the images, and since and
+        until to only list images taken in that range.
+
+        The gallery's version is sent as the ETag, and a request whose
+        If-None-Match has the current version gets an empty 304 without the
+        images being queried.
         """
-        return [x.as_json() for x in Image.query.order_by(desc(Image.id)).all()]
+        options, error = utils.page_options(request.args)
+        if error:
+            return {"error": error}, constants.MALFORMED_REQUEST_CODE
+
+        # read before the page, so a change in between only costs a refetch
+        version = VersionStamp.current(constants.IMAGES_VERSION)
+        headers = {"ETag": f'"{version}"', "Cache-Control": "no-cache"}
+        if request.if_none_match.contains(str(version)):
+            return Response(status=304, headers=headers)
+        return Image.page(**options), 200, headers
 
     @jwt_required
     def post(self):
         """
-        Start the camera and take a picture.
+        Queue a picture. Responds right away with the capture job, whose
+        status is at /api/captures/<id>.
+        """
+        LOGGER.debug("queueing capture...")
+        job = GLOBALS["captures"].submit()
+        return {"job": job.as_json()}, constants.ACCEPTED_CODE
+
+    @jwt_required
+    def delete(self):
+        """
+        Delete the images with the ids in the JSON's ids, or taken from its
+        since until its until, in one transaction. Their files are removed in
+        the background. Responds with the number of images deleted and the
+        gallery's new version.
         """
-        LOGGER.debug("starting capture...")
-        if not GLOBALS["camera"].take_picture(flask_app):
-            return {"error": "Failed taking picture"}, constants.MALFORMED_REQUEST_CODE
+        filters, error = utils.bulk_delete_options(request.json or {})
+        if error:
+            return {"error": error}, constants.MALFORMED_REQUEST_CODE
+
+        query = Image.query.filter(*filters)
+        urls = [url for (url,) in query.with_entities(Image.url)]
+        deleted = query.delete(synchronize_session=False)
+        if deleted:
+            VersionStamp.bump(constants.IMAGES_VERSION)
+        db.session.commit()
+        LOGGER.debug("Deleted %d images", deleted)
+
+        GLOBALS["unlinker"].submit(urls)
+        version = VersionStamp.current(constants.IMAGES_VERSION)
+        return {"deleted": deleted, "version": version}
 
-        return [x.as_json() for x in Image.query.order_by(desc(Image.id)).all()]
+
+class CaptureJobs(Resource):
+    """
+    Access a capture job by its ID
+    """
+
+    @jwt_required
+    def get(self, _id):
+        """
+        Get a capture job, with its image once it's done.
+        """
+        job = CaptureJob.query.get(_id)
+        if job is None:
+            return {"error": "Capture job not found"}, constants.MALFORMED_REQUEST_CODE
+        return job.as_json()
+
+
+class Schedules(Resource):
+    """
+    Get and add capture schedules.
+    """
+
+    @jwt_required
+    def get(self):
+        """
+        Handle a get request for all schedules
+        """
+        return [x.as_json() for x in Schedule.query.order_by(Schedule.id).all()]
+
+    @jwt_required
+    def post(self):
+        """
+        Add a schedule taking a picture every interval seconds between
+        start_hour and end_hour.
+        """
+        options, error = utils.schedule_options(request.json or {})
+        if error:
+            return {"error": error}, constants.MALFORMED_REQUEST_CODE
+
+        schedule = Schedule(**options)
+        db.session.add(schedule)
+        db.session.commit()
+        return schedule.as_json()
+
+
+class DeleteSchedule(Resource):
+    """
+    Access a single schedule by its ID
+    """
+
+    @jwt_required
+    def delete(self, _id):
+        """
+        Delete a schedule
+        """
+        if not Schedule.query.filter_by(id=_id).delete():
+            return {"error": "Schedule not found"}, constants.MALFORMED_REQUEST_CODE
+        db.session.commit()
+        return {"id": _id}
+
+
+class Timelapses(Resource):
+    """
+    Get and build timelapses.
+    """
+
+    @jwt_required
+    def get(self):
+        """
+        Handle a get request for all timelapses
+        """
+        return [x.as_json() for x in Timelapse.query.order_by(desc(Timelapse.id))]
+
+    @jwt_required
+    def post(self):
+        """
+        Build a timelapse of the images taken from since until until. Responds
+        right away, and the timelapse is done once its status is.
+        """
+        options, error = utils.timelapse_options(request.json or {})
+        if error:
+            return {"error": error}, constants.MALFORMED_REQUEST_CODE
+
+        timelapse = GLOBALS["timelapses"].submit(**options)
+        if timelapse is None:
+            error = {"error": "No images were taken in that range"}
+            return error, constants.MALFORMED_REQUEST_CODE
+        return timelapse.as_json(), constants.ACCEPTED_CODE
+
+
+class Clips(Resource):
+    """
+    Get clips and request clips from the camera.
+    """
+
+    @jwt_required
+    def get(self):
+        """
+        Handle a get request for all clips
+        """
+        return [x.as_json() for x in Clip.query.order_by(desc(Clip.id)).all()]
+
+    @jwt_required
+    def post(self):
+        """
+        Record a clip around now. The clip is listed once its post-roll has
+        been recorded and it is written.
+        """
+        if not CLIP_RECORDING:
+            error = {"error": "Clip recording is disabled"}
+            return error, constants.MALFORMED_REQUEST_CODE
+
+        LOGGER.debug("triggering clip...")
+        if not CAPTURE_DAEMON:
+            GLOBALS["clips"].trigger()
+        elif not GLOBALS["camera"].output.request_clip():
+            error = {"error": "Capture daemon is not running"}
+            return error, constants.MALFORMED_REQUEST_CODE
+
+        return {"post_roll": CLIP_POST_ROLL}
 
 
 class DeleteImage(Resource):
@@ -82,23 +323,21 @@ class DeleteImage(Resource):
     @jwt_required
     def delete(self, _id):
         """
-        Delete an image
+        Delete an image, whose files are removed in the background. Responds
+        with its ID and the gallery's new version.
         """
         LOGGER.debug("Delete request for %d", _id)
 
-        # remove from disk
-        if flask_app.debug:
-            path = Image.query.filter_by(id=_id).first().url
-        else:
-            path = os.path.join(
-                "/var/www/html/cam/", Image.query.filter_by(id=_id).first().url
-            )
-        LOGGER.debug("removing %s", path)
-        os.remove(path)
+        image = Image.query.get(_id)
+        if image is None:
+            return {"error": "Item not found"}, constants.MALFORMED_REQUEST_CODE
 
-        Image.query.filter_by(id=_id).delete()
+        url = image.url
+        db.session.delete(image)
+        VersionStamp.bump(constants.IMAGES_VERSION)
         db.session.commit()
-        return [x.as_json() for x in Image.query.order_by(desc(Image.id)).all()]
+        GLOBALS["unlinker"].submit([url])
+        return {"id": _id, "version": VersionStamp.current(constants.IMAGES_VERSION)}
 
 
 class Login(Resource):
@@ -121,15 +360,24 @@ class Login(Resource):
             }, constants.MALFORMED_REQUEST_CODE
         if "password" not in request.json:
             return {"error": "Must supply password"}, constants.MALFORMED_REQUEST_CODE
+        if not all(isinstance(request.json[key], str) for key in ("email", "password")):
+            return {
+                "error": "Email and password must be strings"
+            }, constants.MALFORMED_REQUEST_CODE
+
+        retry_after = auth.throttle(request.remote_addr, request.json["email"])
+        if retry_after is not None:
+            return (
+                {"error": "Too many login attempts, try again later"},
+                constants.TOO_MANY_REQUESTS_CODE,
+                {"Retry-After": str(retry_after)},
+            )
 
         user = User.query.filter_by(email=request.json["email"]).first()
-        if user is None:
-            return {
-                "error": "Email or password incorrect"
-            }, constants.INVALID_CREDS_CODE
-        if bcrypt.hashpw(
-            request.json["password"].encode(), base64.b64decode(user.password)
-        ) != base64.b64decode(user.password):
+        matches, error = auth.check_password(request.json["password"], user)
+        if error:
+            return {"error": error}, constants.SERVICE_UNAVAILABLE_CODE
+        if not matches:
             return {
                 "error": "Email or password incorrect"
             }, constants.INVALID_CREDS_CODE
@@ -164,8 +412,10 @@ class Logout(Resource):
         """
         Add the jti to the revoked token table
         """
-        jti = get_raw_jwt()["jti"]
-        revoked_token = RevokedTokenModel(jti=jti)
+        raw_jwt = get_raw_jwt()
+        revoked_token = RevokedTokenModel(
+            jti=raw_jwt["jti"], expires_at=datetime.utcfromtimestamp(raw_jwt["exp"])
+        )
         revoked_token.add()
         resp = jsonify({"uid": None})
         unset_jwt_cookies(resp)
@@ -201,7 +451,7 @@ def token_check_blacklist(decrypted_token):
     Check if a token is blacklisted.
     """
     jti = decrypted_token["jti"]
-    return RevokedTokenModel.is_jti_blacklisted(jti)
+    return GLOBALS["revoked_tokens"].is_revoked(jti)
 
 
 @jwt.expired_token_loader